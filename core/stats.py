@@ -1,5 +1,8 @@
 import os
 
+from storage.buffer_pool import get_buffer_pool
+from storage.segment_cache import get_segment_cache
+
 def get_basic_stats(schema):
     stats = {}
     stats["total_tables"] = len(schema.tables)
@@ -15,7 +18,7 @@ def get_basic_stats(schema):
 
         # Get number of rows (live, OLTP)
         try:
-            num_rows = len(table.storage.get_row_store(table.name).get_rows())
+            num_rows = table.storage.get_row_store(table.name).row_count()
         except Exception:
             num_rows = None  # or 0
 
@@ -28,4 +31,6 @@ def get_basic_stats(schema):
             "has_pk": bool(table.pk_column),
         }
 
+    stats["buffer_pool"] = get_buffer_pool().stats()
+    stats["segment_cache"] = get_segment_cache().stats()
     return stats
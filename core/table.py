@@ -1,8 +1,10 @@
 import os
 from core.column import Column
 from indexing.bplustree import BplusTree
-from storage.block_manager import BlockManager
 from storage.manager import StorageManager
+from storage.page_allocator import has_page_header
+from storage.predicate import check_predicates
+from storage.row_packer import TYPE_ANY, TYPE_BOOL, TYPE_FLOAT, TYPE_INT, TYPE_TEXT, dtype_to_type_code
 
 class Table:
     def __init__(self, name: str, storage: StorageManager, columns: list[Column] = []):
@@ -12,44 +14,54 @@ class Table:
         self.pk_column = next((col for col in self.columns if "PK" in col.constraints), None)
         self.rows = []
         self.auto_increment_col = next((col for col in self.columns if col.auto_increment), None)
+        # Open the row store with this table's columns so rows are encoded with their dtypes
+        self.storage.get_row_store(self.name, columns=self.columns,
+                                   pk=self.pk_column.name if self.pk_column else None)
         self._load_next_increment()
         self.indexes = {}
         
-        # Use block-based index files (.idx)
+        # Use block-based index files (.idx); the root node is kept in the file's header page
         os.makedirs('data/indexes', exist_ok=True)
         for col in columns:
             if col.is_unique():
                 idx_path = f"data/indexes/{self.name}_{col.name}.idx"
-                block_manager = BlockManager(idx_path)
-                # Root node id persistence (optional: could be in a metadata file)
-                root_meta_path = f"{idx_path}.meta"
-                root_node_id = None
-                if os.path.exists(root_meta_path):
-                    with open(root_meta_path, 'r') as f:
-                        root_node_id = f.read().strip()
-                bptree = BplusTree(order=32, block_manager=block_manager, root_node_id=root_node_id)
-                self.indexes[col.name] = bptree
-                # Always persist root node id for recovery
-                with open(root_meta_path, 'w') as f:
-                    f.write(bptree.root_node_id)
+                if not has_page_header(idx_path):
+                    self._rebuild_old_index(col.name, idx_path)
+                    continue
+                block_manager = self.storage.open_block_file(idx_path)
+                self.indexes[col.name] = BplusTree(order=32, block_manager=block_manager)
+
+    def _rebuild_old_index(self, col_name, idx_path):
+        """
+        Replace an index file written before the page header (pickled nodes at hashed block numbers,
+        root id in a .meta file) with one bulk loaded from the table's rows.
+        """
+        pairs = [(row[col_name], idx) for idx, row in enumerate(self.select_all([col_name]))
+                 if row[col_name] is not None]
+        pairs.sort()
+        block_manager = self.storage.open_block_file(idx_path)
+        block_manager.truncate(0)
+        self.indexes[col_name] = BplusTree.bulk_load(pairs, order=32, block_manager=block_manager)
+        block_manager.sync()
+        # The root now lives in the header page
+        if os.path.exists(f"{idx_path}.meta"):
+            os.remove(f"{idx_path}.meta")
 
     def _load_next_increment(self):
         self.next_increment = 1
         if self.auto_increment_col:
-            rows = self.storage.get_row_store(self.name).get_rows()
-            if rows:
-                self.next_increment = max(row[self.auto_increment_col.name] for row in rows) + 1
+            name = self.auto_increment_col.name
+            rows = self.storage.get_row_store(self.name).scan([name])
+            # Migrated rows keep their ids in the column store, which an empty row store can't show
+            highest = [row[name] for row in rows if row[name] is not None]
+            migrated = self.storage.get_column_store(self.name).max_value(name)
+            if migrated is not None:
+                highest.append(migrated)
+            self.next_increment = max(highest, default=0) + 1
 
     def add_column(self, column: Column):
         self.columns.append(column)
 
-    def _persist_index_root_ids(self):
-        for col_name, bptree in self.indexes.items():
-            idx_path = f"data/indexes/{self.name}_{col_name}.idx"
-            meta_path = f"{idx_path}.meta"
-            with open(meta_path, 'w') as f:
-                f.write(bptree.root_node_id)
-
     def insert(self, row_dict: dict):
         for col in self.columns:
             val = row_dict.get(col.name)
@@ -72,7 +84,6 @@ class Table:
         # Update indexes (persist dirty nodes only)
         for col_name, bptree in self.indexes.items():
             bptree.insert(row_dict[col_name], row_idx)
-        self._persist_index_root_ids()
 
     def bulk_insert(self, rows: list[dict], bulk_mode=False):
         # 1. Check for duplicates *in the batch only* if bulk_mode, otherwise check both in tree and batch
@@ -126,9 +137,9 @@ class Table:
             # Gather all key -> rowid pairs
             pairs = [(row[col_name], idx) for idx, row in enumerate(self.rows)]
             pairs.sort()  # Required by B+Tree bulk load (by key)
-            # Build a new block_manager for this index
-            idx_path = f"data/indexes/{self.name}_{col_name}_bptree.json"
-            block_manager = BlockManager(idx_path)
+            # Bulk load rewrites the index file from scratch
+            idx_path = f"data/indexes/{self.name}_{col_name}.idx"
+            block_manager = self.storage.open_block_file(idx_path)
             # Build the new B+Tree
             new_bptree = BplusTree.bulk_load(pairs, order=32, block_manager=block_manager)
             self.indexes[col_name] = new_bptree  # Swap in-place!
@@ -137,22 +148,63 @@ class Table:
     def flush(self):
         self.storage.flush_table(self.name)
 
+    def set_cluster_key(self, column):
+        """Sort this table's column segments by column, so range predicates on it prune well."""
+        if column is not None and all(col.name != column for col in self.columns):
+            raise ValueError(f"Unknown column '{column}' for table '{self.name}'")
+        self.storage.get_column_store(self.name).set_cluster_key(column)
+
     def delete_rows(self, column, value):
         row_store = self.storage.get_row_store(self.name)
-        rows = row_store.get_rows()
-        initial_len = len(rows)
-        rows_to_keep = [row for row in rows if str(row.get(column)) != value]
-        n_deleted = initial_len - len(rows_to_keep)
-        row_store.clear()
-        for row in rows_to_keep:
-            row_store.insert_row(row)
-        self._persist_index_root_ids()
-        return n_deleted
-
-    def select_all(self):
-        oltp_rows = self.storage.get_row_store(self.name).get_rows()
-        olap_rows = self.storage.get_column_store(self.name).load_segments()
-        return oltp_rows + olap_rows
+        col_store = self.storage.get_column_store(self.name)
+        # Rows migrated to the column store are deleted there; the tier lock keeps a migration
+        # from moving a row between the two deletes, where neither would see it
+        with self.storage.tier_lock(self.name).reading():
+            if self.pk_column and column == self.pk_column.name:
+                # Point delete through the row store's primary-key map
+                keys = [key for key in (value, self._coerce_key(value)) if key in row_store.pk_index][:1]
+                deleted = sum(1 for key in keys if row_store.delete_row(key))
+                return deleted + col_store.log_delete_many({value, self._coerce_key(value)})
+            # Delete by row id: the table may have no primary key, or repeat one
+            matches = [(row_id, row.get(row_store.pk)) for row_id, row in row_store.get_rows_with_ids()
+                       if str(row.get(column)) == value]
+            deleted = len(matches) - len(row_store.delete_row_ids(matches))
+            return deleted + col_store.delete_where([(column, "=", self.coerce_value(column, value))])
+
+    def _coerce_key(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return value
+
+    def coerce_value(self, column, value):
+        """Convert a query literal to the column's dtype so it compares with stored values."""
+        col = next((c for c in self.columns if c.name == column), None)
+        type_code = dtype_to_type_code(col.dtype) if col else TYPE_ANY
+        if type_code == TYPE_TEXT:
+            return value
+        if type_code == TYPE_BOOL:
+            return value == "True" if value in ("True", "False") else value
+        # Untyped columns take the literal's own type
+        parsers = {TYPE_INT: (int,), TYPE_FLOAT: (float,)}.get(type_code, (int, float))
+        for parse in parsers:
+            try:
+                return parse(value)
+            except ValueError:
+                pass
+        return value
+
+    def select_all(self, columns=None, where=None):
+        """
+        Stream every row: row-store blocks first, then column-store segments. columns projects;
+        where is a list of (column, op, value) predicates, used to skip segments by their zone maps.
+        """
+        if where:
+            check_predicates(where)
+        # A migration's handoff waits for the scan, so no row shows up in both tiers or neither
+        with self.storage.tier_lock(self.name).reading():
+            yield from self.storage.get_row_store(self.name).scan(columns, where)
+            yield from self.storage.get_column_store(self.name).scan(columns, where)
 
     def __repr__(self):
         return f"<Table {self.name} Columns={self.columns}>"
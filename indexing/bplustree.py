@@ -1,8 +1,7 @@
 import pickle
-import uuid
-import os
 
-from storage.block_manager import BlockManager
+from storage.block_manager import BLOCK_SIZE
+from storage.page_allocator import PageAllocator
 
 class Node:
     def __init__(self, order, leaf=False, node_id=None):
@@ -12,21 +11,31 @@ class Node:
         self.values = []       # Only used for leaves
         self.children = []     # List of CHILD NODE IDS, not objects!
         self.next = None       # node_id of next leaf (not object)
-        self.node_id = node_id or str(uuid.uuid4())
+        self.node_id = node_id # block number of the node in the index file
         self.dirty = True
 
 class BplusTree:
     def __init__(self, order=4, block_manager=None, root_node_id=None):
         self.order = order
         self.block_manager = block_manager
+        # Block 0 of the index file is a header with the root and the free list
+        self.pages = PageAllocator(block_manager)
+        root_node_id = root_node_id or self.pages.root
         if root_node_id:
             self.root_node_id = root_node_id
             self.root = self.load_node(root_node_id)
         else:
-            root = Node(order, leaf=True)
+            root = self._new_node(leaf=True)
             self.save_node(root)
-            self.root = root
-            self.root_node_id = root.node_id
+            self._set_root(root)
+
+    def _new_node(self, leaf):
+        return Node(self.order, leaf=leaf, node_id=self.pages.allocate())
+
+    def _set_root(self, node):
+        self.root = node
+        self.root_node_id = node.node_id
+        self.pages.set_root(node.node_id)
 
     def _find_index(self, keys, key):
         for i, k in enumerate(keys):
@@ -42,7 +51,8 @@ class BplusTree:
             node = self.load_node(child_id)
         return node
 
-    def save_node(self, node):
+    @staticmethod
+    def _write_node(block_manager, node):
         data = pickle.dumps({
             "order": node.order,
             "leaf": node.leaf,
@@ -52,31 +62,34 @@ class BplusTree:
             "next": node.next,
             "node_id": node.node_id
         })
-        block_id = int(uuid.UUID(node.node_id).int % 1_000_000)
-        self.block_manager.write_block(block_id, data[:8192])
+        if len(data) > BLOCK_SIZE:
+            raise ValueError(f"B+Tree node {node.node_id} is {len(data)} bytes, larger than a block; use a smaller order")
+        block_manager.write_block(node.node_id, data)
         node.dirty = False
 
+    def save_node(self, node):
+        self._write_node(self.block_manager, node)
+
     def load_node(self, node_id):
-        block_id = int(uuid.UUID(node_id).int % 1_000_000)
-        data = self.block_manager.read_block(block_id)
+        data = self.block_manager.read_block(node_id)
         d = pickle.loads(data)
         node = Node(d["order"], d["leaf"], node_id=d["node_id"])
         node.keys = d["keys"]
         node.values = d["values"]
         node.children = d["children"]
         node.next = d["next"]
+        node.dirty = False
         return node
 
     def insert(self, key, value):
         root = self.root
         if len(root.keys) == self.order - 1:
             # Create new root
-            new_root = Node(self.order, leaf=False)
+            new_root = self._new_node(leaf=False)
             new_root.children = [root.node_id]
             self._split_child(new_root, 0)
-            self.root = new_root
-            self.root_node_id = new_root.node_id
             self.save_node(new_root)
+            self._set_root(new_root)
         self._insert_non_full(self.root, key, value)
 
     def _insert_non_full(self, node, key, value):
@@ -108,27 +121,27 @@ class BplusTree:
         mid = order // 2
         split_key = node.keys[mid]
 
-        left = Node(order, leaf=node.leaf)
-        right = Node(order, leaf=node.leaf)
+        # The split node keeps its block as the left half; only the right half is allocated
+        left = node
+        right = self._new_node(leaf=node.leaf)
 
-        left.keys = node.keys[:mid]
         right.keys = node.keys[mid + (0 if node.leaf else 1):]
+        left.keys = node.keys[:mid]
 
         if node.leaf:
-            left.values = node.values[:mid]
             right.values = node.values[mid:]
-            left.next = right.node_id
+            left.values = node.values[:mid]
             right.next = node.next
+            left.next = right.node_id
         else:
-            left.children = node.children[:mid + 1]
             right.children = node.children[mid + 1:]
+            left.children = node.children[:mid + 1]
 
         # Save new nodes before referencing them by ID
-        self.save_node(left)
         self.save_node(right)
+        self.save_node(left)
 
         parent.keys.insert(idx, split_key)
-        parent.children[idx] = left.node_id
         parent.children.insert(idx + 1, right.node_id)
         parent.dirty = True
 
@@ -188,9 +201,15 @@ class BplusTree:
         - items: list of (key, value) tuples (MUST BE SORTED and unique)
         - order: maximum number of keys per node
         - block_manager: BlockManager instance for disk writes
+        Existing pages in the file are discarded, so nodes are laid out sequentially
+        (leaves first, then each internal level).
         Returns: new BplusTree instance
         """
         assert block_manager is not None, "Bulk load requires a BlockManager"
+        pages = PageAllocator(block_manager)
+        pages.reset()
+        if not items:
+            return cls(order=order, block_manager=block_manager)
 
         # 1. Create leaves
         leaf_nodes = []
@@ -200,7 +219,7 @@ class BplusTree:
             chunk = items[i:i + node_size]
             keys = [k for k, v in chunk]
             values = [v for k, v in chunk]
-            node = Node(order, leaf=True)
+            node = Node(order, leaf=True, node_id=pages.allocate())
             node.keys = keys
             node.values = values
             leaf_nodes.append(node)
@@ -212,18 +231,7 @@ class BplusTree:
 
         # 2. Write leaves to disk
         for node in leaf_nodes:
-            node.dirty = False
-            block_id = int(uuid.UUID(node.node_id).int % 1_000_000)
-            data = pickle.dumps({
-                "order": node.order,
-                "leaf": node.leaf,
-                "keys": node.keys,
-                "values": node.values,
-                "children": node.children,
-                "next": node.next,
-                "node_id": node.node_id
-            })
-            block_manager.write_block(block_id, data[:8192])
+            cls._write_node(block_manager, node)
 
         # 3. Build internal levels upward
         current_level = leaf_nodes
@@ -233,46 +241,19 @@ class BplusTree:
                 chunk = current_level[i:i + node_size + 1]
                 keys = [node.keys[0] for node in chunk[1:]]  # separator keys
                 children = [node.node_id for node in chunk]
-                parent = Node(order, leaf=False)
+                parent = Node(order, leaf=False, node_id=pages.allocate())
                 parent.keys = keys
                 parent.children = children
 
                 # Write parent to disk
-                parent.dirty = False
-                block_id = int(uuid.UUID(parent.node_id).int % 1_000_000)
-                data = pickle.dumps({
-                    "order": parent.order,
-                    "leaf": parent.leaf,
-                    "keys": parent.keys,
-                    "values": parent.values,
-                    "children": parent.children,
-                    "next": parent.next,
-                    "node_id": parent.node_id
-                })
-                block_manager.write_block(block_id, data[:8192])
+                cls._write_node(block_manager, parent)
                 next_level.append(parent)
             current_level = next_level
 
         # 4. The only node left is the root
         root = current_level[0]
-        tree = cls(order=order, block_manager=block_manager)
-        tree.root = root
-        tree.root_node_id = root.node_id
-
-        # Write root to disk
-        block_id = int(uuid.UUID(root.node_id).int % 1_000_000)
-        data = pickle.dumps({
-            "order": root.order,
-            "leaf": root.leaf,
-            "keys": root.keys,
-            "values": root.values,
-            "children": root.children,
-            "next": root.next,
-            "node_id": root.node_id
-        })
-        block_manager.write_block(block_id, data[:8192])
-
-        return tree
+        pages.set_root(root.node_id)
+        return cls(order=order, block_manager=block_manager)
 
 
     def __repr__(self):
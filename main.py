@@ -10,31 +10,39 @@ from query.parser import parse_command
 from schema.schema import Schema
 from storage.manager import StorageManager
 from jobs.queue import Job, JobQueue
-from storage.column_store import ColumnStore
+from storage.tiering import TieringPolicy
 
-colstore = ColumnStore("users", pk="id")
 job_queue = JobQueue()
 job_queue.start()
 
 COMPACTION_INTERVAL = 3600  # seconds
+TIERING_CHECK_INTERVAL = 30  # seconds; writes check the row-count and byte thresholds themselves
+RECOVERY_PROCESSES = True  # redo each table's WAL in a worker process at startup
 
-def schedule_periodic_compaction(job_queue, schema):
+def schedule_periodic_compaction(job_queue, schema, storage_manager):
     """Schedules periodic compaction jobs for all tables."""
     while True:
         for table_name, table in schema.tables.items():
             # If your Table class knows its PK, use table.pk
             pk = table.pk if hasattr(table, 'pk') else "id"
-            ""
-            colstore = ColumnStore(table_name, pk=pk)
+            # The manager's instance: it owns the table's manifest and segment ids
+            colstore = storage_manager.get_column_store(table_name, pk=pk)
             job_queue.enqueue(Job(colstore.compact, description=f"Periodic compaction for {table_name}"))
         time.sleep(COMPACTION_INTERVAL)
 
+def schedule_tiering_checks(storage_manager):
+    """Periodically lets the tiering policy migrate tables whose oldest rows have aged out."""
+    while True:
+        time.sleep(TIERING_CHECK_INTERVAL)
+        storage_manager.check_tiering()
+
 def start_api():
     uvicorn.run(app, host="127.0.0.1", port=8000, log_level="info")
 
 def main():
 
-    storage_manager = StorageManager()
+    storage_manager = StorageManager(tiering=TieringPolicy(), job_queue=job_queue,
+                                     recovery_processes=RECOVERY_PROCESSES)
     schema = Schema()
     schema.load_schema(storage_manager)  # Discover tables on startup
 
@@ -51,7 +59,9 @@ def main():
 
     print("FreshDB > Type your SQL-like commands.")
     # 3. Schedule periodic compaction for all tables (in a background thread)
-    threading.Thread(target=schedule_periodic_compaction, args=(job_queue, schema), daemon=True).start()
+    threading.Thread(target=schedule_periodic_compaction, args=(job_queue, schema, storage_manager), daemon=True).start()
+    # 4. Move aged row-store data to the column store (in the job queue)
+    threading.Thread(target=schedule_tiering_checks, args=(storage_manager,), daemon=True).start()
 
     while True:
         try:
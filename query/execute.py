@@ -25,11 +25,11 @@ def execute_query(parsed:QueryType, schema, storage_manager):
         if not table:
             print("Table does not exist.")
             return
+        where = None
         if parsed.conditions:
             col, val = parsed.conditions
-            results = [row for row in table.select_all() if str(row.get(col)) == val]
-        else:
-            results = table.select_all()
+            where = [(col, "=", table.coerce_value(col, val))]
+        results = table.select_all(parsed.columns or None, where)
         for r in results:
             print(r)
     elif cmd_type == QueryTypes.DROP:
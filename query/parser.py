@@ -32,12 +32,16 @@ def parse_command(command: str):
         
         elif cmd == QueryTypes.SELECT.value:
             table_name = tokens[tokens.index("FROM") + 1]
+            # SELECT a, b FROM ... lists the columns to read; * (or nothing) means all of them
+            columns = [c.strip() for c in " ".join(tokens[1:tokens.index("FROM")]).split(",") if c.strip()]
+            if columns == ["*"]:
+                columns = []
             condition = None
             if "WHERE" in tokens:
                 col = tokens[tokens.index("WHERE") + 1]
                 val = tokens[-1].strip(";")
                 condition = (col, val.strip("'\""))
-            return QueryType(type=QueryTypes.SELECT, table=table_name, conditions=condition)
+            return QueryType(type=QueryTypes.SELECT, table=table_name, columns=columns, conditions=condition)
         
         elif cmd == QueryTypes.DROP.value and tokens[1].upper() == "TABLE":
             name = tokens[2]
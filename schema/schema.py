@@ -11,9 +11,7 @@ class Schema:
     def create_table(self, table_name, columns, storage_manager):
         if table_name in self.tables:
             raise ValueError(f"Table '{table_name}' already exists")
-        table = Table(table_name, storage_manager)
-        for col in columns:
-            table.add_column(col)
+        table = Table(table_name, storage_manager, columns=list(columns))
         self.tables[table_name] = table
         self._save_schema()
 
@@ -34,9 +32,14 @@ class Schema:
         if os.path.exists(self.schema_path):
             with open(self.schema_path, "r") as f:
                 meta = json.load(f)
-            for name, info in meta.items():
+            columns = {name: [Column.from_dict(c) for c in info["columns"]] for name, info in meta.items()}
+            # Recover every table's row store in parallel before the Table objects attach to them
+            storage_manager.recover_tables({
+                name: {"columns": cols, "pk": next((c.name for c in cols if "PK" in c.constraints), None)}
+                for name, cols in columns.items()})
+            for name, cols in columns.items():
                 # Restore Table objects with columns...
-                self.tables[name] = Table(name, storage_manager, columns=[Column.from_dict(c) for c in info["columns"]])
+                self.tables[name] = Table(name, storage_manager, columns=cols)
 
     def get_table(self, table_name):
         return self.tables.get(table_name)
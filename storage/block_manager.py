@@ -1,34 +1,105 @@
+import mmap
 import os
 
-BLOCK_SIZE = 8192
+from storage.buffer_pool import BLOCK_SIZE, Frame, get_buffer_pool
 
 class BlockManager:
-    def __init__(self, path):
+    """
+    Fixed-size block file. By default pages go through the shared buffer pool.
+    With use_mmap=True reads are zero-copy memoryview slices of a read-only mapping of
+    the file (the OS page cache does the caching) and writes go straight to the file,
+    refreshing the pool's copy of the page if it has one.
+    A returned memoryview reflects later writes to the same block; copy it if you keep it.
+    Files default to write-through (see PagedFile); pass write_through=False only for
+    files a WAL can redo, such as a row store's heap file.
+    """
+    def __init__(self, path, buffer_pool=None, use_mmap=False, write_through=True):
         self.path = path
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        if not os.path.exists(path):
-            with open(path, "wb") as f:
-                pass  # create file
+        self.buffer_pool = buffer_pool or get_buffer_pool()
+        self.file = self.buffer_pool.open_file(path, write_through=write_through)
+        self.use_mmap = use_mmap
+        self._mmap = None
+        self._mapped_blocks = 0
+        if use_mmap:
+            # Pages cached by a pooled BlockManager on the same file must hit disk first
+            self.buffer_pool.flush(self.file)
 
     def num_blocks(self):
-        return os.path.getsize(self.path) // BLOCK_SIZE
+        return self.file.num_blocks
 
     def read_block(self, block_num):
-        with open(self.path, "rb") as f:
-            f.seek(block_num * BLOCK_SIZE)
-            return f.read(BLOCK_SIZE)
+        if self.use_mmap:
+            return self._read_mapped(block_num)
+        frame = self.buffer_pool.pin(self.file, block_num)
+        try:
+            return bytes(frame.data)
+        finally:
+            self.buffer_pool.unpin(frame)
+
+    def _read_mapped(self, block_num):
+        if block_num >= self.file.num_blocks:
+            return bytes(BLOCK_SIZE)
+        if block_num >= self._mapped_blocks:
+            self._remap()
+        start = block_num * BLOCK_SIZE
+        return memoryview(self._mmap)[start:start + BLOCK_SIZE]
+
+    def _remap(self):
+        # The mapping only grows when a read lands past its end, so a run of
+        # allocate_block calls costs one remap. Views into the old mapping keep it alive.
+        self.file.handle.flush()
+        self._mapped_blocks = self.file.num_blocks
+        self._mmap = mmap.mmap(self.file.handle.fileno(), self._mapped_blocks * BLOCK_SIZE, access=mmap.ACCESS_READ)
 
     def write_block(self, block_num, data):
-        # Ensure the file exists before opening in 'r+b'
-        if not os.path.exists(self.path):
-            with open(self.path, "wb") as f:
-                pass
-        with open(self.path, "r+b") as f:
-            f.seek(block_num * BLOCK_SIZE)
-            f.write(data)
+        if len(data) > BLOCK_SIZE:
+            raise ValueError(f"Block data is {len(data)} bytes, larger than BLOCK_SIZE ({BLOCK_SIZE})")
+        if self.use_mmap:
+            self.buffer_pool.write_page(self.file, block_num, bytes(data).ljust(BLOCK_SIZE, b"\x00"))
+            return
+        frame = self.buffer_pool.pin(self.file, block_num, load=False)
+        try:
+            frame.data[:len(data)] = data
+            frame.data[len(data):] = bytes(BLOCK_SIZE - len(data))  # no stale tail from the old page
+        finally:
+            self.buffer_pool.unpin(frame, dirty=True)
+        self.file.num_blocks = max(self.file.num_blocks, block_num + 1)
 
     def allocate_block(self):
-        block_num = self.num_blocks()
-        with open(self.path, "ab") as f:
-            f.write(b"\x00" * BLOCK_SIZE)
+        with self.buffer_pool.lock:
+            block_num = self.file.num_blocks
+            self.write_block(block_num, b"")
         return block_num
+
+    def truncate(self, num_blocks=0):
+        """Shrink the file to its first num_blocks blocks."""
+        self._mmap = None  # never read through a mapping that extends past EOF
+        self._mapped_blocks = 0
+        self.buffer_pool.truncate_file(self.file, num_blocks)
+
+    def pin_block(self, block_num):
+        """Pin a page and return its frame; frame.data can be modified in place until unpin_block."""
+        if self.use_mmap:
+            return Frame(self.file, block_num, bytearray(self.read_block(block_num)))
+        return self.buffer_pool.pin(self.file, block_num)
+
+    def unpin_block(self, frame, dirty=False):
+        if self.use_mmap:
+            if dirty:
+                self.write_block(frame.block_num, frame.data)
+            return
+        self.buffer_pool.unpin(frame, dirty)
+
+    def flush(self):
+        self.buffer_pool.flush(self.file)
+
+    def sync(self):
+        self.flush()
+        self.file.sync()
+
+    def close(self, flush=True):
+        """Release the shared file handle. With flush=False dirty pages are dropped (file about to be removed)."""
+        self._mmap = None
+        self._mapped_blocks = 0
+        self.buffer_pool.close_file(self.file, flush=flush)
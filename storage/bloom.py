@@ -0,0 +1,56 @@
+import hashlib
+import math
+import struct
+
+DEFAULT_BITS_PER_KEY = 10  # with 7 hashes: about a 1% false-positive rate
+# Serialized filter: bit count, hash count; then the bits
+HEADER = struct.Struct("<IB")
+
+
+def _key_bytes(value):
+    # Keys that compare equal must hash equal: 3, 3.0 and True/1 share a form
+    if isinstance(value, (bool, float)) and float(value).is_integer():
+        value = int(value)
+    return repr(value).encode("utf-8")
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over arbitrary scalar keys, with hashing stable across processes."""
+    def __init__(self, num_bits, num_hashes, bits=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray(bits) if bits is not None else bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def for_keys(cls, keys, bits_per_key=DEFAULT_BITS_PER_KEY):
+        keys = [k for k in keys if k is not None]
+        num_bits = max(64, len(keys) * bits_per_key)
+        num_hashes = max(1, min(16, round(bits_per_key * math.log(2))))
+        bloom = cls(num_bits, num_hashes)
+        for key in keys:
+            bloom.add(key)
+        return bloom
+
+    def _positions(self, key):
+        # Double hashing: k probes from two 64-bit halves of one digest
+        digest = hashlib.blake2b(_key_bytes(key), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def might_contain(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def to_bytes(self):
+        return HEADER.pack(self.num_bits, self.num_hashes) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        """Return (filter, next offset)."""
+        num_bits, num_hashes = HEADER.unpack_from(data, offset)
+        start = offset + HEADER.size
+        end = start + (num_bits + 7) // 8
+        return cls(num_bits, num_hashes, data[start:end]), end
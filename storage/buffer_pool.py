@@ -0,0 +1,218 @@
+import atexit
+import os
+import threading
+from collections import OrderedDict
+
+BLOCK_SIZE = 8192
+DEFAULT_POOL_PAGES = 1024  # 8 MB of cached pages
+
+
+class PagedFile:
+    """
+    An open block file. Every BlockManager on the same path shares one
+    PagedFile, so they also share the handle, the block count and the cached pages.
+    A write_through file has no WAL to redo it from, so its pages reach the OS as
+    soon as they are unpinned dirty instead of waiting for eviction or a flush.
+    """
+    def __init__(self, path, write_through=False):
+        self.path = path
+        self.handle = open(path, "r+b")
+        self.num_blocks = os.path.getsize(path) // BLOCK_SIZE
+        self.write_through = write_through
+
+    def read_page(self, block_num):
+        self.handle.seek(block_num * BLOCK_SIZE)
+        data = self.handle.read(BLOCK_SIZE)
+        if len(data) < BLOCK_SIZE:
+            data = data.ljust(BLOCK_SIZE, b"\x00")
+        return data
+
+    def write_page(self, block_num, data):
+        self.handle.seek(block_num * BLOCK_SIZE)
+        self.handle.write(data)
+
+    def truncate(self, num_blocks):
+        self.handle.flush()
+        self.handle.truncate(num_blocks * BLOCK_SIZE)
+        self.num_blocks = num_blocks
+
+    def sync(self):
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+
+    def close(self):
+        if not self.handle.closed:
+            self.handle.close()
+
+
+class Frame:
+    __slots__ = ("file", "block_num", "data", "pin_count", "dirty")
+
+    def __init__(self, file, block_num, data):
+        self.file = file
+        self.block_num = block_num
+        self.data = data          # bytearray of BLOCK_SIZE bytes
+        self.pin_count = 0
+        self.dirty = False
+
+
+class BufferPool:
+    """
+    Fixed-size LRU cache of 8 KB pages with pin/unpin and dirty-page write-back.
+    Pinned pages are never evicted; dirty pages are written when evicted or flushed,
+    or, for write_through files, when their last pin is released.
+    """
+    def __init__(self, capacity=DEFAULT_POOL_PAGES):
+        self.capacity = capacity
+        self.frames = OrderedDict()  # (PagedFile, block_num) -> Frame, LRU first
+        self.files = {}              # abs path -> PagedFile
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writebacks = 0
+
+    def open_file(self, path, write_through=False):
+        key = os.path.abspath(path)
+        with self.lock:
+            paged_file = self.files.get(key)
+            if paged_file is not None and not os.path.exists(key):
+                # File was removed behind our back: its cached pages are garbage
+                self._forget(paged_file)
+                paged_file = None
+            if paged_file is None:
+                if not os.path.exists(key):
+                    with open(key, "wb"):
+                        pass  # create file
+                paged_file = PagedFile(key)
+                self.files[key] = paged_file
+            # One opener that needs write-through is enough for the whole file
+            paged_file.write_through = paged_file.write_through or write_through
+            return paged_file
+
+    def close_file(self, paged_file, flush=True):
+        with self.lock:
+            if flush:
+                self.flush(paged_file)
+            self._forget(paged_file)
+
+    def truncate_file(self, paged_file, num_blocks):
+        """Shrink a file to num_blocks, discarding cached pages past the new end."""
+        with self.lock:
+            for key in [k for k in self.frames if k[0] is paged_file and k[1] >= num_blocks]:
+                if self.frames[key].pin_count:
+                    raise RuntimeError(f"Cannot truncate {paged_file.path}: page {key[1]} is pinned")
+                del self.frames[key]
+            paged_file.truncate(num_blocks)
+
+    def _forget(self, paged_file):
+        for key in [k for k in self.frames if k[0] is paged_file]:
+            del self.frames[key]
+        self.files.pop(paged_file.path, None)
+        paged_file.close()
+
+    def pin(self, paged_file, block_num, load=True):
+        """
+        Return the frame for a page and pin it. With load=False a missing page
+        starts zeroed instead of being read (the caller is about to overwrite it).
+        """
+        key = (paged_file, block_num)
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.hits += 1
+                self.frames.move_to_end(key)
+            else:
+                self.misses += 1
+                self._make_room()
+                if load and block_num < paged_file.num_blocks:
+                    data = bytearray(paged_file.read_page(block_num))
+                else:
+                    data = bytearray(BLOCK_SIZE)
+                frame = Frame(paged_file, block_num, data)
+                self.frames[key] = frame
+            frame.pin_count += 1
+            return frame
+
+    def unpin(self, frame, dirty=False):
+        with self.lock:
+            frame.pin_count -= 1
+            if dirty:
+                frame.dirty = True
+            if frame.dirty and frame.file.write_through and frame.pin_count == 0:
+                frame.file.write_page(frame.block_num, frame.data)
+                frame.file.handle.flush()
+                frame.dirty = False
+                self.writebacks += 1
+
+    def write_page(self, paged_file, block_num, data):
+        """
+        Write a whole page straight to the file, for writers that bypass the pool (mmap);
+        a cached copy is refreshed so it is neither read nor written back stale.
+        """
+        with self.lock:
+            frame = self.frames.get((paged_file, block_num))
+            if frame is not None:
+                frame.data[:] = data
+                frame.dirty = False
+            paged_file.write_page(block_num, data)
+            paged_file.handle.flush()
+            paged_file.num_blocks = max(paged_file.num_blocks, block_num + 1)
+
+    def _make_room(self):
+        while len(self.frames) >= self.capacity:
+            for key, frame in self.frames.items():
+                if frame.pin_count == 0:
+                    break
+            else:
+                raise RuntimeError("Buffer pool exhausted: all pages are pinned")
+            if frame.dirty:
+                frame.file.write_page(frame.block_num, frame.data)
+                self.writebacks += 1
+            del self.frames[key]
+            self.evictions += 1
+
+    def flush(self, paged_file=None):
+        """Write back dirty pages (of one file, or of every file)."""
+        with self.lock:
+            for (owner, block_num), frame in sorted(self.frames.items(), key=lambda kv: kv[0][1]):
+                if frame.dirty and (paged_file is None or owner is paged_file):
+                    owner.write_page(block_num, frame.data)
+                    frame.dirty = False
+                    self.writebacks += 1
+            for owner in ([paged_file] if paged_file is not None else self.files.values()):
+                owner.handle.flush()
+
+    def checkpoint(self):
+        """Flush every dirty page and fsync every open file."""
+        with self.lock:
+            self.flush()
+            for paged_file in self.files.values():
+                paged_file.sync()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "capacity_pages": self.capacity,
+                "cached_pages": len(self.frames),
+                "dirty_pages": sum(1 for f in self.frames.values() if f.dirty),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "writebacks": self.writebacks,
+            }
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def get_buffer_pool():
+    """The process-wide pool shared by every BlockManager that doesn't bring its own."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = BufferPool()
+            atexit.register(_default_pool.flush)
+        return _default_pool
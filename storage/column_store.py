@@ -1,92 +1,832 @@
 import glob
+import heapq
 import os
 import json
+import re
+import shutil
+import threading
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from itertools import chain
 import zstandard as zstd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from storage.delete_bitmap import DELETES_EXT, DeleteBitmap, live_positions
+from storage.predicate import predicate_columns, range_may_match, row_matches
+from storage.segment import SEGMENT_EXT, SegmentReader, sort_order, sort_value, write_segment
+from storage.segment_cache import get_segment_cache
+
+MANIFEST_NAME = "manifest.json"   # the table's live segments, in order; replaced atomically
+DEFAULT_SEGMENT_ROWS = 1000       # rows per segment written by compaction
+DEFAULT_TOMBSTONE_RATIO = 0.2     # share of deleted rows that makes a segment worth rewriting
+
+# Table directory -> the ColumnStore open on it. The manifest, snapshots and segment ids live in
+# memory, so a second instance on the same directory would commit over the first one's segments.
+_open_stores = weakref.WeakValueDictionary()
+_open_stores_lock = threading.Lock()
+
+
+class SegmentSnapshot:
+    """One manifest version's segment list, with a count of the readers using it."""
+    __slots__ = ("version", "files", "refs")
+
+    def __init__(self, version, files):
+        self.version = version
+        self.files = files
+        self.refs = 0
+
 
 class ColumnStore:
-    def __init__(self, table_name, pk="id", segment_path='data/segments/'):
+    def __init__(self, table_name, pk="id", segment_path='data/segments/', cache=None, cluster_key=None):
         self.table_name = table_name
         self.pk = pk
+        self.cluster_key = None  # column segments are sorted by; kept in the manifest
+        self.migration = None    # row-store handoff in progress; see commit_migration
         self.segment_path = os.path.join(segment_path, table_name)
+        self._claim()
+        # Decompressed chunks are shared across stores unless a cache is passed in
+        self.cache = cache if cache is not None else get_segment_cache()
         os.makedirs(self.segment_path, exist_ok=True)
-        self.deletes_path = os.path.join(self.segment_path, "deletes.json")
-        self.deleted_keys = set()
-        self._load_delete_tombstones()
+        self.manifest_path = os.path.join(self.segment_path, MANIFEST_NAME)
+        self.deletes_path = os.path.join(self.segment_path, "deletes.json")  # pre-bitmap tombstones
+        self.bitmaps = {}  # segment path -> DeleteBitmap, loaded on first use
+        self.readers = {}  # segment path -> SegmentReader; segment files are immutable once written
+        self.lock = threading.RLock()
+        self.current = None   # SegmentSnapshot of the manifest in force
+        self.pinned = []      # older snapshots still referenced by a reader
+        self.retired = set()  # paths dropped from the manifest, deleted once no snapshot holds them
+        self._load_manifest()
+        self._migrate_delete_tombstones()
+        if cluster_key is not None and cluster_key != self.cluster_key:
+            self.set_cluster_key(cluster_key)
+
+    def _load_manifest(self):
+        """
+        Read the manifest, or build one from the directory for tables written before it existed.
+        Files the manifest doesn't list (output of a compaction or flush that crashed before its
+        manifest commit) are removed.
+        """
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+        else:
+            names = sorted((os.path.basename(f) for f in glob.glob(os.path.join(self.segment_path, "*.json.zst"))),
+                           key=_segment_number)
+            manifest = {"version": 0, "next_id": max(map(_segment_number, names), default=-1) + 1,
+                        "cluster_key": None, "migration": None,
+                        "segments": [self._segment_entry(os.path.join(self.segment_path, n)) for n in names]}
+            _atomic_write_json(self.manifest_path, manifest)
+        self.next_id = manifest["next_id"]
+        self.cluster_key = manifest["cluster_key"]
+        self.migration = manifest["migration"]
+        self.entries = {e["name"]: e for e in manifest["segments"]}
+        self.current = SegmentSnapshot(manifest["version"],
+                                       [os.path.join(self.segment_path, e["name"]) for e in manifest["segments"]])
+        listed = set(self.entries) | {n + DELETES_EXT for n in self.entries}
+        for fname in os.listdir(self.segment_path):
+            if fname.startswith("seg_") and fname not in listed:
+                os.remove(os.path.join(self.segment_path, fname))
+        for tmp in glob.glob(os.path.join(self.segment_path, "*.tmp")):
+            os.remove(tmp)
+
+    def _segment_entry(self, path):
+        """
+        Manifest entry for a segment file: name, rows, bytes and the min/max of the pk and of
+        the clustering key when known.
+        """
+        entry = {"name": os.path.basename(path), "bytes": os.path.getsize(path)}
+        if path.endswith(SEGMENT_EXT):
+            reader = self._reader(path)
+            entry["rows"] = reader.row_count
+            for prefix, column in (("pk", self.pk), ("cluster", self.cluster_key)):
+                _, lo, hi = reader.stats.get(column, (0, None, None))
+                if lo is not None and isinstance(lo, (int, float, str)) and prefix + "_min" not in entry:
+                    entry[prefix + "_min"], entry[prefix + "_max"] = lo, hi
+        else:
+            entry["rows"] = _read_segment(path, [self.pk])[0]
+        return entry
+
+    def _commit_manifest(self, replace, added, position=None):
+        """
+        Atomically install a new manifest: the segments in replace are dropped and added
+        (fsynced files) are inserted where the first replaced one was (at the end by default).
+        Readers holding the previous snapshot keep its files until they release it.
+        Caller holds self.lock.
+        """
+        for path in added:
+            _fsync(path)
+        files = [f for f in self.current.files if f not in replace]
+        if position is None:
+            position = len(files)
+        files[position:position] = added
+        entries = {**{k: v for k, v in self.entries.items() if os.path.join(self.segment_path, k) not in replace},
+                   **{os.path.basename(p): self._segment_entry(p) for p in added}}
+        manifest = {"version": self.current.version + 1, "next_id": self.next_id,
+                    "cluster_key": self.cluster_key,
+                    "migration": self.migration,
+                    "segments": [entries[os.path.basename(f)] for f in files]}
+        _atomic_write_json(self.manifest_path, manifest)
+        self.entries = entries
+        if self.current.refs:
+            self.pinned.append(self.current)
+        self.current = SegmentSnapshot(manifest["version"], files)
+        self.retired.update(replace)
+        self._collect()
 
-    def _load_delete_tombstones(self):
+    def set_cluster_key(self, column):
+        """
+        Sort segments by column (None for insertion order) from now on: flushes write rows in
+        key order and compaction merges sorted segments. Existing segments keep their order
+        until compacted; compact(full=True) reclusters the whole table.
+        """
+        with self.lock:
+            self.cluster_key = column
+            self.entries = {name: self._segment_entry(os.path.join(self.segment_path, name))
+                            for name in self.entries}
+            self._commit_manifest((), [])
+
+    def _may_hold(self, fname, where):
+        """
+        False if the manifest's pk or clustering-key bounds for the segment rule out the where
+        predicates, so its footer needn't even be read.
+        """
+        entry = self.entries.get(os.path.basename(fname), {})
+        for column, op, value in where or ():
+            for prefix, key in (("pk", self.pk), ("cluster", self.cluster_key)):
+                if column == key and prefix + "_min" in entry and \
+                        not range_may_match(op, value, entry[prefix + "_min"], entry[prefix + "_max"]):
+                    return False
+        return True
+
+    def _collect(self):
+        """Delete retired segment files that no live snapshot references any more. Caller holds self.lock."""
+        self.pinned = [snap for snap in self.pinned if snap.refs]
+        in_use = set(self.current.files).union(*(snap.files for snap in self.pinned))
+        for path in [p for p in self.retired if p not in in_use]:
+            for old in (path, path + DELETES_EXT):
+                if os.path.exists(old):
+                    os.remove(old)
+            self._forget_segment(path)
+            self.retired.discard(path)
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Pin the current set of segments: files in it are not deleted (by a compaction that
+        finishes meanwhile) until the block exits.
+        """
+        with self.lock:
+            snap = self.current
+            snap.refs += 1
+        try:
+            yield snap
+        finally:
+            with self.lock:
+                snap.refs -= 1
+                self._collect()
+
+    def _migrate_delete_tombstones(self):
+        """Turn a deletes.json key list from older versions into per-segment bitmaps."""
         if os.path.exists(self.deletes_path):
             with open(self.deletes_path, "r") as f:
-                self.deleted_keys = set(json.load(f))
+                keys = json.load(f)
+            self.log_delete_many(keys)
+            os.remove(self.deletes_path)
 
-    def flush(self, rows, segment_id=None):
+    def _new_segment_path(self, segment_id=None):
+        """Path for a new segment; ids come from the manifest so names never collide. Caller holds self.lock."""
+        if segment_id is None:
+            segment_id = f"seg_{self.next_id}{SEGMENT_EXT}"
+        elif segment_id in self.entries:
+            raise ValueError(f"Segment {segment_id} already exists in table {self.table_name}")
+        self.next_id = max(self.next_id, _segment_number(segment_id) + 1)
+        return os.path.join(self.segment_path, segment_id)
+
+    def flush(self, rows, segment_id=None, segment_rows=None):
+        """
+        Write rows as a new segment, or as segments of segment_rows each (see write_segments),
+        installed by one manifest commit.
+        """
         if not rows:
             return
-        cols = {}
-        for key in rows[0]:
-            cols[key] = [row[key] for row in rows]
+        written = self.write_segments(rows, segment_id, segment_rows)
+        with self.lock:
+            self._commit_manifest((), [path for path, _ in written])
+
+    def write_segments(self, rows, segment_id=None, segment_rows=None):
+        """
+        Write rows as new segments of segment_rows each (one by default), sorted by the clustering
+        key first so their key ranges don't overlap. They stay invisible until a manifest commit.
+        Returns [(path, indexes into rows in the segment's row order)].
+        """
+        size = segment_rows or len(rows)
+        order = list(range(len(rows)))
+        sort_key = self.cluster_key
+        if sort_key is not None:
+            key = sort_order(sort_key)
+            try:
+                order.sort(key=lambda i: key(rows[i]))
+            except TypeError:
+                sort_key = None  # mixed value types: insertion order
+        written = []
+        for start in range(0, len(order), size):
+            chunk = order[start:start + size]
+            with self.lock:
+                path = self._new_segment_path(segment_id if start == 0 else None)
+            write_segment(path, [rows[i] for i in chunk], bloom_columns=[self.pk], sort_key=sort_key)
+            self._forget_segment(path)
+            written.append((path, chunk))
+        return written
+
+    def commit_migration(self, paths, moved, dropped):
+        """
+        Install segments written from a row store's rows, recording in the same manifest commit
+        which rows they took over: moved, the ((block, slot), pk value) pairs the row store
+        still has to delete, and dropped, {segment path: positions} of rows deleted from the
+        row store while the segments were written. If the process dies before finish_migration,
+        StorageManager replays this record when it opens the table.
+        """
+        with self.lock:
+            self.migration = {"moved": [[block, slot, key] for (block, slot), key in moved],
+                              "dropped": {os.path.basename(path): positions
+                                          for path, positions in dropped.items() if positions}}
+            self._commit_manifest((), paths)
+            self.apply_migration_drops()
+
+    def apply_migration_drops(self):
+        """Delete the migration's dropped rows from its new segments (again: it is idempotent)."""
+        with self.lock:
+            for name, positions in (self.migration or {}).get("dropped", {}).items():
+                path = os.path.join(self.segment_path, name)
+                if path in self.current.files:
+                    self._bitmap(path).add(positions)
+
+    def finish_migration(self):
+        """Clear the migration record once the row store has deleted the moved rows."""
+        with self.lock:
+            if self.migration is not None:
+                self.migration = None
+                self._commit_manifest((), [])
 
-        segment_id = segment_id or f"seg_{len(os.listdir(self.segment_path))}.json.zst"
-        path = os.path.join(self.segment_path, segment_id)
+    def _write_segment(self, path, rows):
+        """Write rows as a segment, sorted by the clustering key when the values compare."""
+        sort_key = self.cluster_key
+        if sort_key is not None:
+            try:
+                rows = sorted(rows, key=sort_order(sort_key))
+            except TypeError:
+                sort_key = None  # mixed value types: the segment stays in insertion order
+        write_segment(path, rows, bloom_columns=[self.pk], sort_key=sort_key)
+        self._forget_segment(path)
 
-        compressor = zstd.ZstdCompressor()
-        with open(path, 'wb') as f:
-            f.write(compressor.compress(json.dumps(cols).encode('utf-8')))
+    def _forget_segment(self, path):
+        self.readers.pop(path, None)
+        self.bitmaps.pop(path, None)
+        self.cache.invalidate(os.path.abspath(path))
+
+    def _reader(self, fname):
+        """The segment's parsed footer, read once per file."""
+        reader = self.readers.get(fname)
+        if reader is None:
+            reader = self.readers[fname] = SegmentReader(fname, self.cache)
+        return reader
+
+    def _segment_files(self):
+        """Live segments in manifest order (oldest first); no directory listing involved."""
+        return list(self.current.files)
+
+    def _claim(self):
+        key = os.path.abspath(self.segment_path)
+        with _open_stores_lock:
+            if _open_stores.get(key) is not None:
+                raise RuntimeError(f"{self.segment_path} is already open in another ColumnStore; "
+                                   f"share that one (see StorageManager.get_column_store)")
+            _open_stores[key] = self
+
+    def close(self):
+        """Release the table directory so another ColumnStore may open it."""
+        key = os.path.abspath(self.segment_path)
+        with _open_stores_lock:
+            if _open_stores.get(key) is self:
+                del _open_stores[key]
+
+    def drop(self):
+        """Remove the table's segments and tombstones."""
+        self.close()
+        shutil.rmtree(self.segment_path, ignore_errors=True)
+        self.cache.invalidate_dir(os.path.abspath(self.segment_path))
+        self.bitmaps.clear()
+        self.readers.clear()
+        self.retired.clear()
+
+    def _bitmap(self, fname):
+        bitmap = self.bitmaps.get(fname)
+        if bitmap is None:
+            row_count = self.entries[os.path.basename(fname)]["rows"]
+            bitmap = self.bitmaps[fname] = DeleteBitmap(fname + DELETES_EXT, row_count)
+        return bitmap
+
+    def deleted_bits(self, fname):
+        """A snapshot of the segment's delete bitmap, or None if nothing in it was deleted."""
+        if fname not in self.bitmaps and not os.path.exists(fname + DELETES_EXT):
+            return None
+        return self._bitmap(fname).snapshot()
+
+    def _locate(self, fname, keys):
+        """Row positions in one segment whose pk is in keys."""
+        if not fname.endswith(SEGMENT_EXT):
+            _, col_data = _read_segment(fname, [self.pk])
+            return [i for i, key in enumerate(col_data[self.pk]) if key in keys]
+        reader = self._reader(fname)
+        if len(keys) == 1:
+            # Runs on the encoded pk chunk, after the zone maps had their say
+            return reader.matching_rows([(self.pk, "=", next(iter(keys)))])
+        try:
+            bounds = [(self.pk, ">=", min(keys)), (self.pk, "<=", max(keys))]
+        except TypeError:
+            bounds = []  # keys of mixed types
+        if not reader.may_match(bounds):
+            return []
+        return [i for i, key in enumerate(reader.read_columns([self.pk])[self.pk]) if key in keys]
+
+    def get(self, key_value):
+        """
+        Point lookup by primary key: the live row, or None. Newest segments are tried first,
+        and a segment's data is only read when its pk zone map and Bloom filter allow the key.
+        """
+        with self.snapshot() as snap:
+            for fname in reversed(snap.files):
+                positions = live_positions(self.deleted_bits(fname), 0, self._locate(fname, {key_value}))
+                if positions:
+                    if not fname.endswith(SEGMENT_EXT):
+                        _, col_data = _read_segment(fname)
+                        return {name: values[positions[0]] for name, values in col_data.items()}
+                    col_data = self._reader(fname).read_columns(None, positions[:1])
+                    return {name: values[0] for name, values in col_data.items()}
+        return None
+
+    def max_value(self, column):
+        """
+        Largest value of column across the segments, deleted rows included (None if it has none).
+        Typed segments answer from their zone maps; other segments read the column.
+        """
+        best = None
+        with self.snapshot() as snap:
+            for fname in snap.files:
+                if not fname.endswith(SEGMENT_EXT):
+                    values = _read_segment(fname, [column])[1][column]
+                elif column not in self._reader(fname).columns:
+                    continue
+                else:
+                    reader = self._reader(fname)
+                    hi = reader.stats.get(column, (0, None, None))[2]
+                    values = [hi] if hi is not None else reader.read_column(column)
+                for value in values:
+                    try:
+                        if value is not None and (best is None or value > best):
+                            best = value
+                    except TypeError:
+                        pass  # e.g. a text value in a numeric column
+        return best
 
     def log_delete(self, key_value):
-        self.deleted_keys.add(key_value)
-        with open(self.deletes_path, "w") as f:
-            json.dump(list(self.deleted_keys), f)
+        return self.log_delete_many([key_value])
 
-    def compact(self):
+    def log_delete_many(self, keys):
+        """
+        Delete the rows with these primary keys: each segment holding any of them gets its
+        row positions appended to its delete bitmap in one write. Returns the rows deleted.
+        """
+        keys = set(keys)
+        if not keys:
+            return 0
+        deleted = 0
+        # Under the lock so a compaction can tell whether it raced with us
+        with self.lock:
+            for fname in self._segment_files():
+                positions = self._locate(fname, keys)
+                if positions:
+                    deleted += self._bitmap(fname).add(positions)
+        return deleted
+
+    def delete_where(self, where):
+        """
+        Delete the rows satisfying every (column, op, value) predicate (see storage.predicate),
+        for deletes not by primary key. Returns the rows deleted.
+        """
+        deleted = 0
+        with self.lock:
+            for fname in self._segment_files():
+                if self._may_hold(fname, where):
+                    positions = _matching_positions(fname, where, self.cache)
+                    if positions:
+                        deleted += self._bitmap(fname).add(positions)
+        return deleted
+
+    def tombstone_ratios(self):
+        """{segment file name: share of its rows deleted}."""
+        return {os.path.basename(fname): self._bitmap(fname).ratio if self.deleted_bits(fname) else 0.0
+                for fname in self._segment_files()}
+
+    def _live_rows(self, fname):
+        row_count = self.entries[os.path.basename(fname)]["rows"]
+        bits = self.deleted_bits(fname)
+        return row_count - (self.bitmaps[fname].deleted if bits else 0)
+
+    def compaction_candidates(self, tombstone_ratio=DEFAULT_TOMBSTONE_RATIO, small_rows=None,
+                              target_rows=DEFAULT_SEGMENT_ROWS):
+        """
+        Segments worth rewriting: those where at least tombstone_ratio of the rows are deleted,
+        plus small segments (under small_rows, a quarter of target_rows by default) when there
+        are at least two to merge. Legacy JSON segments are always picked so they get converted.
+        Ratios come from the delete bitmaps; no column is read.
+        """
+        small_rows = target_rows // 4 if small_rows is None else small_rows
+        ratios = self.tombstone_ratios()
+        dirty, small = [], []
+        for fname in self._segment_files():
+            if not fname.endswith(SEGMENT_EXT) or ratios[os.path.basename(fname)] >= tombstone_ratio:
+                dirty.append(fname)
+            elif self._live_rows(fname) < small_rows:
+                small.append(fname)
+        if len(small) < 2 and not dirty:
+            small = []
+        return dirty + small
+
+    def compact(self, tombstone_ratio=DEFAULT_TOMBSTONE_RATIO, small_rows=None,
+                target_rows=DEFAULT_SEGMENT_ROWS, full=False):
+        """
+        Incrementally compact: merge only the segments compaction_candidates picks (every
+        segment with full=True) into new segments of target_rows. Inputs are read target_rows
+        rows at a time. Without a clustering key they are streamed one segment after another;
+        with one they are k-way merged in key order (segments not yet sorted by it are ordered
+        by that column alone), and an input only joins the merge once it reaches the input's
+        smallest key in the manifest, so segments with disjoint key ranges are read one at a
+        time. The output is sorted too. The swap is one manifest commit, so queries and flushes
+        can run meanwhile; scans already under way keep reading the old segments. If rows of
+        the merged segments were deleted while it ran, the output is discarded and (0, 0)
+        returned: try again.
+        Returns (segments merged, segments written).
+        """
         print(f"Compacting table {self.table_name}...")
+        if full:
+            old_files = self._segment_files()
+        else:
+            old_files = self.compaction_candidates(tombstone_ratio, small_rows, target_rows)
+        if not old_files:
+            print(f"Nothing to compact for table {self.table_name}.")
+            return 0, 0
+
+        new_files = []
+        seen_deletes = {}
+        inputs = []
+        for fname in old_files:
+            bits = self.deleted_bits(fname)
+            seen_deletes[fname] = self.bitmaps[fname].deleted if bits else 0
+            inputs.append((fname, bits))
+
+        def write_merged(order_by):
+            live, buffer = 0, []
+            streams = [_iter_segment_rows(fname, bits, self.cache, order_by, target_rows) for fname, bits in inputs]
+            if order_by:
+                floors = [self._cluster_floor(fname) for fname, _ in inputs]
+                rows = _merge_rows(list(zip(floors, streams)), sort_order(order_by))
+            else:
+                rows = chain.from_iterable(streams)
+            for row in chain(rows, [None]):
+                if row is not None:
+                    buffer.append(row)
+                if buffer and (row is None or len(buffer) == target_rows):
+                    with self.lock:
+                        path = self._new_segment_path()
+                    self._write_segment(path, buffer)
+                    new_files.append(path)
+                    live += len(buffer)
+                    buffer = []
+            return live
+
+        try:
+            live = write_merged(self.cluster_key)
+        except TypeError:
+            # Clustering-key values that don't compare across segments: concatenate instead
+            for path in new_files:
+                os.remove(path)
+            new_files.clear()
+            live = write_merged(None)
+        print(f"Live rows after filtering tombstones: {live}")
+
+        with self.lock:
+            if any(fname not in self.current.files or
+                   (self.bitmaps[fname].deleted if self.deleted_bits(fname) else 0) != seen
+                   for fname, seen in seen_deletes.items()):
+                for path in new_files:
+                    os.remove(path)
+                print(f"Compaction of table {self.table_name} raced with deletes; discarded.")
+                return 0, 0
+            position = min(self.current.files.index(f) for f in old_files)
+            position -= sum(1 for f in self.current.files[:position] if f in old_files)
+            self._commit_manifest(old_files, new_files, position)
+        print(f"Compaction complete for table {self.table_name}: "
+              f"{len(old_files)} segments merged into {len(new_files)}.")
+        return len(old_files), len(new_files)
+
+    def _cluster_floor(self, fname):
+        """sort_value of the segment's smallest clustering-key value per the manifest, or None if unknown."""
+        entry = self.entries.get(os.path.basename(fname), {})
+        return sort_value(entry["cluster_min"]) if "cluster_min" in entry else None
 
-        # 1. Load all rows from all segments (as in load_segments)
-        decompressor = zstd.ZstdDecompressor()
-        all_rows = []
-        for fname in glob.glob(os.path.join(self.segment_path, "*.json.zst")):
-            with open(fname, 'rb') as f:
-                raw = decompressor.decompress(f.read())
-                col_data = json.loads(raw.decode('utf-8'))
-                rows = [dict(zip(col_data, t)) for t in zip(*col_data.values())]
-                all_rows.extend(rows)
-
-        # 2. Filter out deleted rows
-        live_rows = [row for row in all_rows if row[self.pk] not in self.deleted_keys]
-        print(f"Live rows after filtering tombstones: {len(live_rows)}")
-
-        # 3. Delete all existing segment files
-        for fname in glob.glob(os.path.join(self.segment_path, "*.json.zst")):
-            os.remove(fname)
-
-        # 4. (Optionally) split live_rows into multiple new segments if too many
-        chunk_size = 1000  # You can tune this value
-        compressor = zstd.ZstdCompressor()
-        for i in range(0, len(live_rows), chunk_size):
-            chunk = live_rows[i:i+chunk_size]
-            if not chunk:
+    def scan_columns(self):
+        """
+        Yield one SegmentReader per typed segment, for analytic scans that decode columns
+        straight into arrays (read_array) instead of building rows. Deletes are not applied;
+        see deleted_bits for the segment's delete bitmap.
+        """
+        with self.snapshot() as snap:
+            for fname in snap.files:
+                if fname.endswith(SEGMENT_EXT):
+                    yield self._reader(fname)
+
+    def scan_segments(self, columns=None, where=None):
+        """
+        Yield the live rows of one segment at a time; only that segment is held in memory.
+        With columns the rows hold just those keys and only those columns are read.
+        where is a list of (column, op, value) predicates (see storage.predicate); segments
+        whose zone maps rule them out are skipped without reading any column.
+        """
+        with self.snapshot() as snap:
+            for fname in snap.files:
+                if self._may_hold(fname, where):
+                    yield _segment_rows(fname, columns, where, self.deleted_bits(fname), self.cache)
+
+    def _fan_out(self, fn, args, where, workers, processes):
+        """
+        Run fn(fname, *args, deleted bits, cache) in a pool for every segment the manifest
+        doesn't rule out for where; results in segment order. At most two tasks per worker
+        are in flight, so results pile up no further ahead of the caller than that. Workers
+        get bitmap snapshots, so they never touch the delete files.
+        """
+        with self.snapshot() as snap:
+            files = [fname for fname in snap.files if self._may_hold(fname, where)]
+            workers = workers or min(len(files), os.cpu_count() or 1) or 1
+            # Worker processes have no use for this process's cache
+            cache = None if processes else self.cache
+            executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+            with executor(max_workers=workers) as pool:
+                window = deque()
+                try:
+                    for fname in files:
+                        if len(window) >= workers * 2:
+                            yield window.popleft().result()
+                        window.append(pool.submit(fn, fname, *args, self.deleted_bits(fname), cache))
+                    while window:
+                        yield window.popleft().result()
+                finally:
+                    # The caller stopped early: don't run what it will never read
+                    for future in window:
+                        future.cancel()
+
+    def scan_parallel(self, columns=None, where=None, workers=None, processes=False):
+        """
+        Like scan_segments, but segments are decoded and filtered by a pool of workers
+        (threads, or processes to get past the GIL). Yields each segment's rows in order;
+        workers hand back columns, which are only turned into rows here.
+        """
+        for segment in self._fan_out(_segment_columns, (columns, where), where, workers, processes):
+            yield _columns_to_rows(segment)
+
+    def aggregate(self, aggregates, group_by=None, where=None, workers=None, processes=False):
+        """
+        Compute aggregates over the live rows, e.g. aggregate([("count", None), ("avg", "rating")],
+        group_by=["titleType"]). Each worker reduces its segment to partial aggregates per group,
+        so only those cross back; functions are count (None counts rows), sum, min, max and avg.
+        Returns one dict per group: the group_by values plus "func(column)" keys.
+        """
+        for func, column in aggregates:
+            if func not in AGGREGATES:
+                raise ValueError(f"Unknown aggregate '{func}', expected one of {AGGREGATES}")
+        group_by = list(group_by or [])
+        totals = {}
+        for partials in self._fan_out(_aggregate_segment, (aggregates, group_by, where), where, workers,
+                                      processes):
+            for key, state in partials.items():
+                totals[key] = _merge_partials(aggregates, totals[key], state) if key in totals else state
+        if not group_by and not totals:
+            totals[()] = [_new_partial(func) for func, _ in aggregates]
+        return [{**dict(zip(group_by, key)),
+                 **{f"{func}({column or '*'})": _finish_partial(func, value)
+                    for (func, column), value in zip(aggregates, state)}}
+                for key, state in totals.items()]
+
+    def scan(self, columns=None, where=None):
+        for rows in self.scan_segments(columns, where):
+            yield from rows
+
+    def load_segments(self, columns=None, where=None):
+        return list(self.scan(columns, where))
+
+
+def _read_segment(fname, columns=None, where=None, cache=None, deleted=None):
+    """
+    A segment's columns as (row count, {name: list}), without the rows set in the deleted
+    bitmap snapshot. With columns only those are read (typed segments skip the other chunks
+    entirely). Typed segments apply the where predicates themselves, returning only matching
+    rows, or None when none can match.
+    """
+    if fname.endswith(SEGMENT_EXT):
+        reader = SegmentReader(fname, cache)
+        rows = reader.matching_rows(where) if where else None
+        if deleted is not None:
+            rows = live_positions(deleted, reader.row_count, rows)
+        if rows is None:
+            return reader.row_count, reader.read_columns(columns)
+        if not rows:
+            return None
+        return len(rows), reader.read_columns(columns, rows)
+    with open(fname, 'rb') as f:
+        raw = zstd.ZstdDecompressor().decompress(f.read())
+    col_data = json.loads(raw.decode('utf-8'))
+    row_count = len(next(iter(col_data.values()), []))
+    if columns is not None:
+        col_data = {name: col_data.get(name, [None] * row_count) for name in columns}
+    if deleted is not None:
+        live = live_positions(deleted, row_count)
+        col_data = {name: [values[i] for i in live] for name, values in col_data.items()}
+        row_count = len(live)
+    return row_count, col_data
+
+
+def _matching_positions(fname, where, cache=None):
+    """Positions of the rows in a segment file satisfying every where predicate (deleted or not)."""
+    if fname.endswith(SEGMENT_EXT):
+        return SegmentReader(fname, cache).matching_rows(where)
+    _, col_data = _read_segment(fname, list(dict.fromkeys(predicate_columns(where))), None, cache)
+    return [i for i, t in enumerate(zip(*col_data.values())) if row_matches(dict(zip(col_data, t)), where)]
+
+
+def _segment_columns(fname, columns, where, deleted=None, cache=None):
+    """
+    The live rows of one segment file, filtered by where and projected to columns, as
+    (row count, {name: list}); None when no row matches.
+    """
+    wanted = columns
+    legacy = not fname.endswith(SEGMENT_EXT)
+    if columns is not None and where and legacy:
+        # Legacy segments are filtered row by row, which needs the predicates' columns
+        extra = [name for name in dict.fromkeys(predicate_columns(where)) if name not in columns]
+        if extra:
+            wanted = list(columns) + extra
+    segment = _read_segment(fname, wanted, where, cache, deleted)
+    if segment is None:
+        return None
+    row_count, col_data = segment
+    if where and legacy:
+        keep = [i for i, t in enumerate(zip(*col_data.values())) if row_matches(dict(zip(col_data, t)), where)]
+        row_count = len(keep)
+        col_data = {name: [values[i] for i in keep] for name, values in col_data.items()}
+    if wanted is not columns:
+        col_data = {name: col_data[name] for name in columns}
+    return row_count, col_data
+
+
+def _columns_to_rows(segment):
+    """Rows from a _segment_columns result."""
+    if segment is None:
+        return []
+    row_count, col_data = segment
+    if not col_data:
+        return [{} for _ in range(row_count)]
+    return [dict(zip(col_data, t)) for t in zip(*col_data.values())]
+
+
+def _segment_rows(fname, columns, where, deleted=None, cache=None):
+    """The live rows of one segment file, filtered by where and projected to columns."""
+    return _columns_to_rows(_segment_columns(fname, columns, where, deleted, cache))
+
+
+def _iter_segment_rows(fname, deleted=None, cache=None, order_by=None, batch_rows=DEFAULT_SEGMENT_ROWS):
+    """
+    Generate one segment's live rows, decoding batch_rows of them at a time. With order_by they
+    come in sort_order(order_by): as stored when the segment is sorted by that column, else in
+    an order worked out from that column alone.
+    """
+    if fname.endswith(SEGMENT_EXT):
+        reader = SegmentReader(fname, cache)
+        positions = live_positions(deleted, reader.row_count)
+        if order_by is not None and reader.sort_key != order_by and order_by in reader.columns:
+            keys = reader.read_column(order_by)
+            positions.sort(key=lambda i: sort_value(keys[i]))
+            del keys
+        read = lambda chunk: reader.read_columns(None, chunk)
+    else:
+        # JSON segments can only be decoded whole
+        row_count, col_data = _read_segment(fname, None, None, cache, deleted)
+        positions = list(range(row_count))
+        if order_by in col_data:
+            positions.sort(key=lambda i: sort_value(col_data[order_by][i]))
+        read = lambda chunk: {name: [values[i] for i in chunk] for name, values in col_data.items()}
+    for start in range(0, len(positions), batch_rows):
+        cols = read(positions[start:start + batch_rows])
+        yield from (dict(zip(cols, t)) for t in zip(*cols.values()))
+
+
+def _merge_rows(inputs, key):
+    """
+    Merge (floor, rows) inputs, each sorted by key, into one stream like heapq.merge. An input
+    with a floor (a key no row of it sorts before) is only started once the merge gets there,
+    so its segment isn't read while inputs that come before it are still being merged.
+    """
+    heap = []
+    def advance(n, rows):
+        for row in rows:
+            heapq.heappush(heap, (key(row), n, row, rows))
+            return
+    pending = sorted(((floor, n, rows) for n, (floor, rows) in enumerate(inputs) if floor is not None),
+                     key=lambda p: p[:2], reverse=True)
+    for n, (floor, rows) in enumerate(inputs):
+        if floor is None:
+            advance(n, rows)
+    while heap or pending:
+        while pending and (not heap or pending[-1][0] <= heap[0][0]):
+            _, n, rows = pending.pop()
+            advance(n, rows)
+        if heap:
+            _, n, row, rows = heapq.heappop(heap)
+            yield row
+            advance(n, rows)
+
+
+AGGREGATES = ("count", "sum", "min", "max", "avg")
+
+
+def _new_partial(func):
+    return [0, 0] if func == "avg" else (0 if func == "count" else None)
+
+
+def _aggregate_segment(fname, aggregates, group_by, where, deleted=None, cache=None):
+    """Reduce one segment to {group key tuple: [partial per aggregate]}."""
+    columns = list(dict.fromkeys(group_by + [column for _, column in aggregates if column]))
+    partials = {}
+    for row in _segment_rows(fname, columns, where, deleted, cache):
+        key = tuple(row[name] for name in group_by)
+        state = partials.get(key)
+        if state is None:
+            state = partials[key] = [_new_partial(func) for func, _ in aggregates]
+        for i, (func, column) in enumerate(aggregates):
+            value = row[column] if column else True
+            if value is None:
                 continue
-            cols = {key: [row[key] for row in chunk] for key in chunk[0]}
-            seg_path = os.path.join(self.segment_path, f"seg_{i // chunk_size}.json.zst")
-            with open(seg_path, 'wb') as f:
-                f.write(compressor.compress(json.dumps(cols).encode('utf-8')))
+            if func == "count":
+                state[i] += 1
+            elif func == "avg":
+                state[i][0] += value
+                state[i][1] += 1
+            elif state[i] is None:
+                state[i] = value
+            elif func == "sum":
+                state[i] += value
+            elif func == "min":
+                state[i] = min(state[i], value)
+            else:
+                state[i] = max(state[i], value)
+    return partials
 
-        # 5. Delete tombstone file
-        if os.path.exists(self.deletes_path):
-            os.remove(self.deletes_path)
-        self.deleted_keys.clear()
-
-        print(f"Compaction complete for table {self.table_name}.")
-
-    def load_segments(self):
-        import glob
-        decompressor = zstd.ZstdDecompressor()
-        all_data = []
-        for fname in glob.glob(os.path.join(self.segment_path, "*.json.zst")):
-            with open(fname, 'rb') as f:
-                raw = decompressor.decompress(f.read())
-                col_data = json.loads(raw.decode('utf-8'))
-                rows = [dict(zip(col_data, t)) for t in zip(*col_data.values())]
-                # Filter out deleted rows
-                rows = [r for r in rows if r[self.pk] not in self.deleted_keys]
-                all_data.extend(rows)
-        return all_data
+
+def _merge_partials(aggregates, a, b):
+    merged = []
+    for (func, _), x, y in zip(aggregates, a, b):
+        if func == "avg":
+            merged.append([x[0] + y[0], x[1] + y[1]])
+        elif x is None or y is None:
+            merged.append(y if x is None else x)
+        elif func in ("count", "sum"):
+            merged.append(x + y)
+        else:
+            merged.append((min if func == "min" else max)(x, y))
+    return merged
+
+
+def _finish_partial(func, value):
+    if func == "avg":
+        return value[0] / value[1] if value[1] else None
+    return value
+
+
+def _segment_number(path):
+    """n for seg_<n>.seg; -1 for other names (sorted first)."""
+    match = re.match(r"seg_(\d+)\.", os.path.basename(path))
+    return int(match.group(1)) if match else -1
+
+
+def _fsync(path):
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+def _atomic_write_json(path, value):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,97 @@
+import os
+import struct
+import zlib
+
+DELETES_EXT = ".del"
+# Append-only file of frames: run count, CRC32 of the runs; then the runs as (first row, length) pairs
+FRAME = struct.Struct("<II")
+RUN = struct.Struct("<II")
+
+
+def to_runs(positions):
+    """Sorted row positions as [(first, length), ...] runs."""
+    runs = []
+    for pos in sorted(positions):
+        if runs and runs[-1][0] + runs[-1][1] == pos:
+            runs[-1][1] += 1
+        else:
+            runs.append([pos, 1])
+    return runs
+
+
+class DeleteBitmap:
+    """
+    Deleted row positions of one segment: a bit per row in memory, persisted as an
+    append-only file of run-encoded frames next to the segment (seg_<n>.del). A frame
+    that didn't make it to disk intact (torn write) is ignored on load.
+    """
+    def __init__(self, path, row_count):
+        self.path = path
+        self.row_count = row_count
+        self.bits = bytearray((row_count + 7) // 8)
+        self.deleted = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + FRAME.size <= len(data):
+            count, crc = FRAME.unpack_from(data, offset)
+            end = offset + FRAME.size + count * RUN.size
+            if end > len(data) or zlib.crc32(data[offset + FRAME.size:end]) != crc:
+                break
+            for first, length in RUN.iter_unpack(data[offset + FRAME.size:end]):
+                for pos in range(first, first + length):
+                    self._set(pos)
+            offset = end
+
+    def _set(self, pos):
+        mask = 1 << (pos & 7)
+        if not self.bits[pos >> 3] & mask:
+            self.bits[pos >> 3] |= mask
+            self.deleted += 1
+
+    def is_deleted(self, pos):
+        return bool(self.bits[pos >> 3] & (1 << (pos & 7)))
+
+    def add(self, positions):
+        """Mark rows deleted and append them to the file as one frame; returns how many were new."""
+        new = [pos for pos in set(positions) if 0 <= pos < self.row_count and not self.is_deleted(pos)]
+        if not new:
+            return 0
+        body = b"".join(RUN.pack(first, length) for first, length in to_runs(new))
+        with open(self.path, "ab") as f:
+            f.write(FRAME.pack(len(body) // RUN.size, zlib.crc32(body)) + body)
+            f.flush()
+            os.fsync(f.fileno())
+        for pos in new:
+            self._set(pos)
+        return len(new)
+
+    @property
+    def ratio(self):
+        return self.deleted / self.row_count if self.row_count else 0.0
+
+    def snapshot(self):
+        """The bits as immutable bytes (or None with nothing deleted), for live_positions in any process."""
+        return bytes(self.bits) if self.deleted else None
+
+
+def live_positions(bits, row_count, positions=None):
+    """Row positions (all, or the given ones) whose bit isn't set in a snapshot; None bits = all live."""
+    if bits is None:
+        return list(range(row_count) if positions is None else positions)
+    if positions is not None:
+        return [i for i in positions if not bits[i >> 3] & (1 << (i & 7))]
+    live = []
+    # Whole bytes at a time: all-live and all-deleted bytes need no per-bit test
+    for byte_num, byte in enumerate(bits):
+        base = byte_num << 3
+        if byte == 0:
+            live.extend(range(base, min(base + 8, row_count)))
+        elif byte != 0xFF:
+            live.extend(base + j for j in range(8) if not byte & (1 << j) and base + j < row_count)
+    return live
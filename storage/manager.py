@@ -1,13 +1,45 @@
 import os
 import glob
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from jobs.queue import Job
+from storage.block_manager import BLOCK_SIZE, BlockManager
+from storage.buffer_pool import get_buffer_pool
 from storage.row_store import RowStore
-from storage.column_store import ColumnStore
+from storage.column_store import MANIFEST_NAME, ColumnStore
+from storage.segment_cache import get_segment_cache
+from storage.tiering import TierLock
+from transaction.wal_manager import DURABILITY_GROUP
 
 class StorageManager:
-    def __init__(self, base_path="data"):
+    def __init__(self, base_path="data", use_mmap=False, lazy_load=False, durability=DURABILITY_GROUP,
+                 segment_cache_bytes=None, tiering=None, job_queue=None, recovery_processes=False):
         self.base_path = base_path
+        self.use_mmap = use_mmap  # memory-map .tbl/.idx files for read-heavy workloads
+        self.lazy_load = lazy_load  # decode row blocks on first access instead of at startup
+        self.durability = durability  # default WAL mode for tables: "sync", "group" or "async"
+        # Redo each table's WAL in a worker process at startup (see recover_tables); pays off
+        # once there are several tables with long logs, costs a process start per table otherwise
+        self.recovery_processes = recovery_processes
+        self.recovery_times = {}  # table -> seconds its last recover_tables run took
         self.row_stores = {}
         self.column_stores = {}
+        # Stores are opened on first use from query threads and the job queue alike
+        self.stores_lock = threading.RLock()
+        # With a TieringPolicy, writes that push a row store past its thresholds queue a
+        # migration to the column store on job_queue (a started jobs.queue.JobQueue)
+        if tiering is not None and job_queue is None:
+            raise ValueError("A tiering policy needs a job_queue to run its migrations on")
+        self.tiering = tiering
+        self.job_queue = job_queue
+        self.oldest_write = {}  # table -> monotonic time of its oldest write not yet migrated
+        self.migrations_pending = set()
+        self.tiering_lock = threading.Lock()
+        self.tier_locks = {}  # table -> TierLock between two-tier scans and migration handoffs
+        if segment_cache_bytes is not None:
+            # Budget for decompressed column chunks, shared by every table's column store
+            get_segment_cache().resize(segment_cache_bytes)
 
         self._ensure_dirs()
     
@@ -16,31 +48,162 @@ class StorageManager:
         os.makedirs(os.path.join(self.base_path, "segments"), exist_ok=True)
         os.makedirs(os.path.join(self.base_path, "indexes"), exist_ok=True)
 
-    def get_row_store(self, table_name) -> RowStore:
+    def get_row_store(self, table_name, columns=None, pk=None, durability=None) -> RowStore:
+        with self.stores_lock:
+            return self._get_row_store(table_name, columns, pk, durability)
+
+    def _get_row_store(self, table_name, columns, pk, durability):
         if table_name not in self.row_stores:
-            self.row_stores[table_name] = RowStore(table_name, self.base_path)
+            self.row_stores[table_name] = RowStore(table_name, pk=pk or "id",
+                                                   base_path=_row_store_path(self.base_path),
+                                                   use_mmap=self.use_mmap, columns=columns, lazy=self.lazy_load,
+                                                   durability=durability or self.durability)
+            self._finish_migration(table_name)
+        else:
+            if columns and self.row_stores[table_name].schemaless:
+                self.row_stores[table_name].set_columns(columns)
+            self.row_stores[table_name].set_pk(pk)
+            if durability:
+                self.row_stores[table_name].wal_manager.set_durability(durability)
         return self.row_stores[table_name]
     
-    def get_column_store(self, table_name) -> ColumnStore:
+    def _finish_migration(self, table_name):
+        """
+        Complete a migration the process died in the middle of: its manifest commit is durable,
+        so the rows it moved are deleted from the freshly recovered row store.
+        """
+        if not os.path.exists(os.path.join(self.base_path, "segments", table_name, MANIFEST_NAME)):
+            return
+        row_store = self.row_stores[table_name]
+        col_store = self.get_column_store(table_name, pk=row_store.pk)
+        if col_store.migration is None:
+            return
+        col_store.apply_migration_drops()
+        row_store.delete_row_ids([((block, slot), key) for block, slot, key in col_store.migration["moved"]])
+        col_store.finish_migration()
+
+    def tier_lock(self, table_name) -> TierLock:
+        with self.tiering_lock:
+            return self.tier_locks.setdefault(table_name, TierLock())
+
+    def get_column_store(self, table_name, pk=None, cluster_key=None) -> ColumnStore:
+        with self.stores_lock:
+            return self._get_column_store(table_name, pk, cluster_key)
+
+    def _get_column_store(self, table_name, pk, cluster_key):
         if table_name not in self.column_stores:
-            self.column_stores[table_name] = ColumnStore(table_name, self.base_path)
+            self.column_stores[table_name] = ColumnStore(table_name, pk=pk or "id",
+                                                         segment_path=os.path.join(self.base_path, "segments"),
+                                                         cluster_key=cluster_key)
+        else:
+            if pk:
+                self.column_stores[table_name].pk = pk
+            if cluster_key and cluster_key != self.column_stores[table_name].cluster_key:
+                self.column_stores[table_name].set_cluster_key(cluster_key)
         return self.column_stores[table_name]
     
+    def open_block_file(self, path) -> BlockManager:
+        return BlockManager(path, use_mmap=self.use_mmap)
+
     def write_row(self, table_name, row: dict):
         self.get_row_store(table_name).insert_row(row)
+        self._note_write(table_name)
 
     def bulk_write(self, table_name, rows:  list[dict]):
         self.get_row_store(table_name).bulk_insert_rows(rows)
+        self._note_write(table_name)
+
+    def _note_write(self, table_name):
+        self.oldest_write.setdefault(table_name, time.monotonic())
+        if self.tiering is not None:
+            self.schedule_migration(table_name)
+
+    def schedule_migration(self, table_name):
+        """
+        Queue a migration job if the tiering policy finds the table's row store due; at most one
+        is pending per table. Returns the threshold crossed, or None if nothing was queued.
+        """
+        row_store = self.get_row_store(table_name)
+        row_count = row_store.row_count()
+        now = time.monotonic()
+        if row_count:
+            # Rows recovered at startup have no write time: their age counts from now
+            self.oldest_write.setdefault(table_name, now)
+        reason = self.tiering.reason(row_count, row_store.bm.num_blocks() * BLOCK_SIZE,
+                                     now - self.oldest_write.get(table_name, now))
+        with self.tiering_lock:
+            if reason is None or table_name in self.migrations_pending:
+                return None
+            self.migrations_pending.add(table_name)
+        self.job_queue.enqueue(Job(self._run_migration, args=(table_name,), priority=1,
+                                   description=f"Migrate {table_name} to the column store ({reason})"))
+        return reason
+
+    def check_tiering(self):
+        """
+        Run the tiering policy over every open table; call it periodically so the age threshold
+        fires for tables nobody writes to. Returns {table: threshold crossed} for the jobs queued.
+        """
+        scheduled = {}
+        for table_name in list(self.row_stores):
+            reason = self.schedule_migration(table_name)
+            if reason:
+                scheduled[table_name] = reason
+        return scheduled
+
+    def _run_migration(self, table_name):
+        try:
+            self.migrate_table(table_name)
+        finally:
+            with self.tiering_lock:
+                self.migrations_pending.discard(table_name)
+
+    def migrate_table(self, table_name, segment_rows=None):
+        """
+        Move the rows now in the table's row store to its column store, in segments of
+        segment_rows (the tiering policy's by default, else one segment). Inserts are only held
+        up while the rows are copied and at the handoff, not while the segments are written.
+        The handoff runs under the table's TierLock, so no two-tier scan sees it half done:
+        one manifest commit installs the segments together with a record of the rows they
+        take over, the row store deletes those rows, and the record is cleared. Copies of rows
+        updated or deleted meanwhile are deleted from the new segments by position. After a
+        crash, get_row_store replays an uncleared record (see _finish_migration).
+        Returns the rows moved.
+        """
+        row_store = self.get_row_store(table_name)
+        col_store = self.get_column_store(table_name, pk=row_store.pk)
+        with row_store.lock:
+            batch = row_store.get_rows_with_ids()
+            copied_at = time.monotonic()
+        if not batch:
+            return 0
+        if segment_rows is None and self.tiering is not None:
+            segment_rows = self.tiering.segment_rows
+        written = col_store.write_segments([row for _, row in batch], segment_rows=segment_rows)
+        handoff = [(row_id, row.get(row_store.pk)) for row_id, row in batch]
+        with self.tier_lock(table_name).handing_off(), row_store.lock:
+            missing = {row_id for row_id, _ in row_store.missing_row_ids(handoff)}
+            dropped = {path: [pos for pos, i in enumerate(indexes) if handoff[i][0] in missing]
+                       for path, indexes in written}
+            moved = [pair for pair in handoff if pair[0] not in missing]
+            col_store.commit_migration([path for path, _ in written], moved, dropped)
+            row_store.delete_row_ids(moved)
+            col_store.finish_migration()
+        if row_store.clear_if_empty():
+            self.oldest_write.pop(table_name, None)
+        else:
+            self.oldest_write[table_name] = copied_at
+        return len(moved)
 
     def drop_table(self, table_name):
         # Drop RowStore files and remove from manager
-        if table_name in self.row_stores:
-            self.row_stores[table_name].drop()
-            del self.row_stores[table_name]
-        if table_name in self.column_stores:
-            self.column_stores[table_name].drop()
-            del self.column_stores[table_name]
-        # Remove index files (block and meta)
+        with self.stores_lock:
+            if table_name in self.row_stores:
+                self.row_stores.pop(table_name).drop()
+            if table_name in self.column_stores:
+                self.column_stores.pop(table_name).drop()
+        self.tier_locks.pop(table_name, None)
+        # Remove index files
         index_pattern = os.path.join(self.base_path, "indexes", f"{table_name}_*")
         for file_path in glob.glob(index_pattern):
             try:
@@ -48,17 +211,84 @@ class StorageManager:
             except Exception:
                 pass
 
+    def close(self):
+        """Close every open table, e.g. before another StorageManager opens the same base_path."""
+        with self.stores_lock:
+            for row_store in self.row_stores.values():
+                row_store.close()
+            for col_store in self.column_stores.values():
+                col_store.close()
+            self.row_stores.clear()
+            self.column_stores.clear()
+
     def flush_table(self, table_name):
-        row_store = self.get_row_store(table_name)
-        col_store = self.get_column_store(table_name)
-        rows = row_store.get_rows()
-        if not rows:
-            return
-        col_store.flush(rows)
-        row_store.clear()
-
-    def load_all_tables(self):
-        for file in os.listdir(os.path.join(self.base_path, "wal")):
-            if file.endswith(".wal"):
-                table_name = file.replace(".wal", "")
-                store = self.get_row_store(table_name)
+        self.migrate_table(table_name)
+
+    def checkpoint(self):
+        """Checkpoint every open table (pages to disk, WAL recycled), then flush the remaining block files."""
+        for row_store in self.row_stores.values():
+            row_store.checkpoint()
+        get_buffer_pool().checkpoint()
+
+    def recover_tables(self, tables, workers=None, processes=None, progress=None):
+        """
+        Open (and so recover) many row stores at once. tables maps a table name to the
+        get_row_store keyword arguments for it. With processes=True each table's WAL redo
+        and checkpoint run in a worker process first, so CPU-bound decoding isn't serialised
+        by the GIL; the stores are then opened here with nothing left to redo.
+        processes defaults to the manager's recovery_processes setting.
+        progress(table_name, done, total, seconds) is called as each table finishes.
+        Returns {table_name: seconds}.
+        """
+        pending = {name: kwargs for name, kwargs in tables.items() if name not in self.row_stores}
+        if not pending:
+            return {}
+        progress = progress or _print_recovery_progress
+        if processes is None:
+            processes = self.recovery_processes
+        workers = workers or min(len(pending), os.cpu_count() or 1)
+        timings = {}
+        if processes:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(_recover_in_process, self.base_path, self.use_mmap, name, kwargs): name
+                           for name, kwargs in pending.items()}
+                redo_times = {futures[f]: f.result() for f in as_completed(futures)}
+        else:
+            redo_times = dict.fromkeys(pending, 0.0)
+        def open_store(name):
+            start = time.perf_counter()
+            self.get_row_store(name, **pending[name])
+            return redo_times[name] + time.perf_counter() - start
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(open_store, name): name for name in pending}
+            for future in as_completed(futures):
+                name = futures[future]
+                timings[name] = future.result()
+                progress(name, len(timings), len(pending), timings[name])
+        self.recovery_times.update(timings)
+        return timings
+
+    def load_all_tables(self, workers=None, processes=None):
+        tables = {file[:-len(".wal")]: {} for file in os.listdir(os.path.join(self.base_path, "wal"))
+                  if file.endswith(".wal")}
+        return self.recover_tables(tables, workers=workers, processes=processes)
+
+
+def _row_store_path(base_path):
+    # Heap (.tbl) and overflow (.toast) files have always lived next to the WAL files
+    return os.path.join(base_path, "wal")
+
+
+def _print_recovery_progress(table_name, done, total, seconds):
+    print(f"[Recovery] {done}/{total} {table_name} recovered in {seconds:.3f}s")
+
+
+def _recover_in_process(base_path, use_mmap, table_name, kwargs):
+    # Runs in a worker process: redo the WAL into the pages and checkpoint, without
+    # decoding more blocks than the redo touches
+    start = time.perf_counter()
+    store = RowStore(table_name, pk=kwargs.get("pk") or "id", base_path=_row_store_path(base_path),
+                     use_mmap=use_mmap, columns=kwargs.get("columns"), lazy=True)
+    store.checkpoint()
+    store.close()
+    return time.perf_counter() - start
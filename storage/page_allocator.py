@@ -0,0 +1,83 @@
+import os
+import struct
+
+# Header page (block 0): magic, format version, root page, free-list head, free page count
+HEADER_FORMAT = ">4sHIII"
+HEADER_MAGIC = b"FDBP"
+HEADER_VERSION = 1
+# A freed page starts with this marker followed by the next free page (0 = end of list)
+FREE_FORMAT = ">4sI"
+FREE_MAGIC = b"FREE"
+
+def has_page_header(path):
+    """True if the block file at path is missing, empty or starts with the page header."""
+    if not os.path.exists(path):
+        return True
+    with open(path, "rb") as f:
+        head = f.read(len(HEADER_MAGIC))
+    return not head or head == HEADER_MAGIC
+
+class PageAllocator:
+    """
+    Page allocation for block files that hand out pages by number (index nodes, overflow chains).
+    Block 0 is a header page holding a root pointer and the head of a free list that is
+    chained through the freed pages themselves, so freed pages are reused before the file grows.
+    """
+    def __init__(self, block_manager):
+        self.bm = block_manager
+        if self.bm.num_blocks() == 0:
+            self.bm.allocate_block()
+            self.root = 0
+            self.free_head = 0
+            self.free_count = 0
+            self._write_header()
+        else:
+            magic, version, root, free_head, free_count = struct.unpack_from(HEADER_FORMAT, self.bm.read_block(0))
+            if magic != HEADER_MAGIC:
+                raise ValueError(f"{self.bm.path} has no page header (old format?)")
+            if version != HEADER_VERSION:
+                raise ValueError(f"{self.bm.path} has unsupported page format version {version}")
+            self.root = root
+            self.free_head = free_head
+            self.free_count = free_count
+
+    def _write_header(self):
+        self.bm.write_block(0, struct.pack(HEADER_FORMAT, HEADER_MAGIC, HEADER_VERSION,
+                                           self.root, self.free_head, self.free_count))
+
+    def set_root(self, page):
+        self.root = page
+        self._write_header()
+
+    def allocate(self):
+        """Return a page number, reusing a freed page if there is one."""
+        if not self.free_head:
+            return self.bm.allocate_block()
+        page = self.free_head
+        magic, next_free = struct.unpack_from(FREE_FORMAT, self.bm.read_block(page))
+        if magic != FREE_MAGIC:
+            raise ValueError(f"Free list of {self.bm.path} is corrupt at page {page}")
+        self.free_head = next_free
+        self.free_count -= 1
+        self._write_header()
+        return page
+
+    def free(self, page):
+        if page == 0:
+            raise ValueError("Cannot free the header page")
+        self.bm.write_block(page, struct.pack(FREE_FORMAT, FREE_MAGIC, self.free_head))
+        self.free_head = page
+        self.free_count += 1
+        self._write_header()
+
+    def reset(self):
+        """Drop every page and start over with an empty header (used before bulk loads)."""
+        self.bm.truncate(1)
+        self.root = 0
+        self.free_head = 0
+        self.free_count = 0
+        self._write_header()
+
+    def num_pages(self):
+        """Pages in use, excluding the header and free pages."""
+        return self.bm.num_blocks() - 1 - self.free_count
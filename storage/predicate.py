@@ -0,0 +1,58 @@
+import operator
+
+# A predicate is (column, op, value); a row matches a list of them when it matches all.
+# Null never matches, as in SQL.
+OPS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def check_predicates(where):
+    for column, op, _ in where:
+        if op not in OPS:
+            raise ValueError(f"Unknown operator '{op}' on {column}, expected one of {list(OPS)}")
+
+
+def predicate_columns(where):
+    return [column for column, _, _ in where or ()]
+
+
+def value_matches(v, op, value):
+    if v is None:
+        return False
+    try:
+        return bool(OPS[op](v, value))
+    except TypeError:
+        return False  # e.g. a text value compared with a number
+
+
+def row_matches(row, where):
+    return all(value_matches(row.get(column), op, value) for column, op, value in where)
+
+
+def range_may_match(op, value, lo, hi):
+    """
+    False only if no value in [lo, hi] can satisfy `v op value`. Values that don't compare
+    with the bounds are let through; the row filter decides.
+    """
+    try:
+        if op == "=":
+            return lo <= value <= hi
+        if op == "!=":
+            return not (lo == hi == value)
+        if op == "<":
+            return lo < value
+        if op == "<=":
+            return lo <= value
+        if op == ">":
+            return hi > value
+        if op == ">=":
+            return hi >= value
+    except TypeError:
+        pass
+    return True
@@ -1,22 +1,398 @@
 import json
+import struct
 
-def encode_rows_block(rows):
+from core.datatypes import DataType
+from storage.buffer_pool import BLOCK_SIZE
+
+# Column type codes used in the binary row format
+TYPE_ANY = 0    # self-describing: 1-byte tag + value (schemaless tables, unknown dtypes)
+TYPE_INT = 1    # 8-byte signed
+TYPE_FLOAT = 2  # 8-byte IEEE double
+TYPE_BOOL = 3   # 1 byte
+TYPE_TEXT = 4   # 2-byte length + UTF-8
+
+_TYPE_NAMES = {TYPE_ANY: "ANY", TYPE_INT: "INT", TYPE_FLOAT: "FLOAT", TYPE_BOOL: "BOOL", TYPE_TEXT: "TEXT"}
+
+# Tags for TYPE_ANY values
+_TAG_INT, _TAG_FLOAT, _TAG_BOOL, _TAG_TEXT, _TAG_JSON, _TAG_TOAST = 1, 2, 3, 4, 5, 6
+
+_INT = struct.Struct(">q")
+_FLOAT = struct.Struct(">d")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+
+# Overflow pointer left in a row: first chunk page/slot, raw length, stored length, flags
+POINTER = struct.Struct(">IHIIB")
+FLAG_COMPRESSED = 1
+FLAG_JSON = 2  # value is not a str and was stored as JSON
+TOAST_MARKER = 0xFFFF  # TEXT length that means "an overflow pointer follows"
+
+# Slotted page header: magic, slot count, free space start, free space end, layout length,
+# LSN of the last WAL record applied to the page
+PAGE_MAGIC = b"FS"
+PAGE_HEADER = struct.Struct(">2sHHHHQ")
+# Slot directory entry: tuple offset, tuple length (high bit set = deleted)
+SLOT = struct.Struct(">HH")
+SLOT_DEAD = 0x8000
+_PAGE_LSN = struct.Struct(">Q")
+
+
+class ToastPointer:
+    """Placeholder for a value that lives in the table's overflow file (see storage/toast.py)."""
+    __slots__ = ("page", "slot", "raw_length", "stored_length", "flags")
+
+    def __init__(self, page, slot, raw_length, stored_length, flags):
+        self.page = page
+        self.slot = slot
+        self.raw_length = raw_length
+        self.stored_length = stored_length
+        self.flags = flags
+
+    def pack(self):
+        return POINTER.pack(self.page, self.slot, self.raw_length, self.stored_length, self.flags)
+
+    @classmethod
+    def unpack_from(cls, data, offset):
+        return cls(*POINTER.unpack_from(data, offset)), offset + POINTER.size
+
+    def __eq__(self, other):
+        return isinstance(other, ToastPointer) and (self.page, self.slot) == (other.page, other.slot)
+
+    def __hash__(self):
+        return hash((self.page, self.slot))
+
+    def __repr__(self):
+        return f"ToastPointer(page={self.page}, slot={self.slot}, raw_length={self.raw_length})"
+
+
+def dtype_to_type_code(dtype):
+    """Map a Column dtype ("INT", "TEXT", DataType.FLOAT, ...) to a row format type code."""
+    name = str(dtype.value if isinstance(dtype, DataType) else dtype).upper()
+    if name in ("INT", "INTEGER", "BIGINT", "SMALLINT"):
+        return TYPE_INT
+    if name in ("FLOAT", "REAL", "DOUBLE"):
+        return TYPE_FLOAT
+    if name in ("BOOL", "BOOLEAN"):
+        return TYPE_BOOL
+    if name in ("TEXT", "STRING") or name.startswith("VARCHAR") or name.startswith("CHAR"):
+        return TYPE_TEXT
+    return TYPE_ANY
+
+
+class RowCodec:
     """
-    Header: 2 bytes = number of rows
-    Payload: JSON serialization of list of rows
+    Encodes rows against a fixed column layout:
+    a null bitmap followed by the non-null values in layout order.
     """
-    payload = json.dumps(rows).encode("utf-8")
-    row_count = len(rows)
-    header = row_count.to_bytes(2, "big")
-    return header + payload
+    def __init__(self, layout):
+        self.layout = list(layout)  # [(name, type_code), ...]
+        self.names = [name for name, _ in self.layout]
+        self.types = [type_code for _, type_code in self.layout]
+        self.bitmap_len = (len(self.layout) + 7) // 8
+        self._name_set = set(self.names)
+        self._layout_bytes = None
+
+    @classmethod
+    def from_columns(cls, columns):
+        return cls([(col.name, dtype_to_type_code(col.dtype)) for col in columns])
+
+    @classmethod
+    def for_rows(cls, rows, base=None):
+        """Schemaless layout: every key seen so far, stored as TYPE_ANY."""
+        layout = list(base.layout) if base else []
+        seen = {name for name, _ in layout}
+        for row in rows:
+            for key in row:
+                if key not in seen:
+                    seen.add(key)
+                    layout.append((key, TYPE_ANY))
+        return cls(layout)
+
+    def covers(self, row):
+        return all(key in self._name_set for key in row)
+
+    def layout_bytes(self):
+        if self._layout_bytes is None:
+            out = bytearray([len(self.layout)])
+            for name, type_code in self.layout:
+                raw = name.encode("utf-8")
+                out.append(type_code)
+                out.append(len(raw))
+                out += raw
+            self._layout_bytes = bytes(out)
+        return self._layout_bytes
+
+    @classmethod
+    def from_layout_bytes(cls, data, offset=0):
+        count = data[offset]
+        offset += 1
+        layout = []
+        for _ in range(count):
+            type_code, name_len = data[offset], data[offset + 1]
+            offset += 2
+            layout.append((bytes(data[offset:offset + name_len]).decode("utf-8"), type_code))
+            offset += name_len
+        return cls(layout), offset
+
+    def encode(self, row):
+        if not self.covers(row):
+            unknown = [key for key in row if key not in self._name_set]
+            raise ValueError(f"Unknown column(s) {unknown} for row layout {self.names}")
+        bitmap = bytearray(self.bitmap_len)
+        out = bytearray()
+        for i, (name, type_code) in enumerate(self.layout):
+            value = row.get(name)
+            if value is None:
+                bitmap[i >> 3] |= 1 << (i & 7)
+                continue
+            try:
+                _encode_value(out, type_code, value)
+            except (TypeError, ValueError, struct.error, OverflowError):
+                raise ValueError(f"Column '{name}' is {_TYPE_NAMES[type_code]} but got {value!r}") from None
+        return bytes(bitmap) + bytes(out)
+
+    def decode(self, data, offset=0):
+        """Decode one row starting at offset; returns (row, offset after the row)."""
+        bitmap = data[offset:offset + self.bitmap_len]
+        offset += self.bitmap_len
+        row = {}
+        for i, (name, type_code) in enumerate(self.layout):
+            if bitmap[i >> 3] & (1 << (i & 7)):
+                row[name] = None
+                continue
+            row[name], offset = _decode_value(data, offset, type_code)
+        return row, offset
+
+
+def _encode_value(out, type_code, value):
+    if type_code == TYPE_INT:
+        if isinstance(value, float) or isinstance(value, str):
+            raise TypeError(value)
+        out += _INT.pack(value)
+    elif type_code == TYPE_FLOAT:
+        if isinstance(value, str):
+            raise TypeError(value)
+        out += _FLOAT.pack(float(value))
+    elif type_code == TYPE_BOOL:
+        if not isinstance(value, (bool, int)):
+            raise TypeError(value)
+        out.append(1 if value else 0)
+    elif type_code == TYPE_TEXT:
+        if isinstance(value, ToastPointer):
+            out += _U16.pack(TOAST_MARKER)
+            out += value.pack()
+            return
+        if not isinstance(value, str):
+            raise TypeError(value)
+        raw = value.encode("utf-8")
+        if len(raw) >= TOAST_MARKER:
+            raise ValueError(value)
+        out += _U16.pack(len(raw))
+        out += raw
+    else:
+        _encode_any(out, value)
+
+
+def _encode_any(out, value):
+    if isinstance(value, ToastPointer):
+        out.append(_TAG_TOAST)
+        out += value.pack()
+    elif isinstance(value, bool):
+        out.append(_TAG_BOOL)
+        out.append(1 if value else 0)
+    elif isinstance(value, int) and -2**63 <= value < 2**63:
+        out.append(_TAG_INT)
+        out += _INT.pack(value)
+    elif isinstance(value, float):
+        out.append(_TAG_FLOAT)
+        out += _FLOAT.pack(value)
+    elif isinstance(value, str) and len(value) < 16384:  # worst case 4 bytes/char still fits a u16 length
+        raw = value.encode("utf-8")
+        out.append(_TAG_TEXT)
+        out += _U16.pack(len(raw))
+        out += raw
+    else:
+        raw = json.dumps(value).encode("utf-8")
+        out.append(_TAG_JSON)
+        out += _U32.pack(len(raw))
+        out += raw
+
+
+def _decode_value(data, offset, type_code):
+    if type_code == TYPE_INT:
+        return _INT.unpack_from(data, offset)[0], offset + 8
+    if type_code == TYPE_FLOAT:
+        return _FLOAT.unpack_from(data, offset)[0], offset + 8
+    if type_code == TYPE_BOOL:
+        return data[offset] != 0, offset + 1
+    if type_code == TYPE_TEXT:
+        length = _U16.unpack_from(data, offset)[0]
+        offset += 2
+        if length == TOAST_MARKER:
+            return ToastPointer.unpack_from(data, offset)
+        return str(data[offset:offset + length], "utf-8"), offset + length
+    tag = data[offset]
+    offset += 1
+    if tag == _TAG_INT:
+        return _INT.unpack_from(data, offset)[0], offset + 8
+    if tag == _TAG_FLOAT:
+        return _FLOAT.unpack_from(data, offset)[0], offset + 8
+    if tag == _TAG_BOOL:
+        return data[offset] != 0, offset + 1
+    if tag == _TAG_TEXT:
+        length = _U16.unpack_from(data, offset)[0]
+        offset += 2
+        return str(data[offset:offset + length], "utf-8"), offset + length
+    if tag == _TAG_TOAST:
+        return ToastPointer.unpack_from(data, offset)
+    length = _U32.unpack_from(data, offset)[0]
+    offset += 4
+    return json.loads(str(data[offset:offset + length], "utf-8")), offset + length
+
+
+def page_capacity(codec):
+    """Bytes a page has for tuples and their slots once the header and layout are in place."""
+    return BLOCK_SIZE - PAGE_HEADER.size - len(codec.layout_bytes())
+
+
+def page_init(page, codec):
+    layout = codec.layout_bytes()
+    free_start = PAGE_HEADER.size + len(layout)
+    PAGE_HEADER.pack_into(page, 0, PAGE_MAGIC, 0, free_start, BLOCK_SIZE, len(layout), 0)
+    page[PAGE_HEADER.size:free_start] = layout
+
+
+def is_slotted_page(page):
+    return bytes(page[:2]) == PAGE_MAGIC
+
+
+def page_free_space(page):
+    """Bytes available for one more tuple (its slot entry already accounted for)."""
+    if not is_slotted_page(page):
+        return 0
+    _, _, free_start, free_end, _, _ = PAGE_HEADER.unpack_from(page)
+    return max(0, free_end - free_start - SLOT.size)
+
+
+def page_lsn(page):
+    """LSN of the last logged change to a page (0 for pages never stamped or not slotted)."""
+    if not is_slotted_page(page):
+        return 0
+    return PAGE_HEADER.unpack_from(page)[5]
+
+
+def page_set_lsn(page, lsn):
+    if is_slotted_page(page):
+        _PAGE_LSN.pack_into(page, PAGE_HEADER.size - _PAGE_LSN.size, lsn)
+
+
+def page_insert(page, codec, data):
+    """
+    Append an encoded tuple to a slotted page in place: the tuple goes at the end of the
+    free space, its slot at the end of the directory. Returns the slot number, or None if
+    the page is full or was written with a different layout.
+    """
+    if not is_slotted_page(page):
+        if any(page[:PAGE_HEADER.size]):
+            return None  # older block format: never appended to in place
+        page_init(page, codec)
+    _, slot_count, free_start, free_end, layout_len, lsn = PAGE_HEADER.unpack_from(page)
+    layout = codec.layout_bytes()
+    if layout_len != len(layout) or page[PAGE_HEADER.size:PAGE_HEADER.size + layout_len] != layout:
+        return None
+    if free_end - free_start < len(data) + SLOT.size:
+        return None
+    offset = free_end - len(data)
+    page[offset:free_end] = data
+    SLOT.pack_into(page, free_start, offset, len(data))
+    PAGE_HEADER.pack_into(page, 0, PAGE_MAGIC, slot_count + 1, free_start + SLOT.size, offset, layout_len, lsn)
+    return slot_count
+
+
+def page_delete(page, slot):
+    """Tombstone a slot by flipping its flag bit. Returns False if there is no live tuple there."""
+    if not is_slotted_page(page):
+        return False
+    _, slot_count, _, _, layout_len, _ = PAGE_HEADER.unpack_from(page)
+    if slot >= slot_count:
+        return False
+    pos = PAGE_HEADER.size + layout_len + slot * SLOT.size
+    offset, length = SLOT.unpack_from(page, pos)
+    if length & SLOT_DEAD:
+        return False
+    SLOT.pack_into(page, pos, offset, length | SLOT_DEAD)
+    return True
+
+
+def page_tuple(page, slot):
+    """The raw bytes of a live tuple, or None if the slot is empty or deleted."""
+    if not is_slotted_page(page):
+        return None
+    _, slot_count, _, _, layout_len, _ = PAGE_HEADER.unpack_from(page)
+    if slot >= slot_count:
+        return None
+    offset, length = SLOT.unpack_from(page, PAGE_HEADER.size + layout_len + slot * SLOT.size)
+    if length & SLOT_DEAD:
+        return None
+    return page[offset:offset + length]
+
+
+def page_live_slots(page):
+    if not is_slotted_page(page):
+        return 0
+    _, slot_count, _, _, layout_len, _ = PAGE_HEADER.unpack_from(page)
+    pos = PAGE_HEADER.size + layout_len
+    return sum(1 for i in range(slot_count) if not SLOT.unpack_from(page, pos + i * SLOT.size)[1] & SLOT_DEAD)
+
+
+def build_page(codec, encoded_rows):
+    """Build a full slotted page from rows already encoded with codec."""
+    page = bytearray(BLOCK_SIZE)
+    page_init(page, codec)
+    for data in encoded_rows:
+        if page_insert(page, codec, data) is None:
+            raise ValueError("Rows do not fit in one page")
+    return page
+
+
+def encode_rows_block(rows, codec=None):
+    """
+    Header: magic, slot count, free space start/end, layout length
+    Then the column layout (names + types, once per page) and the slot directory;
+    tuples are packed from the end of the page towards the directory.
+    """
+    codec = codec or RowCodec.for_rows(rows)
+    return bytes(build_page(codec, [codec.encode(row) for row in rows]))
+
+
+def decode_page(data):
+    """Return (slots, rows) for the live tuples of a block, in slot order."""
+    if not is_slotted_page(data):
+        rows = _decode_json_block(data) if len(data) >= 2 else []
+        return list(range(len(rows))), rows
+    _, slot_count, _, _, layout_len, _ = PAGE_HEADER.unpack_from(data)
+    codec, pos = RowCodec.from_layout_bytes(data, PAGE_HEADER.size)
+    slots, rows = [], []
+    for slot in range(slot_count):
+        offset, length = SLOT.unpack_from(data, pos)
+        pos += SLOT.size
+        if length & SLOT_DEAD:
+            continue
+        slots.append(slot)
+        rows.append(codec.decode(data, offset)[0])
+    return slots, rows
+
 
 def decode_rows_block(data):
-    if len(data) < 2:
-        return []
+    return decode_page(data)[1]
+
+
+def _decode_json_block(data):
+    # Blocks written before the binary format: 2-byte row count + JSON list
     row_count = int.from_bytes(data[:2], "big")
     if row_count == 0:
         return []
-    payload = data[2:]
+    payload = bytes(data[2:])  # data may be a memoryview of an mmap'd block
      # Remove trailing nulls (padding), then decode to string, then load JSON
     payload_str = payload.rstrip(b"\x00").decode("utf-8")
-    return json.loads(payload_str)
\ No newline at end of file
+    return json.loads(payload_str)
@@ -1,34 +1,361 @@
 import json
 import os
-from storage.row_packer import encode_rows_block, decode_rows_block
-from storage.block_manager import BlockManager
-from transaction.wal_manager import WALManager
+import struct
+import sys
+import threading
+from collections import OrderedDict
+from bisect import bisect_left
+from storage.row_packer import (RowCodec, ToastPointer, build_page, decode_page, page_capacity, page_delete,
+                                page_free_space, page_insert, page_live_slots, page_lsn, page_set_lsn,
+                                is_slotted_page, SLOT, TYPE_ANY, TYPE_TEXT)
+from storage.block_manager import BLOCK_SIZE, BlockManager
+from storage.predicate import row_matches
+from storage.toast import TOAST_THRESHOLD, ToastStore
+from transaction.wal_manager import DURABILITY_GROUP, WALManager
+
+DEFAULT_CACHE_BYTES = 8 << 20  # decoded rows a lazy store keeps in memory (estimated size)
+DEFAULT_CHECKPOINT_BYTES = 16 << 20  # WAL growth that triggers a checkpoint
+# Free space map (<table>.fsm), rewritten at each checkpoint so a lazy open needn't read the pages:
+# magic, block count, WAL LSN; then per block: free bytes, live rows, page LSN, flags
+FSM_MAGIC = b"FSM1"
+FSM_HEADER = struct.Struct("<4sIQ")
+FSM_ENTRY = struct.Struct("<HHQB")
+FSM_TOASTED = 1  # the block holds at least one ToastPointer
 
 class RowStore:
-    def __init__(self, table_name,pk="id", base_path='data/wal/'):
+    def __init__(self, table_name,pk="id", base_path='data/wal/', use_mmap=False, columns=None,
+                 toast_threshold=TOAST_THRESHOLD, lazy=False, cache_bytes=DEFAULT_CACHE_BYTES,
+                 durability=DURABILITY_GROUP, checkpoint_bytes=DEFAULT_CHECKPOINT_BYTES):
         self.table_name = table_name
         self.pk = pk
+        # Rows are encoded against the table's column dtypes; without a schema the
+        # layout is inferred from the rows themselves (every value self-describing)
+        self.schemaless = not columns
+        self.codec = RowCodec([]) if self.schemaless else RowCodec.from_columns(columns)
         self.block_path = os.path.join(base_path, f"{table_name}.tbl")
-        self.wal_manager = WALManager(table_name)
-        self.bm = BlockManager(self.block_path)
-        self.block_rows = {}  # block_num -> [row, ...]
+        self.fsm_path = os.path.join(base_path, f"{table_name}.fsm")
+        self.wal_manager = WALManager(table_name, durability=durability)
+        self.use_mmap = use_mmap
+        # The WAL covers the heap file, so its pages may stay dirty in the pool until a checkpoint
+        self.bm = BlockManager(self.block_path, use_mmap=use_mmap, write_through=False)
+        # Large TEXT/ANY values live in an overflow file and the row keeps a ToastPointer
+        self.toast_threshold = toast_threshold
+        self.toast_path = os.path.join(base_path, f"{table_name}.toast")
+        self._toast = None
+        self.toasted_blocks = set()  # blocks holding at least one ToastPointer
+        # A lazy store takes block metadata from the free space map (reading only the pages
+        # written since it) and decodes a block the first time it is touched, keeping decoded
+        # rows up to cache_bytes (LRU); pages stay authoritative
+        self.lazy = lazy
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.block_bytes = {}  # block_num -> estimated size of its decoded rows, for cached blocks
+        self.block_rows = OrderedDict() if lazy else {}  # block_num -> [row, ...] (live rows, in slot order)
+        self.block_slots = {}  # block_num -> [slot, ...] parallel to block_rows; (block, slot) is a stable row id
+        self.block_free = {}  # block_num -> bytes free for one more tuple
+        self.block_counts = {}  # block_num -> live rows
+        self.block_lsn = {}  # block_num -> LSN of the last WAL record applied to the page
+        self._unverified = set()  # blocks whose metadata came from the free space map, until redo reads them
+        self.checkpoint_bytes = checkpoint_bytes
+        self._pk_index = None  # primary key -> (block, slot), built on first use when lazy
+        # Serialises writers with the column-store handoff (see delete_row_ids)
+        self.lock = threading.RLock()
         self._load_blocks()
         self._recover_from_wal()
 
 
     def _load_blocks(self):
-        for block_num in range(self.bm.num_blocks()):
-            raw = self.bm.read_block(block_num)
-            rows = decode_rows_block(raw)
-            self.block_rows[block_num] = rows
+        start, fsm_lsn = self._load_fsm() if self.lazy else (0, 0)
+        for block_num in range(start, self.bm.num_blocks()):
+            self._read_meta(block_num, self.bm.read_block(block_num))
+        if not self.lazy:
+            self._build_pk_index()
+        # New records must sort after every change already on disk, even if the WAL was lost
+        self.wal_manager.lsn = max(self.wal_manager.lsn, fsm_lsn, max(self.block_lsn.values(), default=0))
+
+    def _read_meta(self, block_num, raw):
+        self.block_free[block_num] = page_free_space(raw)
+        self.block_lsn[block_num] = page_lsn(raw)
+        if self.lazy and (is_slotted_page(raw) or not any(raw[:2])):
+            self.block_counts[block_num] = page_live_slots(raw)
+        else:
+            self.block_counts[block_num] = len(self._decode_block(block_num, raw))
+
+    def _load_fsm(self):
+        """
+        Take block metadata from the free space map; returns (blocks covered, WAL LSN it was
+        written at). Pages changed since then have WAL records after the checkpoint, so redo
+        re-reads them (see _verify_block). A map for more blocks than the file has is ignored.
+        """
+        if not os.path.exists(self.fsm_path):
+            return 0, 0
+        with open(self.fsm_path, "rb") as f:
+            data = f.read()
+        if len(data) < FSM_HEADER.size:
+            return 0, 0
+        magic, count, lsn = FSM_HEADER.unpack_from(data)
+        if magic != FSM_MAGIC or count > self.bm.num_blocks() or len(data) != FSM_HEADER.size + count * FSM_ENTRY.size:
+            return 0, 0
+        for block_num, (free, live, last_lsn, flags) in enumerate(FSM_ENTRY.iter_unpack(data[FSM_HEADER.size:])):
+            self.block_free[block_num] = free
+            self.block_counts[block_num] = live
+            self.block_lsn[block_num] = last_lsn
+            if flags & FSM_TOASTED:
+                self.toasted_blocks.add(block_num)
+        self._unverified = set(range(count))
+        return count, lsn
+
+    def _fsm_bytes(self):
+        """The free space map for the current block metadata. Caller holds self.lock."""
+        count = self.bm.num_blocks()
+        return FSM_HEADER.pack(FSM_MAGIC, count, self.wal_manager.lsn) + b"".join(
+            FSM_ENTRY.pack(self.block_free.get(b, BLOCK_SIZE), self.block_counts.get(b, 0), self.block_lsn.get(b, 0),
+                           FSM_TOASTED if b in self.toasted_blocks else 0)
+            for b in range(count))
+
+    def _write_fsm(self, data):
+        tmp_path = self.fsm_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.fsm_path)
+
+    def _verify_block(self, block_num):
+        # The map may predate the page: its own header wins the first time redo touches it
+        if block_num in self._unverified:
+            self._unverified.discard(block_num)
+            self._read_meta(block_num, self.bm.read_block(block_num))
+
+    def _decode_block(self, block_num, raw):
+        slots, rows = decode_page(raw)
+        self.block_rows[block_num] = rows
+        self.block_slots[block_num] = slots
+        if any(type(v) is ToastPointer for row in rows for v in row.values()):
+            self.toasted_blocks.add(block_num)
+        if self.lazy:
+            size = sum(map(_row_size, rows))
+            self.cached_bytes += size - self.block_bytes.get(block_num, 0)
+            self.block_bytes[block_num] = size
+            self._evict()
+        return rows
+
+    def _evict(self):
+        """Drop least recently used decoded blocks (never the last one touched) while over cache_bytes."""
+        while self.cached_bytes > self.cache_bytes and len(self.block_rows) > 1:
+            evicted, _ = self.block_rows.popitem(last=False)
+            self.block_slots.pop(evicted, None)
+            self.cached_bytes -= self.block_bytes.pop(evicted, 0)
+
+    def _rows(self, block_num):
+        """Live rows of a block, decoding it first if a lazy store doesn't have it cached."""
+        rows = self.block_rows.get(block_num)
+        if rows is None:
+            if not self.lazy or block_num >= self.bm.num_blocks():
+                return self.block_rows.setdefault(block_num, [])
+            return self._decode_block(block_num, self.bm.read_block(block_num))
+        if self.lazy:
+            self.block_rows.move_to_end(block_num)
+        return rows
+
+    def _block_nums(self):
+        return range(self.bm.num_blocks()) if self.lazy else list(self.block_rows)
+
+    @property
+    def pk_index(self):
+        if self._pk_index is None:
+            self._build_pk_index()
+        return self._pk_index
+
+    def _build_pk_index(self):
+        self._pk_index = {}
+        for block_num in self._block_nums():
+            rows = self._rows(block_num)
+            for slot, row in zip(self._slots(block_num), rows):
+                key = row.get(self.pk)
+                if key is not None:
+                    self._pk_index[key] = (block_num, slot)
+
+    def set_pk(self, pk):
+        if pk and pk != self.pk:
+            self.pk = pk
+            self._pk_index = None
+
+    @property
+    def toast(self):
+        if self._toast is None:
+            self._toast = ToastStore(self.toast_path, use_mmap=self.use_mmap)
+        return self._toast
+
+    def _toast_row(self, codec, row):
+        """Move values larger than toast_threshold to overflow pages; returns the row as stored."""
+        stored = None
+        for name, type_code in codec.layout:
+            if (type_code != TYPE_TEXT and type_code != TYPE_ANY) or name == self.pk:
+                continue
+            value = row.get(name)
+            if isinstance(value, str):
+                if len(value) * 4 <= self.toast_threshold or len(value.encode("utf-8")) <= self.toast_threshold:
+                    continue
+            elif not isinstance(value, (list, dict)) or len(json.dumps(value)) <= self.toast_threshold:
+                continue
+            if stored is None:
+                stored = dict(row)
+            stored[name] = self.toast.store(value)
+        return row if stored is None else stored
+
+    def _detoast(self, row):
+        if not any(type(v) is ToastPointer for v in row.values()):
+            return row
+        return {k: self.toast.fetch(v) if type(v) is ToastPointer else v for k, v in row.items()}
+
+    def _free_toast(self, row):
+        for value in row.values():
+            if type(value) is ToastPointer:
+                self.toast.free(value)
+
+    def set_columns(self, columns):
+        """Switch a store opened without a schema over to the table's column layout."""
+        if columns:
+            self.schemaless = False
+            self.codec = RowCodec.from_columns(columns)
+
+    def _codec_for(self, rows):
+        if self.schemaless and not all(self.codec.covers(row) for row in rows):
+            self.codec = RowCodec.for_rows(rows, base=self.codec)
+        return self.codec
+
+    def _encode_row(self, codec, row):
+        data = codec.encode(row)
+        if len(data) + SLOT.size > page_capacity(codec):
+            raise ValueError(f"Row is {len(data)} bytes and does not fit in a {BLOCK_SIZE}-byte block")
+        return data
+
+    def _slots(self, block_num):
+        # Blocks loaded without slot info were written densely, slot i holding row i
+        rows = self._rows(block_num) if self.lazy else self.block_rows.get(block_num, [])
+        return self.block_slots.setdefault(block_num, list(range(len(rows))))
+
+    def _append_tuples(self, block_num, rows, encoded, codec, start=0, originals=None, log=None, lsn=None):
+        """
+        Append rows[start:] to a block in place (tuple + slot + header only) until it is full.
+        With originals each row is logged as log(original, (block, slot)) (as given, before toasting),
+        while the page is still pinned; the page is stamped with the last LSN (or with lsn, on redo).
+        Returns how many rows went in.
+        """
+        block = self._rows(block_num)
+        slots = self._slots(block_num)
+        frame = self.bm.pin_block(block_num)
+        count = 0
+        try:
+            for i in range(start, len(rows)):
+                slot = page_insert(frame.data, codec, encoded[i])
+                if slot is None:
+                    break
+                if originals is not None:
+                    lsn = log(originals[i], (block_num, slot))
+                block.append(rows[i])
+                slots.append(slot)
+                if self.lazy:
+                    size = _row_size(rows[i])
+                    self.block_bytes[block_num] = self.block_bytes.get(block_num, 0) + size
+                    self.cached_bytes += size
+                key = rows[i].get(self.pk)
+                if key is not None and self._pk_index is not None:
+                    self._pk_index[key] = (block_num, slot)
+                if self._toast is not None and any(type(v) is ToastPointer for v in rows[i].values()):
+                    self.toasted_blocks.add(block_num)
+                count += 1
+            if count and lsn:
+                page_set_lsn(frame.data, lsn)
+                self.block_lsn[block_num] = lsn
+            self.block_free[block_num] = page_free_space(frame.data)
+            self.block_counts[block_num] = self.block_counts.get(block_num, 0) + count
+        finally:
+            self.bm.unpin_block(frame, dirty=count > 0)
+        if self.lazy:
+            self._evict()
+        return count
 
     def _recover_from_wal(self):
-        # Replay WAL and insert each row as if it was new
-        def apply_row(row):
+        # Redo each logged change whose page doesn't have it yet; records without a row id
+        # (older logs) are applied as if they were new
+        replayed = []
+        def apply_row(row, lsn=0, row_id=None):
+            replayed.append(lsn)
+            if row_id is None:
+                self._insert_without_wal(row)
+            else:
+                self._redo_insert(row, lsn, row_id)
+        def apply_delete(key, lsn=0, row_id=None):
+            replayed.append(lsn)
+            if row_id is None:
+                self._delete_without_wal(key)
+            else:
+                self._redo_delete(lsn, row_id)
+        def apply_update(key, row, lsn, old_row_id, new_row_id):
+            replayed.append(lsn)
+            self._redo_update(row, lsn, old_row_id, new_row_id)
+        self.wal_manager.replay(apply_row, apply_delete, apply_update)
+        self._unverified.clear()
+        if replayed:
+            # Next start begins after what was just redone
+            self.checkpoint()
+
+    def _redo_insert(self, row, lsn, row_id):
+        block_num = row_id[0]
+        self._verify_block(block_num)
+        if self.block_lsn.get(block_num, 0) >= lsn:
+            return
+        while self.bm.num_blocks() <= block_num:
+            self.bm.allocate_block()
+        codec = self._codec_for([row])
+        stored = self._toast_row(codec, row)
+        if not self._append_tuples(block_num, [stored], [self._encode_row(codec, stored)], codec, lsn=lsn):
+            # The page no longer matches the log (e.g. it was rewritten); keep the row anyway
+            self._free_toast(stored)
             self._insert_without_wal(row)
-        def apply_delete(key):
-            self._delete_without_wal(key)
-        self.wal_manager.replay(apply_row,apply_delete)
+
+    def _redo_delete(self, lsn, row_id):
+        block_num, slot = row_id
+        if block_num >= self.bm.num_blocks():
+            return
+        self._verify_block(block_num)
+        if self.block_lsn.get(block_num, 0) >= lsn:
+            return
+        self._delete_row_id(row_id, lsn, redo=True)
+
+    def _redo_update(self, row, lsn, old_row_id, new_row_id):
+        # Both halves are checked against their pages before either is applied: when the rows
+        # share a block, redoing the insert stamps the page with this LSN
+        stale = False
+        if old_row_id[0] < self.bm.num_blocks():
+            self._verify_block(old_row_id[0])
+            stale = self.block_lsn.get(old_row_id[0], 0) < lsn
+        self._redo_insert(row, lsn, new_row_id)
+        if stale:
+            self._delete_row_id(old_row_id, lsn, redo=True)
+
+    def checkpoint(self):
+        """
+        Fuzzy checkpoint: note the WAL's current LSN, write back and fsync the table's pages
+        and the free space map, then recycle the WAL up to that LSN. Changes made meanwhile
+        carry newer page LSNs, so replaying them again is a no-op.
+        """
+        # Opening first: converting a JSON-lines log numbers its records, and they are covered too
+        self.wal_manager.open()
+        redo_lsn = self.wal_manager.lsn
+        with self.lock:
+            fsm = self._fsm_bytes()
+        if self._toast is not None:
+            self._toast.bm.sync()
+        self.bm.sync()
+        self._write_fsm(fsm)
+        self.wal_manager.checkpoint(redo_lsn)
+
+    def _maybe_checkpoint(self):
+        if self.wal_manager.wal_bytes >= self.checkpoint_bytes:
+            self.checkpoint()
 
     # def _load_wal(self):
     #     if os.path.exists(self.wal_path):
@@ -38,85 +365,260 @@ class RowStore:
     #                 self.rows.append(row)
 
     def insert_row(self, row):
-        self.wal_manager.log_insert(row)
-        self._insert_without_wal(row)
+        with self.lock:
+            self._place_rows([row], log=self._log_insert)
+        self.wal_manager.commit(self.wal_manager.lsn)
+        self._maybe_checkpoint()
 
 
     def bulk_insert_rows(self, rows: list[dict]):
         """
         Insert a batch of rows with minimal WAL and block writes.
         """
-        # 1. WAL: log all rows at once (if your WALManager supports batch logging, otherwise loop)
-        self.wal_manager.log_insert_many(rows) if hasattr(self.wal_manager, "log_insert_many") else [self.wal_manager.log_insert(r) for r in rows]
-        
-        # 2. Buffer rows for block writing
-        buffer = []
-        last_block = self.bm.num_blocks() - 1
-        if last_block >= 0:
-            buffer = self.block_rows.get(last_block, [])
-        
-        for row in rows:
-            buffer.append(row)
-            # If buffer full, write and start new block
-            if len(buffer) >= 50:
-                block_num = last_block if last_block >= 0 else self.bm.allocate_block()
-                self.block_rows[block_num] = buffer
-                self.bm.write_block(block_num, encode_rows_block(buffer))
-                buffer = []
-                last_block = self.bm.allocate_block()
-        # Write any remaining rows in buffer
-        if buffer:
-            block_num = last_block if last_block >= 0 else self.bm.allocate_block()
-            self.block_rows[block_num] = buffer
-            self.bm.write_block(block_num, encode_rows_block(buffer))
+        # Each row is logged as it lands; the whole batch shares one WAL commit
+        with self.lock:
+            self._place_rows(rows, log=self._log_insert)
+        self.wal_manager.commit(self.wal_manager.lsn)
+        self._maybe_checkpoint()
 
     def _insert_without_wal(self, row):
-        # Try to fit in the last block
+        self._place_rows([row])
+
+    def _log_insert(self, row, row_id):
+        return self.wal_manager.log_insert(row, row_id, wait=False)
+
+    def _place_rows(self, rows, log=None):
+        if not rows:
+            return
+        # Fill the last block's free space, then as many fresh blocks as needed
+        codec = self._codec_for(rows)
+        stored = [self._toast_row(codec, row) for row in rows]
+        encoded = [self._encode_row(codec, row) for row in stored]
+        originals = rows if log is not None else None
+        done = 0
         last_block = self.bm.num_blocks() - 1
-        if last_block < 0 or len(self.block_rows.get(last_block, [])) >= 50:  # limit: 50 rows/block
-            block_num = self.bm.allocate_block()
-            rows = []
-        else:
-            block_num = last_block
-            rows = self.block_rows.get(block_num, [])
-        rows.append(row)
-        self.block_rows[block_num] = rows
-        self.bm.write_block(block_num, encode_rows_block(rows))
+        if last_block >= 0 and self.block_free.get(last_block, BLOCK_SIZE) >= len(encoded[0]):
+            done = self._append_tuples(last_block, stored, encoded, codec, originals=originals, log=log)
+        while done < len(rows):
+            done += self._append_tuples(self.bm.allocate_block(), stored, encoded, codec, start=done,
+                                        originals=originals, log=log)
+
+    def close(self):
+        """Write back and release the table's files."""
+        self.bm.close()
+        self.wal_manager.close()
+        if self._toast is not None:
+            self._toast.close()
+            self._toast = None
 
     def drop(self):
         """Remove all persistent files and in-memory blocks for this table."""
-        # Remove block file
-        if os.path.exists(self.block_path):
-            os.remove(self.block_path)
+        # Remove block file (cached pages are dropped, not written back)
+        self.bm.close(flush=False)
+        for path in (self.block_path, self.fsm_path):
+            if os.path.exists(path):
+                os.remove(path)
+        if self._toast is not None:
+            self._toast.close(flush=False)
+            self._toast = None
+        if os.path.exists(self.toast_path):
+            os.remove(self.toast_path)
         # Remove WAL file
+        self.wal_manager.close(flush=False)
         if os.path.exists(self.wal_manager.wal_path):
             os.remove(self.wal_manager.wal_path)
         # Clear in-memory state
         self.block_rows.clear()
+        self.block_bytes.clear()
+        self.cached_bytes = 0
+        self.block_counts.clear()
+        self.toasted_blocks.clear()
+        self._pk_index = {}
 
     def delete_row(self, key_value):
-        self.wal_manager.log_delete(key_value)
-        self._delete_without_wal(key_value)
+        with self.lock:
+            row_id = self.pk_index.get(key_value)
+            if row_id is None:
+                return False
+            lsn = self.wal_manager.log_delete(key_value, row_id)
+            self._delete_row_id(row_id, lsn)
+        self._maybe_checkpoint()
+        return True
+
+    def delete_row_ids(self, rows):
+        """
+        Delete rows by ((block, slot), pk value) with one WAL commit, e.g. once they have been
+        copied to the column store. Returns the pairs no longer present: deleted or updated since.
+        """
+        gone, lsn = [], 0
+        with self.lock:
+            for row_id, key_value in rows:
+                i = self._find_row(row_id, key_value)
+                if i is None:
+                    gone.append((row_id, key_value))
+                    continue
+                lsn = self.wal_manager.log_delete(key_value, row_id, wait=False)
+                self._delete_at(row_id[0], i, lsn)
+        if lsn:
+            self.wal_manager.commit(lsn)
+        self._maybe_checkpoint()
+        return gone
+
+    def missing_row_ids(self, rows):
+        """The ((block, slot), pk value) pairs of rows that are no longer present."""
+        with self.lock:
+            return [(row_id, key_value) for row_id, key_value in rows if self._find_row(row_id, key_value) is None]
+
+    def _find_row(self, row_id, key_value):
+        """Index of the row in its block's lists, or None if it was deleted (or the slot reused)."""
+        block_num, slot = row_id
+        slots = self._slots(block_num) if block_num < self.bm.num_blocks() else []
+        i = bisect_left(slots, slot)
+        if i == len(slots) or slots[i] != slot or self._rows(block_num)[i].get(self.pk) != key_value:
+            return None
+        return i
 
     def _delete_without_wal(self, key_value):
-        for block_num, rows in self.block_rows.items():
-            for i, row in enumerate(rows):
-                if row.get(self.pk) == key_value:
-                    del rows[i]
-                    self.bm.write_block(block_num, encode_rows_block(rows))
-                    return True
-        return False
+        row_id = self.pk_index.get(key_value)
+        if row_id is None:
+            return False
+        return self._delete_row_id(row_id, redo=True)
+
+    def _delete_row_id(self, row_id, lsn=None, redo=False):
+        block_num, slot = row_id
+        # Slots of a block are kept in ascending order
+        slots = self._slots(block_num)
+        i = bisect_left(slots, slot)
+        if i == len(slots) or slots[i] != slot:
+            return False
+        self._delete_at(block_num, i, lsn, redo)
+        return True
+
+    def get_row(self, key_value):
+        """Point lookup by primary key."""
+        row_id = self.pk_index.get(key_value)
+        if row_id is None:
+            return None
+        block_num, slot = row_id
+        row = self._rows(block_num)[bisect_left(self._slots(block_num), slot)]
+        return self._detoast(row) if block_num in self.toasted_blocks else row
+
+    def update_row(self, key_value, row):
+        """Replace the row with this primary key, logged as one UPDATE record so a crash can't split it."""
+        with self.lock:
+            old_row_id = self.pk_index.get(key_value)
+            if old_row_id is None:
+                return False
+            lsns = []
+            def log_update(new_row, new_row_id):
+                lsns.append(self.wal_manager.log_update(key_value, old_row_id, new_row, new_row_id, wait=False))
+                return lsns[-1]
+            # The new row goes in first, then the old one is deleted under the same LSN
+            self._place_rows([row], log=log_update)
+            self._delete_row_id(old_row_id, lsns[-1])
+        self.wal_manager.commit(lsns[-1])
+        self._maybe_checkpoint()
+        return True
+
+    def _delete_at(self, block_num, i, lsn=None, redo=False):
+        rows = self._rows(block_num)
+        slots = self._slots(block_num)
+        # Only the slot's flag changes; the tuple's space is left as a tombstone
+        frame = self.bm.pin_block(block_num)
+        try:
+            deleted = page_delete(frame.data, slots[i])
+            if deleted and lsn:
+                page_set_lsn(frame.data, lsn)
+                self.block_lsn[block_num] = lsn
+        finally:
+            self.bm.unpin_block(frame, dirty=deleted)
+        if block_num in self.toasted_blocks and not redo:
+            # Overflow frees aren't logged: on redo the stale page's chains may already have been
+            # freed and reused (even by an earlier redo insert), so they are leaked instead
+            self._free_toast(rows[i])
+        if self.lazy:
+            size = _row_size(rows[i])
+            self.block_bytes[block_num] = self.block_bytes.get(block_num, 0) - size
+            self.cached_bytes -= size
+        if self._pk_index is not None and self._pk_index.get(rows[i].get(self.pk)) == (block_num, slots[i]):
+            del self._pk_index[rows[i].get(self.pk)]
+        del rows[i]
+        del slots[i]
+        self.block_counts[block_num] = len(rows)
+        if not deleted:
+            # Block from an older format: rewrite it as a slotted page, renumbering its rows
+            codec = self._codec_for(rows)
+            page = build_page(codec, [codec.encode(r) for r in rows])
+            if lsn:
+                page_set_lsn(page, lsn)
+                self.block_lsn[block_num] = lsn
+            self.bm.write_block(block_num, page)
+            slots[:] = range(len(rows))
+            self.block_free[block_num] = page_free_space(page)
+            for slot, row in enumerate(rows):
+                if row.get(self.pk) is not None and self._pk_index is not None:
+                    self._pk_index[row.get(self.pk)] = (block_num, slot)
+
+    def row_count(self):
+        """Live rows in the table, from block metadata (no block is decoded)."""
+        return sum(self.block_counts.values())
+
+    def scan(self, columns=None, where=None):
+        """
+        Yield live rows block by block; a lazy store decodes each block only when reached.
+        With columns each row holds just those keys (and only their overflow values are fetched).
+        where is a list of (column, op, value) predicates (see storage.predicate) rows must match.
+        """
+        for block_num in self._block_nums():
+            # Copy the block's row list so callers may delete while iterating
+            rows = list(self._rows(block_num))
+            toasted = block_num in self.toasted_blocks
+            if where:
+                rows = [row for row in rows if row_matches(self._detoast(row) if toasted else row, where)]
+            if columns is not None:
+                rows = [{name: row.get(name) for name in columns} for row in rows]
+            if toasted:
+                yield from (self._detoast(row) for row in rows)
+            else:
+                yield from rows
 
     def get_rows(self):
-        all_rows = []
-        for rows in self.block_rows.values():
-            all_rows.extend(rows)
-        return all_rows
-    
-def clear(self):
-        self.block_rows = {}
+        return list(self.scan())
+
+    def get_rows_with_ids(self):
+        """Live rows as ((block, slot), row) pairs, oldest blocks first."""
+        with self.lock:
+            return [((block_num, slot), self._detoast(row) if block_num in self.toasted_blocks else row)
+                    for block_num in self._block_nums()
+                    for slot, row in zip(self._slots(block_num), self._rows(block_num))]
+
+    def clear(self):
+        """Empty the table (its rows have moved to the column store) and truncate the WAL."""
+        for block_num in list(self.toasted_blocks):
+            for row in self._rows(block_num):
+                self._free_toast(row)
+        self.bm.truncate(0)
+        if os.path.exists(self.fsm_path):
+            os.remove(self.fsm_path)
+        self.block_rows = OrderedDict() if self.lazy else {}
+        self.block_bytes.clear()
+        self.cached_bytes = 0
+        self.block_slots.clear()
+        self.block_free.clear()
+        self.block_counts.clear()
+        self.block_lsn.clear()
+        self.toasted_blocks.clear()
+        self._pk_index = {}
         self.wal_manager.clear()
     
+    def clear_if_empty(self):
+        """clear() unless rows were inserted meanwhile, reclaiming blocks emptied by delete_row_ids."""
+        with self.lock:
+            if self.row_count():
+                return False
+            self.clear()
+            return True
+
     # def clear(self):
     #     """Clear rows and WAL after flushing."""
     #     self.rows = []
@@ -128,4 +630,9 @@ def clear(self):
     #         with open(self.wal_path, "r") as f:
     #             for line in f:
     #                 row = json.loads(line.strip())
-    #                 self.rows.append(row)
\ No newline at end of file
+    #                 self.rows.append(row)
+
+
+def _row_size(row):
+    # Rough in-memory size of a decoded row; column names are shared between rows
+    return sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row.values())
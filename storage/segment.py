@@ -0,0 +1,533 @@
+import json
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+import zstandard as zstd
+
+from storage.bloom import BloomFilter
+from storage.predicate import range_may_match, value_matches
+from storage.row_packer import TYPE_ANY, TYPE_BOOL, TYPE_FLOAT, TYPE_INT, TYPE_TEXT
+
+SEGMENT_EXT = ".seg"
+SEGMENT_MAGIC = b"FSEG"
+# File tail: footer length, magic
+TAIL = struct.Struct("<I4s")
+# Footer: row count, column count; then per column: name length + name, FOOTER_COLUMN, FOOTER_STATS
+# and, if it has bounds, the column's min and max (see _pack_bound); then a Bloom filter count and
+# per filter: column name length + name, the serialized BloomFilter; then the name length + name of
+# the column the rows are sorted by (nulls last), empty if they are in insertion order
+FOOTER_HEADER = struct.Struct("<IH")
+FOOTER_COLUMN = struct.Struct("<BQQ")  # type code, chunk offset, chunk length
+FOOTER_STATS = struct.Struct("<IB")    # null count, has-bounds flag
+# Column chunk (zstd-compressed): header byte (bit 0 has-nulls, bits 1+ encoding), [null bitmap],
+# then the values in that encoding. Null positions hold a copy of a neighbouring value.
+#   ENC_PLAIN: the values as laid out by _encode_plain
+#     INT/FLOAT/BOOL: little-endian int64 / float64 / int8 array
+#     TEXT: (count + 1) little-endian uint32 offsets, then the UTF-8 data
+#     ANY: JSON list (mixed or nested values)
+#   ENC_DICT: DICT_HEADER, the per-row codes bit-packed, then the distinct values (plain)
+#   ENC_RLE: run count, run lengths (uint32), then each run's value (plain)
+#   ENC_DELTA / ENC_FOR (INT only): PACKED_INT_HEADER, then (count) bit-packed offsets: deltas from
+#     the previous value for non-decreasing columns, or distances from the minimum otherwise
+ENC_PLAIN = 0
+ENC_DICT = 1
+ENC_RLE = 2
+ENC_DELTA = 3
+ENC_FOR = 4
+DICT_HEADER = struct.Struct("<IB")        # distinct values, code width in bits
+PACKED_INT_HEADER = struct.Struct("<qB")  # base value, width in bits
+_COUNT = struct.Struct("<I")
+_ARRAY_TYPECODES = {TYPE_INT: "q", TYPE_FLOAT: "d", TYPE_BOOL: "b"}
+_BIG_ENDIAN = sys.byteorder == "big"
+_PACK_WIDTHS = (1, 2, 4, 8, 16, 32, 64)
+_WIDE_TYPECODES = {8: "B", 16: "H", 32: "I", 64: "Q"}
+# byte -> the (8 // width) values packed in it, lowest bits first
+_UNPACK_TABLES = {w: [tuple((b >> (w * j)) & ((1 << w) - 1) for j in range(8 // w)) for b in range(256)]
+                  for w in (1, 2, 4)}
+MAX_DICT_SIZE = 1 << 16
+
+
+def column_type(values):
+    """Narrowest segment type holding every non-null value without changing it."""
+    kinds = {type(v) for v in values if v is not None}
+    if kinds == {int} and all(-2**63 <= v < 2**63 for v in values if v is not None):
+        return TYPE_INT
+    if kinds == {float}:
+        return TYPE_FLOAT
+    if kinds == {bool}:
+        return TYPE_BOOL
+    if kinds == {str}:
+        return TYPE_TEXT
+    return TYPE_ANY
+
+
+def _to_le(arr):
+    if _BIG_ENDIAN:
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _from_le(typecode, data):
+    arr = array(typecode)
+    arr.frombytes(data)
+    if _BIG_ENDIAN:
+        arr.byteswap()
+    return arr
+
+
+def _pack_width(max_value):
+    return next(w for w in _PACK_WIDTHS if max_value < 1 << w)
+
+
+def _pack(values, width):
+    """Bit-pack non-negative ints below 2**width; width is one of _PACK_WIDTHS."""
+    if width >= 8:
+        return _to_le(array(_WIDE_TYPECODES[width], values))
+    per = 8 // width
+    values = list(values) + [0] * (-len(values) % per)
+    return bytes(sum(v << (width * j) for j, v in enumerate(values[i:i + per]))
+                 for i in range(0, len(values), per))
+
+
+def _unpack(data, pos, width, count):
+    """Return (values, next position)."""
+    if width >= 8:
+        end = pos + count * width // 8
+        return _from_le(_WIDE_TYPECODES[width], data[pos:end]), end
+    end = pos + (count * width + 7) // 8
+    table = _UNPACK_TABLES[width]
+    return [v for b in data[pos:end] for v in table[b]][:count], end
+
+
+def _encode_plain(type_code, values):
+    if type_code in _ARRAY_TYPECODES:
+        return _to_le(array(_ARRAY_TYPECODES[type_code], values))
+    if type_code == TYPE_TEXT:
+        offsets, data = array("I", [0]), bytearray()
+        for v in values:
+            data += v.encode("utf-8")
+            offsets.append(len(data))
+        return _to_le(offsets) + bytes(data)
+    return json.dumps(values).encode("utf-8")
+
+
+def _decode_plain(type_code, data, pos, count):
+    """Return (values, next position); numeric types come back as array.array."""
+    if type_code in _ARRAY_TYPECODES:
+        typecode = _ARRAY_TYPECODES[type_code]
+        end = pos + count * array(typecode).itemsize
+        return _from_le(typecode, data[pos:end]), end
+    if type_code == TYPE_TEXT:
+        text_start = pos + (count + 1) * 4
+        offsets = _from_le("I", data[pos:text_start])
+        text = bytes(data[text_start:text_start + offsets[-1]])
+        return [text[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(count)], text_start + offsets[-1]
+    return json.loads(bytes(data[pos:]).decode("utf-8")), len(data)
+
+
+def _fill_nulls(type_code, values):
+    """Replace nulls by the previous value (the first value for leading nulls) so runs stay intact."""
+    present = next((v for v in values if v is not None), None)
+    if present is None:
+        present = {TYPE_INT: 0, TYPE_FLOAT: 0.0, TYPE_BOOL: False, TYPE_TEXT: ""}.get(type_code)
+    filled = []
+    for v in values:
+        if v is not None:
+            present = v
+        filled.append(present)
+    return filled
+
+
+def _runs(type_code, values):
+    # Floats compare by repr so 0.0 and -0.0 stay distinct
+    key = repr if type_code == TYPE_FLOAT else None
+    lengths, run_values = [], []
+    for v in values:
+        if run_values and (key(run_values[-1]) == key(v) if key else run_values[-1] == v):
+            lengths[-1] += 1
+        else:
+            run_values.append(v)
+            lengths.append(1)
+    return lengths, run_values
+
+
+def _encodings(type_code, values):
+    """Yield (encoding, body) for every encoding that suits the (null-filled) values."""
+    yield ENC_PLAIN, _encode_plain(type_code, values)
+    if type_code == TYPE_ANY or not values:
+        return
+    lengths, run_values = _runs(type_code, values)
+    if len(run_values) * 4 <= len(values):
+        yield ENC_RLE, _COUNT.pack(len(run_values)) + _to_le(array("I", lengths)) + _encode_plain(type_code, run_values)
+    if type_code in (TYPE_INT, TYPE_TEXT):
+        distinct = list(dict.fromkeys(values))
+        if len(distinct) * 2 <= len(values) and len(distinct) <= MAX_DICT_SIZE:
+            codes = {v: i for i, v in enumerate(distinct)}
+            width = _pack_width(len(distinct) - 1)
+            yield ENC_DICT, (DICT_HEADER.pack(len(distinct), width) + _pack([codes[v] for v in values], width) +
+                             _encode_plain(type_code, distinct))
+    if type_code == TYPE_INT:
+        deltas = [b - a for a, b in zip(values, values[1:])]
+        if all(d >= 0 for d in deltas):
+            width = _pack_width(max(deltas, default=0))
+            yield ENC_DELTA, PACKED_INT_HEADER.pack(values[0], width) + _pack([0] + deltas, width)
+        else:
+            low = min(values)
+            width = _pack_width(max(values) - low)
+            if width < 64:
+                yield ENC_FOR, PACKED_INT_HEADER.pack(low, width) + _pack([v - low for v in values], width)
+
+
+def encode_column(type_code, values):
+    """Chunk bytes for a column, in whichever suitable encoding is smallest."""
+    nulls = [v is None for v in values]
+    has_nulls = any(nulls)
+    encoding, body = min(_encodings(type_code, _fill_nulls(type_code, values) if has_nulls else values),
+                         key=lambda e: len(e[1]))
+    out = bytearray([has_nulls | encoding << 1])
+    if has_nulls:
+        bitmap = bytearray((len(values) + 7) // 8)
+        for i, is_null in enumerate(nulls):
+            if is_null:
+                bitmap[i >> 3] |= 1 << (i & 7)
+        out += bitmap
+    out += body
+    return bytes(out)
+
+
+def _chunk_header(data, row_count):
+    """Return (encoding, null bitmap or None, body position)."""
+    nulls = None
+    pos = 1
+    if data[0] & 1:
+        nulls = bytes(data[1:1 + (row_count + 7) // 8])
+        pos += len(nulls)
+    return data[0] >> 1, nulls, pos
+
+
+def _decode_runs(type_code, data, pos):
+    """Return (run lengths, run values) of an ENC_RLE body."""
+    run_count = _COUNT.unpack_from(data, pos)[0]
+    pos += _COUNT.size
+    lengths = _from_le("I", data[pos:pos + run_count * 4])
+    return lengths, _decode_plain(type_code, data, pos + run_count * 4, run_count)[0]
+
+
+def _decode_dict(type_code, data, pos, row_count):
+    """Return (codes, distinct values) of an ENC_DICT body."""
+    size, width = DICT_HEADER.unpack_from(data, pos)
+    codes, pos = _unpack(data, pos + DICT_HEADER.size, width, row_count)
+    return codes, _decode_plain(type_code, data, pos, size)[0]
+
+
+def decode_column(type_code, data, row_count):
+    """Return (values, nulls): an array (numeric types) or list, and the null bitmap or None."""
+    encoding, nulls, pos = _chunk_header(data, row_count)
+    if encoding == ENC_PLAIN:
+        return _decode_plain(type_code, data, pos, row_count)[0], nulls
+    if encoding == ENC_DICT:
+        codes, distinct = _decode_dict(type_code, data, pos, row_count)
+        values = [distinct[c] for c in codes]
+    elif encoding == ENC_RLE:
+        values = []
+        for length, value in zip(*_decode_runs(type_code, data, pos)):
+            values.extend([value] * length)
+    elif encoding in (ENC_DELTA, ENC_FOR):
+        base, width = PACKED_INT_HEADER.unpack_from(data, pos)
+        offsets = _unpack(data, pos + PACKED_INT_HEADER.size, width, row_count)[0]
+        if encoding == ENC_DELTA:
+            values = accumulate(offsets, initial=base)
+            next(values)  # the first delta is 0: skip the seed
+        else:
+            values = (base + d for d in offsets)
+    else:
+        raise ValueError(f"Unknown column encoding {encoding}")
+    if type_code in _ARRAY_TYPECODES and not isinstance(values, array):
+        values = array(_ARRAY_TYPECODES[type_code], values)
+    return values, nulls
+
+
+def match_column(type_code, data, row_count, op, value):
+    """
+    Evaluate `v op value` for every row of a chunk; returns a list of bools (False for nulls).
+    Dictionary and run-length chunks compare each distinct value or run once instead of every row.
+    """
+    encoding, nulls, pos = _chunk_header(data, row_count)
+    if encoding == ENC_DICT:
+        codes, distinct = _decode_dict(type_code, data, pos, row_count)
+        hits = [value_matches(v, op, value) for v in distinct]
+        matches = [hits[c] for c in codes]
+    elif encoding == ENC_RLE:
+        matches = []
+        for length, v in zip(*_decode_runs(type_code, data, pos)):
+            matches.extend([value_matches(v, op, value)] * length)
+    else:
+        matches = [value_matches(v, op, value) for v in decode_column(type_code, data, row_count)[0]]
+    if nulls is not None:
+        for i in range(row_count):
+            if nulls[i >> 3] & (1 << (i & 7)):
+                matches[i] = False
+    return matches
+
+
+def _with_nulls(values, nulls, type_code=None):
+    values = values.tolist() if isinstance(values, array) else list(values)
+    if type_code == TYPE_BOOL:
+        values = [bool(v) for v in values]
+    if nulls is not None:
+        for i in range(len(values)):
+            if nulls[i >> 3] & (1 << (i & 7)):
+                values[i] = None
+    return values
+
+
+_BOUND_FORMATS = {TYPE_INT: struct.Struct("<q"), TYPE_FLOAT: struct.Struct("<d"), TYPE_BOOL: struct.Struct("<?")}
+_TEXT_LENGTH = struct.Struct("<I")
+
+
+def column_stats(type_code, values):
+    """(null count, min, max); min and max are None for ANY columns, all-null columns and NaNs."""
+    present = [v for v in values if v is not None]
+    if type_code == TYPE_ANY or not present or (type_code == TYPE_FLOAT and any(v != v for v in present)):
+        return len(values) - len(present), None, None
+    return len(values) - len(present), min(present), max(present)
+
+
+def _pack_bound(type_code, value):
+    if type_code == TYPE_TEXT:
+        raw = value.encode("utf-8")
+        return _TEXT_LENGTH.pack(len(raw)) + raw
+    return _BOUND_FORMATS[type_code].pack(value)
+
+
+def _unpack_bound(type_code, data, pos):
+    """Return (value, next position)."""
+    if type_code == TYPE_TEXT:
+        length = _TEXT_LENGTH.unpack_from(data, pos)[0]
+        pos += _TEXT_LENGTH.size
+        return bytes(data[pos:pos + length]).decode("utf-8"), pos + length
+    fmt = _BOUND_FORMATS[type_code]
+    return fmt.unpack_from(data, pos)[0], pos + fmt.size
+
+
+def sort_value(value):
+    """Sort key of one value in sort_order: nulls last."""
+    return (value is None, value if value is not None else 0)
+
+
+def sort_order(column):
+    """Key function ordering rows by column, nulls last; the order sorted segments are written in."""
+    def key(row):
+        return sort_value(row.get(column))
+    return key
+
+
+def encode_segment(rows, bloom_columns=(), sort_key=None):
+    """
+    Columnar segment bytes for a list of row dicts (columns are the keys of the first row).
+    Columns in bloom_columns (typically the primary key) also get a Bloom filter for point lookups.
+    sort_key names the column the rows are already sorted by (see sort_order), which lets
+    readers binary-search it.
+    """
+    names = list(rows[0])
+    compressor = zstd.ZstdCompressor()
+    body = bytearray()
+    entries = []
+    for name in names:
+        values = [row.get(name) for row in rows]
+        type_code = column_type(values)
+        chunk = compressor.compress(encode_column(type_code, values))
+        entries.append((name, type_code, len(body), len(chunk), column_stats(type_code, values)))
+        body += chunk
+    footer = bytearray(FOOTER_HEADER.pack(len(rows), len(names)))
+    for name, type_code, offset, length, (null_count, lo, hi) in entries:
+        raw = name.encode("utf-8")
+        footer += struct.pack("<H", len(raw)) + raw
+        footer += FOOTER_COLUMN.pack(type_code, offset, length)
+        footer += FOOTER_STATS.pack(null_count, lo is not None)
+        if lo is not None:
+            footer += _pack_bound(type_code, lo) + _pack_bound(type_code, hi)
+    blooms = [name for name in bloom_columns if name in names]
+    footer += struct.pack("<H", len(blooms))
+    for name in blooms:
+        raw = name.encode("utf-8")
+        footer += struct.pack("<H", len(raw)) + raw
+        footer += BloomFilter.for_keys(row.get(name) for row in rows).to_bytes()
+    raw = sort_key.encode("utf-8") if sort_key in names else b""
+    footer += struct.pack("<H", len(raw)) + raw
+    return bytes(body + footer + TAIL.pack(len(footer), SEGMENT_MAGIC))
+
+
+def write_segment(path, rows, bloom_columns=(), sort_key=None):
+    with open(path, "wb") as f:
+        f.write(encode_segment(rows, bloom_columns, sort_key))
+
+
+def _unpack_name(data, pos):
+    """Return (name, next position) for a length-prefixed UTF-8 name."""
+    length = struct.unpack_from("<H", data, pos)[0]
+    pos += 2
+    return bytes(data[pos:pos + length]).decode("utf-8"), pos + length
+
+
+class SegmentReader:
+    """
+    Reads a segment's footer up front; a column's chunk is only read from disk and
+    decompressed when that column is asked for. The footer's per-column statistics
+    (zone maps) let may_match rule a segment out without reading any chunk.
+    With a SegmentCache, decompressed chunks are looked up there before touching the file.
+    In a segment sorted by a column (sort_key), predicates on that column are binary searches.
+    """
+    def __init__(self, path, cache=None):
+        self.path = os.path.abspath(path)
+        self.cache = cache
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.version = (st.st_mtime_ns, st.st_size)
+            f.seek(-TAIL.size, 2)
+            footer_len, magic = TAIL.unpack(f.read(TAIL.size))
+            if magic != SEGMENT_MAGIC:
+                raise ValueError(f"{path} is not a column segment")
+            f.seek(-TAIL.size - footer_len, 2)
+            footer = f.read(footer_len)
+        self.row_count, column_count = FOOTER_HEADER.unpack_from(footer)
+        pos = FOOTER_HEADER.size
+        self.columns = {}  # name -> (type code, chunk offset, chunk length)
+        self.stats = {}    # name -> (null count, min, max)
+        self.blooms = {}   # name -> BloomFilter, for the columns that have one
+        self.sort_key = None  # the column the rows are sorted by, if any
+        for _ in range(column_count):
+            name, pos = _unpack_name(footer, pos)
+            self.columns[name] = FOOTER_COLUMN.unpack_from(footer, pos)
+            pos += FOOTER_COLUMN.size
+            null_count, has_bounds = FOOTER_STATS.unpack_from(footer, pos)
+            pos += FOOTER_STATS.size
+            lo = hi = None
+            if has_bounds:
+                type_code = self.columns[name][0]
+                lo, pos = _unpack_bound(type_code, footer, pos)
+                hi, pos = _unpack_bound(type_code, footer, pos)
+            self.stats[name] = (null_count, lo, hi)
+        bloom_count = struct.unpack_from("<H", footer, pos)[0]
+        pos += 2
+        for _ in range(bloom_count):
+            name, pos = _unpack_name(footer, pos)
+            self.blooms[name], pos = BloomFilter.from_bytes(footer, pos)
+        self.sort_key = _unpack_name(footer, pos)[0] or None
+        self.decompressor = zstd.ZstdDecompressor()
+
+    def may_match(self, where):
+        """
+        False if the zone maps (or, for equality on a column that has one, the Bloom filter)
+        show no row can satisfy every (column, op, value) predicate.
+        """
+        for column, op, value in where:
+            if column not in self.columns:
+                return False  # the column is null in every row
+            if op == "=" and column in self.blooms and not self.blooms[column].might_contain(value):
+                return False
+            null_count, lo, hi = self.stats[column]
+            if null_count == self.row_count:
+                return False
+            if lo is not None and not range_may_match(op, value, lo, hi):
+                return False
+        return True
+
+    def _chunks(self, names):
+        """Yield (name, decompressed chunk) in file order; the file is only opened on a cache miss."""
+        f = None
+        try:
+            for name in sorted(names, key=lambda n: self.columns[n][1]):
+                data = self.cache.get(self.path, name, self.version) if self.cache else None
+                if data is None:
+                    _, offset, length = self.columns[name]
+                    if f is None:
+                        f = open(self.path, "rb")
+                    f.seek(offset)
+                    data = self.decompressor.decompress(f.read(length))
+                    if self.cache:
+                        self.cache.put(self.path, name, self.version, data)
+                yield name, data
+        finally:
+            if f is not None:
+                f.close()
+
+    def _chunk(self, name):
+        return dict(self._chunks([name]))[name]
+
+    def read_array(self, name):
+        """A column as (values, null bitmap or None); numeric columns come back as array.array."""
+        return decode_column(self.columns[name][0], self._chunk(name), self.row_count)
+
+    def read_column(self, name):
+        """A column as a list, None where the value is null."""
+        return _with_nulls(*self.read_array(name), self.columns[name][0])
+
+    def matching_rows(self, where):
+        """
+        Positions of the rows satisfying every (column, op, value) predicate, evaluated on the
+        encoded chunks (see match_column); only the predicates' columns are read. Range and
+        equality predicates on the sort column narrow the rows by binary search first.
+        """
+        if not self.may_match(where):
+            return []
+        if any(column not in self.columns for column, _, _ in where):
+            return []
+        selected = None
+        span = self._sorted_span(where)
+        if span is not None:
+            selected = range(*span)
+            where = [p for p in where if p[0] != self.sort_key or p[1] == "!="]
+        for column, op, value in where:
+            if selected is not None and not selected:
+                break
+            matches = match_column(self.columns[column][0], self._chunk(column), self.row_count, op, value)
+            selected = [i for i in (range(self.row_count) if selected is None else selected) if matches[i]]
+        return selected if selected is None else list(selected)
+
+    def _sorted_span(self, where):
+        """
+        (start, stop) of the rows the sort column's range and equality predicates allow, found by
+        binary search, or None if there are none or the values don't compare with the column's.
+        """
+        bounds = [(op, value) for column, op, value in where if column == self.sort_key and op != "!="]
+        if not bounds or self.stats.get(self.sort_key, (0, None))[1] is None:
+            return None  # unsorted, or no usable bounds (NaNs, mixed types)
+        values = self.read_array(self.sort_key)[0]
+        start, stop = 0, self.row_count - self.stats[self.sort_key][0]  # nulls sort last
+        try:
+            for op, value in bounds:
+                if op in ("=", ">="):
+                    start = max(start, bisect_left(values, value, 0, stop))
+                elif op == ">":
+                    start = max(start, bisect_right(values, value, 0, stop))
+                if op in ("=", "<="):
+                    stop = min(stop, bisect_right(values, value, 0, stop))
+                elif op == "<":
+                    stop = min(stop, bisect_left(values, value, 0, stop))
+        except TypeError:
+            return None
+        return start, max(start, stop)
+
+    def read_columns(self, names=None, rows=None):
+        """
+        {name: list} for the given columns (all by default), optionally only at the given row
+        positions. Only their chunks are read; a name the segment doesn't have comes back as all None.
+        """
+        names = list(self.columns) if names is None else names
+        count = self.row_count if rows is None else len(rows)
+        cols = {}
+        for name, data in self._chunks({n for n in names if n in self.columns}):
+            type_code = self.columns[name][0]
+            values = _with_nulls(*decode_column(type_code, data, self.row_count), type_code)
+            cols[name] = values if rows is None else [values[i] for i in rows]
+        return {name: cols[name] if name in cols else [None] * count for name in names}
+
+    def rows(self):
+        cols = self.read_columns()
+        return [dict(zip(cols, values)) for values in zip(*cols.values())]
@@ -0,0 +1,113 @@
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_SEGMENT_CACHE_BYTES = 64 << 20
+
+
+class SegmentCache:
+    """
+    LRU cache of decompressed column chunks, bounded by their total size in bytes.
+    Keys are (segment path, column, file version); the version is the file's
+    (mtime_ns, size), so a rewritten segment never serves stale chunks even if
+    nobody invalidated it. Chunks stay in their encoded form (see storage.segment),
+    which keeps them small and lets filters run on them directly.
+    """
+    def __init__(self, capacity_bytes=DEFAULT_SEGMENT_CACHE_BYTES):
+        self.capacity_bytes = capacity_bytes
+        self.chunks = OrderedDict()  # (path, column, version) -> bytes, LRU first
+        self.by_path = {}            # path -> keys cached for it
+        self.cached_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, path, column, version):
+        key = (path, column, version)
+        with self.lock:
+            data = self.chunks.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.chunks.move_to_end(key)
+            return data
+
+    def put(self, path, column, version, data):
+        if len(data) > self.capacity_bytes:
+            return
+        key = (path, column, version)
+        with self.lock:
+            if key in self.chunks:
+                return
+            self.chunks[key] = data
+            self.by_path.setdefault(path, set()).add(key)
+            self.cached_bytes += len(data)
+            while self.cached_bytes > self.capacity_bytes:
+                old_key, old = self.chunks.popitem(last=False)
+                self._unlink(old_key, old)
+                self.evictions += 1
+
+    def _unlink(self, key, data):
+        self.cached_bytes -= len(data)
+        keys = self.by_path[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self.by_path[key[0]]
+
+    def invalidate(self, path):
+        """Drop every chunk cached for a segment file (rewritten or removed)."""
+        with self.lock:
+            for key in list(self.by_path.get(path, ())):
+                self._unlink(key, self.chunks.pop(key))
+                self.invalidations += 1
+
+    def invalidate_dir(self, directory):
+        """Drop the chunks of every segment under a directory (a table's segment folder)."""
+        prefix = os.path.join(directory, "")
+        with self.lock:
+            paths = [p for p in self.by_path if p.startswith(prefix)]
+        for path in paths:
+            self.invalidate(path)
+
+    def resize(self, capacity_bytes):
+        with self.lock:
+            self.capacity_bytes = capacity_bytes
+            while self.cached_bytes > self.capacity_bytes:
+                key, data = self.chunks.popitem(last=False)
+                self._unlink(key, data)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.chunks.clear()
+            self.by_path.clear()
+            self.cached_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "capacity_bytes": self.capacity_bytes,
+                "cached_bytes": self.cached_bytes,
+                "cached_chunks": len(self.chunks),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_segment_cache():
+    """The process-wide cache shared by every ColumnStore that doesn't bring its own."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = SegmentCache()
+        return _default_cache
@@ -0,0 +1,79 @@
+import threading
+from contextlib import contextmanager
+
+from storage.column_store import DEFAULT_SEGMENT_ROWS
+
+DEFAULT_TIER_ROWS = 10 * DEFAULT_SEGMENT_ROWS  # row-store rows that trigger a migration
+DEFAULT_TIER_BYTES = 8 << 20                   # row-store block bytes that trigger one
+DEFAULT_TIER_AGE = 300.0                       # seconds the oldest unmigrated write may wait
+
+
+class TieringPolicy:
+    """
+    When a table's rows move from its row store to its column store: once the row store holds
+    max_rows rows, takes max_bytes of blocks, or its oldest unmigrated write is max_age seconds
+    old (None disables a threshold). Migrations write segments of segment_rows rows.
+    """
+    def __init__(self, max_rows=DEFAULT_TIER_ROWS, max_bytes=DEFAULT_TIER_BYTES, max_age=DEFAULT_TIER_AGE,
+                 segment_rows=DEFAULT_SEGMENT_ROWS):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_rows = segment_rows
+
+    def reason(self, row_count, byte_size, age):
+        """The threshold crossed, "rows", "bytes" or "age", or None if the table can wait."""
+        if not row_count:
+            return None
+        if self.max_rows is not None and row_count >= self.max_rows:
+            return "rows"
+        if self.max_bytes is not None and byte_size >= self.max_bytes:
+            return "bytes"
+        if self.max_age is not None and age >= self.max_age:
+            return "age"
+        return None
+
+
+
+class TierLock:
+    """
+    Keeps a migration's handoff (segments installed, row-store copies deleted) from landing
+    in the middle of a scan that reads both tiers, which would see those rows twice or not
+    at all. Any number of scans run together; a waiting handoff holds off new ones so it
+    can't be starved. A thread already scanning may start another scan (nested reads).
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.readers = {}  # thread id -> open scans
+        self.handoff = False
+
+    @contextmanager
+    def reading(self):
+        me = threading.get_ident()
+        with self.cond:
+            while self.handoff and me not in self.readers:
+                self.cond.wait()
+            self.readers[me] = self.readers.get(me, 0) + 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.readers[me] -= 1
+                if not self.readers[me]:
+                    del self.readers[me]
+                self.cond.notify_all()
+
+    @contextmanager
+    def handing_off(self):
+        with self.cond:
+            while self.handoff:
+                self.cond.wait()
+            self.handoff = True
+            while self.readers:
+                self.cond.wait()
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.handoff = False
+                self.cond.notify_all()
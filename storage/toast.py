@@ -0,0 +1,97 @@
+import json
+import struct
+
+import zstandard as zstd
+
+from storage.block_manager import BlockManager
+from storage.page_allocator import PageAllocator
+from storage.row_packer import (FLAG_COMPRESSED, FLAG_JSON, SLOT, RowCodec, ToastPointer, page_capacity,
+                                page_delete, page_insert, page_live_slots, page_tuple)
+
+TOAST_THRESHOLD = 256  # values larger than this many bytes move out of the heap page
+
+# Chunk tuple: next chunk page, next chunk slot (page 0 = last chunk), then the chunk's bytes
+CHUNK_HEADER = struct.Struct(">IH")
+
+
+class ToastStore:
+    """
+    Overflow storage for large values. A value is (optionally zstd-compressed and) split into
+    chunks chained by (page, slot); chunks are tuples in slotted pages, so small values share pages.
+    Pages whose chunks are all deleted go back to the file's free list.
+    """
+    def __init__(self, path, use_mmap=False):
+        self.path = path
+        self.bm = BlockManager(path, use_mmap=use_mmap)
+        self.pages = PageAllocator(self.bm)
+        self.codec = RowCodec([])  # chunk tuples are raw bytes; the layout is empty
+        self.max_chunk = page_capacity(self.codec) - SLOT.size - CHUNK_HEADER.size
+        self.fill_page = None  # page that small chunks are packed into
+        self.compressor = zstd.ZstdCompressor(level=3)
+        self.decompressor = zstd.ZstdDecompressor()
+
+    def store(self, value):
+        if isinstance(value, str):
+            raw, flags = value.encode("utf-8"), 0
+        else:
+            raw, flags = json.dumps(value).encode("utf-8"), FLAG_JSON
+        data = raw
+        packed = self.compressor.compress(raw)
+        if len(packed) < len(raw):
+            data, flags = packed, flags | FLAG_COMPRESSED
+        chunks = [data[i:i + self.max_chunk] for i in range(0, len(data), self.max_chunk)] or [b""]
+        # Write back to front so every chunk knows where the next one lives
+        next_page, next_slot = 0, 0
+        for chunk in reversed(chunks):
+            tuple_data = CHUNK_HEADER.pack(next_page, next_slot) + chunk
+            page, slot = None, None
+            if self.fill_page is not None:
+                slot = self._insert(self.fill_page, tuple_data)
+                page = self.fill_page
+            if slot is None:
+                page = self.fill_page = self.pages.allocate()
+                self.bm.write_block(page, b"")  # may be a recycled page still holding the free-list marker
+                slot = self._insert(page, tuple_data)
+            next_page, next_slot = page, slot
+        return ToastPointer(next_page, next_slot, len(raw), len(data), flags)
+
+    def _insert(self, page, tuple_data):
+        frame = self.bm.pin_block(page)
+        slot = None
+        try:
+            slot = page_insert(frame.data, self.codec, tuple_data)
+        finally:
+            self.bm.unpin_block(frame, dirty=slot is not None)
+        return slot
+
+    def _chunks(self, pointer):
+        page, slot = pointer.page, pointer.slot
+        while page:
+            data = page_tuple(self.bm.read_block(page), slot)
+            if data is None:
+                raise ValueError(f"Overflow chunk {page}/{slot} in {self.path} is missing")
+            yield page, slot, bytes(data[CHUNK_HEADER.size:])
+            page, slot = CHUNK_HEADER.unpack_from(data)
+
+    def fetch(self, pointer):
+        data = b"".join(chunk for _, _, chunk in self._chunks(pointer))
+        if pointer.flags & FLAG_COMPRESSED:
+            data = self.decompressor.decompress(data, max_output_size=pointer.raw_length)
+        value = data.decode("utf-8")
+        return json.loads(value) if pointer.flags & FLAG_JSON else value
+
+    def free(self, pointer):
+        for page, slot, _ in list(self._chunks(pointer)):
+            frame = self.bm.pin_block(page)
+            try:
+                page_delete(frame.data, slot)
+                empty = page_live_slots(frame.data) == 0
+            finally:
+                self.bm.unpin_block(frame, dirty=True)
+            if empty:
+                if page == self.fill_page:
+                    self.fill_page = None
+                self.pages.free(page)
+
+    def close(self, flush=True):
+        self.bm.close(flush=flush)
@@ -0,0 +1,42 @@
+from storage.block_manager import BlockManager
+from storage.buffer_pool import BLOCK_SIZE, BufferPool
+
+def test_mmap_read_returns_memoryview(tmp_path):
+    pool = BufferPool(capacity=4)
+    bm = BlockManager(str(tmp_path / "t.tbl"), buffer_pool=pool, use_mmap=True)
+    bm.write_block(bm.allocate_block(), b"abc")
+    page = bm.read_block(0)
+    assert isinstance(page, memoryview)
+    assert len(page) == BLOCK_SIZE
+    assert bytes(page[:3]) == b"abc"
+    # mmap mode bypasses the page cache
+    assert pool.stats()["misses"] == 0
+
+def test_mmap_mapping_grows_with_allocate(tmp_path):
+    bm = BlockManager(str(tmp_path / "t.tbl"), buffer_pool=BufferPool(), use_mmap=True)
+    bm.write_block(bm.allocate_block(), b"first")
+    old_view = bm.read_block(0)
+    for i in range(1, 10):
+        bm.write_block(bm.allocate_block(), f"block{i}".encode())
+    assert bytes(bm.read_block(9)[:6]) == b"block9"
+    # Views into the previous mapping stay valid after the remap
+    assert bytes(old_view[:5]) == b"first"
+
+def test_mmap_sees_pages_written_through_pool(tmp_path):
+    pool = BufferPool()
+    path = str(tmp_path / "t.tbl")
+    pooled = BlockManager(path, buffer_pool=pool)
+    pooled.write_block(pooled.allocate_block(), b"pooled")
+    mapped = BlockManager(path, buffer_pool=pool, use_mmap=True)
+    assert bytes(mapped.read_block(0)[:6]) == b"pooled"
+
+def test_mmap_writes_refresh_pages_cached_in_pool(tmp_path):
+    pool = BufferPool()
+    path = str(tmp_path / "t.tbl")
+    pooled = BlockManager(path, buffer_pool=pool, write_through=False)
+    pooled.write_block(pooled.allocate_block(), b"old")  # cached and dirty
+    mapped = BlockManager(path, buffer_pool=pool, use_mmap=True)
+    mapped.write_block(0, b"new")
+    assert pooled.read_block(0)[:3] == b"new"
+    pool.flush()  # the stale copy must not be written back over the mmap write
+    assert bytes(mapped.read_block(0)[:3]) == b"new"
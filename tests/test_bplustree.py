@@ -105,3 +105,64 @@ def test__find_leaf_all_paths():
         assert leaf.leaf
         assert key in leaf.keys
 
+
+def _index_file(tmp_path):
+    from storage.block_manager import BlockManager
+    from storage.buffer_pool import BufferPool
+    return BlockManager(str(tmp_path / "t.idx"), buffer_pool=BufferPool())
+
+def test_node_ids_are_compact_block_numbers(tmp_path):
+    bm = _index_file(tmp_path)
+    t = BplusTree(order=4, block_manager=bm)
+    for i in range(50):
+        t.insert(i, str(i))
+    ids = set()
+    def collect(node):
+        ids.add(node.node_id)
+        for child_id in node.children:
+            collect(t.load_node(child_id))
+    collect(t.root)
+    # Header is block 0, every other block is a live node (splits reuse the split node's block)
+    assert ids == set(range(1, bm.num_blocks()))
+
+def test_root_persisted_in_header(tmp_path):
+    bm = _index_file(tmp_path)
+    t = BplusTree(order=4, block_manager=bm)
+    for i in range(20):
+        t.insert(i, str(i))
+    t2 = BplusTree(order=4, block_manager=bm)
+    assert t2.root_node_id == t.root_node_id
+    assert t2.search(17) == "17"
+
+def test_bulk_load_is_sequential_and_reuses_file(tmp_path):
+    bm = _index_file(tmp_path)
+    t = BplusTree(order=4, block_manager=bm)
+    for i in range(30):
+        t.insert(i, str(i))
+    items = [(i, str(i)) for i in range(9)]
+    t2 = BplusTree.bulk_load(items, order=4, block_manager=bm)
+    # 3 leaves then 1 root, right after the header
+    assert bm.num_blocks() == 5
+    assert t2.root_node_id == 4
+    assert list(t2.scan()) == items
+
+def test_page_allocator_reuses_freed_pages(tmp_path):
+    from storage.page_allocator import PageAllocator
+    pages = PageAllocator(_index_file(tmp_path))
+    a, b = pages.allocate(), pages.allocate()
+    pages.free(a)
+    assert pages.allocate() == a
+    assert pages.allocate() == b + 1
+
+def test_index_survives_a_crash_without_flush(tmp_path):
+    from storage.block_manager import BlockManager
+    from storage.buffer_pool import BufferPool
+    path = str(tmp_path / "t.idx")
+    pool = BufferPool(capacity=8)
+    t = BplusTree(order=4, block_manager=BlockManager(path, buffer_pool=pool))
+    for i in range(200):
+        t.insert(i, str(i))
+    # Kill: the pool's frames are lost without a flush; index files have no WAL to redo them
+    pool.frames.clear()
+    reopened = BplusTree(order=4, block_manager=BlockManager(path, buffer_pool=BufferPool()))
+    assert [reopened.search(i) for i in range(200)] == [str(i) for i in range(200)]
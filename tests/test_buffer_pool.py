@@ -0,0 +1,62 @@
+import pytest
+
+from storage.block_manager import BlockManager
+from storage.buffer_pool import BLOCK_SIZE, BufferPool
+
+def test_write_and_read_roundtrip(tmp_path):
+    pool = BufferPool(capacity=4)
+    bm = BlockManager(str(tmp_path / "t.tbl"), buffer_pool=pool)
+    b = bm.allocate_block()
+    bm.write_block(b, b"hello")
+    data = bm.read_block(b)
+    assert len(data) == BLOCK_SIZE
+    assert data.startswith(b"hello")
+    assert data[5:] == bytes(BLOCK_SIZE - 5)
+    assert bm.num_blocks() == 1
+
+def test_dirty_pages_written_back_on_eviction(tmp_path):
+    pool = BufferPool(capacity=2)
+    path = str(tmp_path / "t.tbl")
+    bm = BlockManager(path, buffer_pool=pool)
+    for i in range(5):
+        bm.write_block(bm.allocate_block(), bytes([i + 1]) * 10)
+    assert pool.evictions >= 3
+    pool.flush()
+    with open(path, "rb") as f:
+        raw = f.read()
+    assert len(raw) == 5 * BLOCK_SIZE
+    for i in range(5):
+        assert raw[i * BLOCK_SIZE] == i + 1
+
+def test_hit_and_miss_counters(tmp_path):
+    pool = BufferPool(capacity=4)
+    path = str(tmp_path / "t.tbl")
+    with open(path, "wb") as f:
+        f.write(b"\x01" * BLOCK_SIZE)
+    bm = BlockManager(path, buffer_pool=pool)
+    bm.read_block(0)
+    bm.read_block(0)
+    stats = pool.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+    assert stats["hit_rate"] == 0.5
+
+def test_pinned_pages_are_not_evicted(tmp_path):
+    pool = BufferPool(capacity=1)
+    bm = BlockManager(str(tmp_path / "t.tbl"), buffer_pool=pool)
+    bm.allocate_block()
+    frame = bm.pin_block(0)
+    with pytest.raises(RuntimeError):
+        bm.read_block(1)
+    bm.unpin_block(frame)
+    bm.read_block(1)
+
+def test_block_managers_share_one_file(tmp_path):
+    pool = BufferPool(capacity=4)
+    path = str(tmp_path / "t.tbl")
+    a = BlockManager(path, buffer_pool=pool)
+    b = BlockManager(path, buffer_pool=pool)
+    a.write_block(a.allocate_block(), b"shared")
+    assert b.num_blocks() == 1
+    assert b.read_block(0).startswith(b"shared")
+    assert b.allocate_block() == 1
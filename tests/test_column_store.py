@@ -0,0 +1,219 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from storage.column_store import ColumnStore
+from storage.delete_bitmap import FRAME, RUN, live_positions
+from storage.segment import SegmentReader
+from storage.segment_cache import SegmentCache
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ColumnStore("titles", segment_path=str(tmp_path), cache=SegmentCache())
+    for seg in range(4):
+        store.flush([{"id": seg * 100 + i, "kind": "movie" if i % 4 else "short",
+                      "rating": None if i == 7 else float(i % 10)} for i in range(100)], f"seg_{seg}.seg")
+    store.log_delete(5)
+    return store
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_parallel_scan_matches_serial_scan(store, processes):
+    where = [("kind", "=", "short")]
+    serial = list(store.scan_segments(["id"], where))
+    assert list(store.scan_parallel(["id"], where, workers=2, processes=processes)) == serial
+    assert sum(len(rows) for rows in serial) == 100
+
+
+def test_parallel_scan_keeps_a_bounded_window_of_tasks(store, monkeypatch):
+    submitted = []
+    class CountingPool(ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            submitted.append(args[0])
+            return super().submit(fn, *args, **kwargs)
+    monkeypatch.setattr("storage.column_store.ThreadPoolExecutor", CountingPool)
+    scan = store.scan_parallel(["id"], workers=1)
+    assert [r["id"] for r in next(scan)][:2] == [0, 1]
+    assert len(submitted) == 2  # two per worker, not all four segments
+    assert sum(len(rows) for rows in scan) == 300
+    assert len(submitted) == 4
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_aggregate_merges_partials_across_segments(store, processes):
+    result = store.aggregate([("count", None), ("count", "rating"), ("sum", "rating"), ("min", "id"),
+                              ("avg", "rating")], group_by=["kind"], workers=3, processes=processes)
+    by_kind = {r["kind"]: r for r in result}
+    rows = [r for r in store.scan() if r["kind"] == "movie"]
+    ratings = [r["rating"] for r in rows if r["rating"] is not None]
+    assert by_kind["movie"] == {"kind": "movie", "count(*)": len(rows), "count(rating)": len(ratings),
+                                "sum(rating)": sum(ratings), "min(id)": 1,
+                                "avg(rating)": sum(ratings) / len(ratings)}
+    assert by_kind["short"]["count(*)"] == 100
+    assert store.aggregate([("max", "id")], where=[("id", ">", 10_000)]) == [{"max(id)": None}]
+
+
+def test_incremental_compaction_only_rewrites_churned_and_small_segments(tmp_path):
+    store = ColumnStore("t", segment_path=str(tmp_path), cache=SegmentCache())
+    store.flush([{"id": i} for i in range(100)])          # seg_0: 30% deleted below
+    store.flush([{"id": i} for i in range(100, 200)])     # seg_1: untouched
+    store.flush([{"id": i} for i in range(200, 210)])     # seg_2, seg_3: small
+    store.flush([{"id": i} for i in range(210, 215)])
+    for key in list(range(30)) + [150]:
+        store.log_delete(key)
+    untouched = os.stat(tmp_path / "t" / "seg_1.seg").st_mtime_ns
+
+    assert store.compact(small_rows=20, target_rows=40) == (3, 3)
+    names = sorted(os.listdir(tmp_path / "t"))
+    assert names == ["manifest.json", "seg_1.seg", "seg_1.seg.del", "seg_4.seg", "seg_5.seg", "seg_6.seg"]
+    assert os.stat(tmp_path / "t" / "seg_1.seg").st_mtime_ns == untouched
+    # Merged output takes the place of the first segment it replaced
+    assert [r.row_count for r in store.scan_columns()] == [40, 40, 5, 100]
+    # Only the untouched segment still has a delete bitmap
+    assert store.tombstone_ratios() == {"seg_1.seg": 0.01, "seg_4.seg": 0.0, "seg_5.seg": 0.0, "seg_6.seg": 0.0}
+    assert sorted(r["id"] for r in store.scan()) == [i for i in range(30, 215) if i != 150]
+    assert store.compact(small_rows=20, target_rows=40) == (0, 0)
+
+
+def test_compaction_output_is_invisible_until_the_manifest_commit(tmp_path):
+    store = ColumnStore("t", segment_path=str(tmp_path), cache=SegmentCache())
+    store.flush([{"id": i} for i in range(10)])
+    store.flush([{"id": i} for i in range(10, 20)])
+    store.log_delete(3)
+
+    def crash(*args):
+        raise OSError("power cut")
+    store._commit_manifest = crash
+    with pytest.raises(OSError):
+        store.compact()
+    assert "seg_2.seg" in os.listdir(tmp_path / "t")
+    store.close()
+    reopened = ColumnStore("t", segment_path=str(tmp_path), cache=SegmentCache())
+    # The orphaned output is cleaned up and the old segments still serve reads
+    assert sorted(os.listdir(tmp_path / "t")) == ["manifest.json", "seg_0.seg", "seg_0.seg.del", "seg_1.seg"]
+    assert sorted(r["id"] for r in reopened.scan()) == [i for i in range(20) if i != 3]
+    assert reopened.compact() == (2, 1)
+    reopened.flush([{"id": 99}])
+    assert [os.path.basename(f) for f in reopened._segment_files()] == ["seg_2.seg", "seg_3.seg"]
+
+
+def test_snapshots_keep_compacted_segments_until_released(tmp_path):
+    store = ColumnStore("t", segment_path=str(tmp_path), cache=SegmentCache())
+    store.flush([{"id": i} for i in range(10)])
+    store.flush([{"id": i} for i in range(10, 20)])
+    scan = store.scan_segments()
+    first = next(scan)  # a reader part way through the old segments
+    assert store.compact() == (2, 1)
+    assert os.path.exists(tmp_path / "t" / "seg_1.seg")
+    assert [r["id"] for r in first + next(scan)] == list(range(20))
+    scan.close()
+    assert sorted(os.listdir(tmp_path / "t")) == ["manifest.json", "seg_2.seg"]
+    with open(tmp_path / "t" / "manifest.json") as f:
+        manifest = json.load(f)
+    assert manifest["version"] == 3 and manifest["next_id"] == 3
+    assert manifest["segments"][0]["rows"] == 20 and manifest["segments"][0]["pk_max"] == 19
+
+
+def test_one_column_store_per_table_directory(tmp_path):
+    store = ColumnStore("t", segment_path=str(tmp_path), cache=SegmentCache())
+    store.flush([{"id": 1}])
+    with pytest.raises(RuntimeError):
+        ColumnStore("t", segment_path=str(tmp_path), cache=SegmentCache())
+    store.close()
+    assert [r["id"] for r in ColumnStore("t", segment_path=str(tmp_path)).scan()] == [1]
+
+
+def test_deletes_append_run_encoded_frames_per_segment(tmp_path):
+    store = ColumnStore("t", segment_path=str(tmp_path), cache=SegmentCache())
+    store.flush([{"id": i} for i in range(100)])
+    store.flush([{"id": i} for i in range(100, 200)])
+    assert store.log_delete_many(range(10, 60)) == 50
+    assert store.log_delete(150) == 1
+    assert store.log_delete(150) == 0
+    seg0 = tmp_path / "t" / "seg_0.seg.del"
+    # One frame holding a single (10, 50) run
+    assert os.path.getsize(seg0) == FRAME.size + RUN.size
+    with open(seg0, "ab") as f:
+        f.write(b"\x05\x00")  # torn frame
+    store.close()
+    reopened = ColumnStore("t", segment_path=str(tmp_path), cache=SegmentCache())
+    assert reopened.tombstone_ratios() == {"seg_0.seg": 0.5, "seg_1.seg": 0.01}
+    assert len(list(reopened.scan())) == 149
+    assert live_positions(reopened.deleted_bits(str(tmp_path / "t" / "seg_0.seg")), 100, [9, 10, 60]) == [9, 60]
+
+
+def test_legacy_tombstone_file_becomes_bitmaps(tmp_path):
+    store = ColumnStore("t", segment_path=str(tmp_path), cache=SegmentCache())
+    store.flush([{"id": i} for i in range(10)])
+    with open(tmp_path / "t" / "deletes.json", "w") as f:
+        json.dump([2, 3, 99], f)
+    store.close()
+    reopened = ColumnStore("t", segment_path=str(tmp_path), cache=SegmentCache())
+    assert not os.path.exists(tmp_path / "t" / "deletes.json")
+    assert [r["id"] for r in reopened.scan()] == [0, 1, 4, 5, 6, 7, 8, 9]
+
+
+def test_point_lookup_reads_only_the_segment_holding_the_key(tmp_path):
+    cache = SegmentCache()
+    store = ColumnStore("t", segment_path=str(tmp_path), cache=cache)
+    # Interleaved keys: every segment's pk range covers every key, so only the Bloom filters can rule them out
+    for seg in range(8):
+        store.flush([{"id": f"tt{i:07d}", "title": f"title {i}"} for i in range(seg, 4000, 8)])
+    assert store.get("tt0001234") == {"id": "tt0001234", "title": "title 1234"}
+    assert cache.stats()["misses"] == 2  # the pk and title chunks of one segment
+    assert store.get("tt9999999") is None
+    assert cache.stats()["misses"] == 2
+    store.log_delete("tt0001234")
+    assert store.get("tt0001234") is None
+
+
+def test_clustered_flushes_and_merge_compaction_keep_segments_sorted(tmp_path):
+    store = ColumnStore("t", segment_path=str(tmp_path), cache=SegmentCache(), cluster_key="year")
+    for seg in range(4):
+        store.flush([{"id": seg * 100 + i, "year": (i * 37 + seg) % 100} for i in range(100)])
+    assert [r["year"] for r in store.scan()][:3] == [0, 1, 2]  # first segment, sorted on flush
+    store.log_delete_many(range(0, 400, 3))
+    live = sorted((r["year"], r["id"]) for r in store.scan())
+
+    assert store.compact(full=True, target_rows=60) == (4, 5)
+    store.close()
+    reopened = ColumnStore("t", segment_path=str(tmp_path), cache=SegmentCache())
+    assert reopened.cluster_key == "year"
+    assert [(r["year"], r["id"]) for r in reopened.scan()] == live
+    # Each output segment covers a narrow slice of years, so a range touches one or two of them
+    hits = list(reopened.scan_segments(["id"], [("year", ">=", 40), ("year", "<", 45)]))
+    assert len(hits) <= 2
+    assert sorted(r["id"] for rows in hits for r in rows) == sorted(i for y, i in live if 40 <= y < 45)
+
+
+def test_merge_compaction_reads_inputs_in_batches_one_key_range_at_a_time(tmp_path, monkeypatch):
+    store = ColumnStore("t", segment_path=str(tmp_path), cache=SegmentCache(), cluster_key="year")
+    for seg in (2, 0, 3, 1):  # disjoint year ranges, flushed out of order
+        store.flush([{"id": seg * 100 + i, "year": seg * 100 + (i * 37) % 100} for i in range(100)])
+    reads = []
+    read_columns = SegmentReader.read_columns
+    def spy(reader, names=None, rows=None):
+        reads.append((os.path.basename(reader.path), len(rows)))
+        return read_columns(reader, names, rows)
+    monkeypatch.setattr(SegmentReader, "read_columns", spy)
+
+    assert store.compact(full=True, target_rows=30) == (4, 14)
+    assert max(count for _, count in reads) == 30
+    # Each input is read in one stretch: the next starts only once the merge reaches its years
+    runs = [name for i, (name, _) in enumerate(reads) if i == 0 or reads[i - 1][0] != name]
+    assert runs == ["seg_1.seg", "seg_3.seg", "seg_0.seg", "seg_2.seg"]
+    monkeypatch.undo()
+    assert [r["year"] for r in store.scan()] == sorted(r["year"] for r in store.scan())
+    assert len(list(store.scan())) == 400
+
+
+def test_clustering_mixed_types_falls_back_to_insertion_order(tmp_path):
+    store = ColumnStore("t", segment_path=str(tmp_path), cache=SegmentCache(), cluster_key="k")
+    store.flush([{"id": 1, "k": 5}, {"id": 2, "k": 1}])
+    store.flush([{"id": 3, "k": "b"}, {"id": 4, "k": "a"}])
+    assert [r["id"] for r in store.scan()] == [2, 1, 4, 3]
+    assert store.compact(full=True) == (2, 1)
+    assert [r["id"] for r in store.scan()] == [2, 1, 4, 3]
@@ -72,4 +72,11 @@ def test_parse_unknown_command_returns_unknown():
 
 def test_parse_empty_command_returns_unknown():
     q = parse_command("")
-    assert q.type == QueryTypes.UNKNOWN
\ No newline at end of file
+    assert q.type == QueryTypes.UNKNOWN
+
+
+def test_parse_select_columns():
+    q = parse_command("SELECT name, age FROM users WHERE id '42';")
+    assert q.columns == ["name", "age"]
+    assert q.table == "users"
+    assert parse_command("SELECT * FROM users;").columns == []
@@ -0,0 +1,69 @@
+import pytest
+
+from core.column import Column
+from storage.buffer_pool import BLOCK_SIZE
+from storage.row_packer import (RowCodec, build_page, decode_page, decode_rows_block, encode_rows_block,
+                                page_delete, page_free_space, page_insert)
+
+COLUMNS = [
+    Column("tconst", "TEXT", constraints=["PRIMARY KEY"]),
+    Column("isAdult", "INT"),
+    Column("rating", "FLOAT"),
+    Column("genres", "TEXT"),
+]
+
+def test_roundtrip_with_schema_and_nulls():
+    codec = RowCodec.from_columns(COLUMNS)
+    rows = [
+        {"tconst": "tt0000001", "isAdult": 0, "rating": 5.5, "genres": "Documentary,Short"},
+        {"tconst": "tt0000002", "isAdult": None, "rating": None, "genres": None},
+    ]
+    assert decode_rows_block(encode_rows_block(rows, codec)) == rows
+
+def test_binary_block_is_smaller_than_json():
+    import json
+    codec = RowCodec.from_columns(COLUMNS)
+    rows = [{"tconst": f"tt{i:07d}", "isAdult": 0, "rating": 7.0, "genres": "Drama"} for i in range(50)]
+    used = BLOCK_SIZE - page_free_space(encode_rows_block(rows, codec))
+    assert used < len(json.dumps(rows)) * 0.6
+
+def test_schemaless_layout_is_inferred():
+    rows = [{"id": 1, "name": "foo"}, {"id": 2, "tags": ["a", "b"]}]
+    decoded = decode_rows_block(encode_rows_block(rows))
+    assert decoded == [{"id": 1, "name": "foo", "tags": None}, {"id": 2, "name": None, "tags": ["a", "b"]}]
+
+def test_type_mismatch_raises():
+    codec = RowCodec.from_columns(COLUMNS)
+    with pytest.raises(ValueError):
+        codec.encode({"tconst": "tt1", "isAdult": "yes"})
+    with pytest.raises(ValueError):
+        codec.encode({"tconst": "tt1", "unknown": 1})
+
+def test_decodes_legacy_json_blocks():
+    import json
+    rows = [{"id": 1}, {"id": 2}]
+    legacy = len(rows).to_bytes(2, "big") + json.dumps(rows).encode("utf-8")
+    assert decode_rows_block(legacy.ljust(8192, b"\x00")) == rows
+
+def test_slotted_page_insert_and_delete_in_place():
+    codec = RowCodec.from_columns(COLUMNS)
+    page = build_page(codec, [codec.encode({"tconst": "tt1", "isAdult": 0})])
+    before = bytes(page)
+    slot = page_insert(page, codec, codec.encode({"tconst": "tt2", "isAdult": 1}))
+    assert slot == 1
+    changed = [i for i in range(BLOCK_SIZE) if page[i] != before[i]]
+    # Only the header, the new slot entry and the new tuple at the end of the free space changed
+    assert len(changed) < 40
+    assert page_delete(page, 0)
+    assert not page_delete(page, 0)
+    slots, rows = decode_page(page)
+    assert slots == [1]
+    assert rows[0]["tconst"] == "tt2"
+
+def test_page_insert_refuses_when_full():
+    codec = RowCodec.from_columns(COLUMNS)
+    page = build_page(codec, [])
+    big = codec.encode({"tconst": "x" * 3000})
+    assert page_insert(page, codec, big) == 0
+    assert page_insert(page, codec, big) == 1
+    assert page_insert(page, codec, big) is None
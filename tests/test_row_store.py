@@ -1,6 +1,7 @@
 import pytest
 from unittest.mock import patch
 import storage.row_store
+from storage.buffer_pool import BLOCK_SIZE, Frame
 
 # ----------------- DUMMY CLASSES -----------------
 
@@ -9,6 +10,7 @@ class DummyBlockManager:
         self._counter = 0
         self._written = set()
         self._rows_per_block = {}
+        self._pages = {}
     def allocate_block(self):
         self._counter += 1
         return self._counter - 1
@@ -20,6 +22,15 @@ class DummyBlockManager:
         self._rows_per_block[block_num] = data
     def read_block(self, block_num):
         return b''
+    def pin_block(self, block_num):
+        return Frame(None, block_num, self._pages.setdefault(block_num, bytearray(BLOCK_SIZE)))
+    def unpin_block(self, frame, dirty=False):
+        if dirty:
+            self._written.add(frame.block_num)
+    def truncate(self, num_blocks=0):
+        self._counter = num_blocks
+    def sync(self):
+        pass
 
 class DummyWALManager:
     def __init__(self, *a, **kw):
@@ -28,15 +39,26 @@ class DummyWALManager:
         self.deletes = []
         self.did_clear = False
         self.insert_many_called = False
-    def replay(self, apply_row, apply_delete):
+        self.lsn = 0
+        self.wal_bytes = 0
+    def replay(self, apply_row, apply_delete, apply_update=None):
         self.did_replay = True
-    def log_insert(self, row):
+    def log_insert(self, row, row_id=None, wait=True):
         self.inserts.append(row)
-    def log_delete(self, key):
+    def log_delete(self, key, row_id=None, wait=True):
         self.deletes.append(key)
+    def log_update(self, key, old_row_id, row, new_row_id, wait=True):
+        self.deletes.append(key)
+        self.inserts.append(row)
+    def commit(self, lsn):
+        pass
+    def open(self):
+        pass
+    def checkpoint(self, redo_lsn):
+        pass
     def clear(self):
         self.did_clear = True
-    def log_insert_many(self, rows):
+    def log_insert_many(self, rows, row_ids=None, wait=True):
         self.insert_many_called = True
         self.inserts.extend(rows)
 
@@ -69,9 +91,9 @@ def test_bulk_insert_rows():
          patch('storage.row_store.WALManager', DummyWALManager):
         from storage.row_store import RowStore
         row_store = RowStore('test_table', pk='id', base_path='/tmp/')
-        rows = [{"id": i, "name": f"row{i}"} for i in range(60)]
+        rows = [{"id": i, "name": f"row{i}" + "x" * 200} for i in range(60)]
         row_store.bulk_insert_rows(rows)
-        # Should write at least two blocks for 60 rows (since limit is 50/block)
+        # Should write at least two blocks for 60 ~220-byte rows (blocks are packed by byte size)
         assert len(row_store.bm._written) >= 2
         # Check all rows are in block_rows
         all_rows = [r for rows in row_store.block_rows.values() for r in rows]
@@ -83,7 +105,7 @@ def test_bulk_insert_rows():
 def test_recover_from_wal_calls_replay(monkeypatch):
     called = {}
     class WAL(DummyWALManager):
-        def replay(self, apply_row, apply_delete):
+        def replay(self, apply_row, apply_delete, apply_update=None):
             called['replay'] = True
             apply_row({'id': 42})
             apply_delete(77)
@@ -93,6 +115,15 @@ def test_recover_from_wal_calls_replay(monkeypatch):
         RowStore('test_table', pk='id', base_path='/tmp/')
         assert 'replay' in called
 
+def test_bulk_insert_of_no_rows_is_a_no_op():
+    with patch('storage.row_store.BlockManager', DummyBlockManager), \
+         patch('storage.row_store.WALManager', DummyWALManager):
+        from storage.row_store import RowStore
+        store = RowStore('test_table', pk='id', base_path='/tmp/')
+        store.bulk_insert_rows([])
+        assert store.row_count() == 0
+        assert store.bm.num_blocks() == 0
+
 def test_bulk_insert_rows_uses_existing_block(monkeypatch):
     class ExistingBlockBM(DummyBlockManager):
         def __init__(self, *a, **kw):
@@ -138,7 +169,8 @@ def test_delete_row():
         from storage.row_store import RowStore
         row_store = RowStore('test_table', pk='id', base_path='/tmp/')
         # Pre-populate
-        row_store.block_rows[0] = [{"id": 1, "name": "foo"}, {"id": 2, "name": "bar"}]
+        row_store._insert_without_wal({"id": 1, "name": "foo"})
+        row_store._insert_without_wal({"id": 2, "name": "bar"})
         row_store.delete_row(1)
         # Check that WAL got the delete
         assert row_store.wal_manager.deletes == [1]
@@ -178,3 +210,198 @@ def test_insert_and_delete_without_wal():
         assert 42 in [r['id'] for r in row_store.block_rows[0]]
         row_store._delete_without_wal(42)
         assert 42 not in [r['id'] for r in row_store.block_rows[0]]
+
+def test_slotted_row_ids_are_stable():
+    with patch('storage.row_store.BlockManager', DummyBlockManager), \
+         patch('storage.row_store.WALManager', DummyWALManager):
+        from storage.row_store import RowStore
+        store = RowStore('test_table', pk='id', base_path='/tmp/')
+        for i in range(5):
+            store._insert_without_wal({'id': i})
+        ids_before = dict((row['id'], rid) for rid, row in store.get_rows_with_ids())
+        store._delete_without_wal(2)
+        ids_after = dict((row['id'], rid) for rid, row in store.get_rows_with_ids())
+        assert 2 not in ids_after
+        assert all(ids_after[k] == ids_before[k] for k in ids_after)
+
+def test_large_values_move_to_overflow_pages(tmp_path):
+    with patch('storage.row_store.WALManager', DummyWALManager):
+        from storage.row_store import RowStore
+        store = RowStore('toasty', pk='id', base_path=str(tmp_path), toast_threshold=64)
+        long_title = "A Very Long Title " * 40
+        store.insert_row({'id': 1, 'title': long_title})
+        store.insert_row({'id': 2, 'title': 'short'})
+        # The heap keeps a pointer, readers get the full value back
+        assert store.block_rows[0][0]['title'] != long_title
+        assert store.get_rows() == [{'id': 1, 'title': long_title}, {'id': 2, 'title': 'short'}]
+        store.bm.flush()
+        store.toast.bm.flush()
+        reopened = RowStore('toasty', pk='id', base_path=str(tmp_path), toast_threshold=64)
+        assert reopened.get_rows()[0]['title'] == long_title
+        # Deleting the row frees its overflow page for reuse
+        reopened.delete_row(1)
+        assert reopened.toast.pages.free_count == 1
+
+def test_redo_never_frees_overflow_chains_of_stale_pages(tmp_path, monkeypatch):
+    import random
+    from storage.row_store import RowStore
+    monkeypatch.chdir(tmp_path)
+    rng = random.Random(7)
+    big = {i: "".join(rng.choice("abcdefghij") for _ in range(3000)) for i in range(3)}
+    def crash(store):
+        store.bm.close(flush=False)
+        store.wal_manager.close()
+        store.toast.close()
+    store = RowStore('t', pk='id', base_path=str(tmp_path))
+    store.insert_row({'id': 0, 'v': big[0]})
+    store.checkpoint()
+    crash(store)
+    store = RowStore('t', pk='id', base_path=str(tmp_path))
+    store.insert_row({'id': 1, 'v': big[1]})
+    store.delete_row(0)  # frees id 0's chunks on disk; the heap page never gets there
+    crash(store)
+    store = RowStore('t', pk='id', base_path=str(tmp_path))
+    store.insert_row({'id': 2, 'v': big[2]})
+    assert {r['id']: r['v'] for r in store.get_rows()} == {1: big[1], 2: big[2]}
+
+def test_pk_index_point_lookup_update_and_delete():
+    with patch('storage.row_store.BlockManager', DummyBlockManager), \
+         patch('storage.row_store.WALManager', DummyWALManager):
+        from storage.row_store import RowStore
+        store = RowStore('test_table', pk='id', base_path='/tmp/')
+        store.bulk_insert_rows([{'id': i, 'name': f'row{i}'} for i in range(5)])
+        assert store.get_row(3) == {'id': 3, 'name': 'row3'}
+        assert store.get_row(99) is None
+        assert store.update_row(3, {'id': 3, 'name': 'changed'})
+        assert store.get_row(3) == {'id': 3, 'name': 'changed'}
+        assert not store.update_row(99, {'id': 99})
+        assert store.delete_row(1)
+        assert store.get_row(1) is None
+        assert store.get_row(4) == {'id': 4, 'name': 'row4'}
+        assert sorted(store.pk_index) == [0, 2, 3, 4]
+
+@pytest.mark.parametrize("pages_written", [False, True])
+def test_update_is_redone_as_one_change(tmp_path, monkeypatch, pages_written):
+    from storage.row_store import RowStore
+    monkeypatch.chdir(tmp_path)
+    store = RowStore('t', pk='id', base_path=str(tmp_path))
+    store.bulk_insert_rows([{'id': i, 'name': f'row{i}'} for i in range(3)])
+    store.checkpoint()
+    assert store.update_row(1, {'id': 1, 'name': 'changed'})
+    if pages_written:
+        store.bm.flush()  # the page already holds both halves; redo must skip them both
+    store.bm.close(flush=False)
+    store.wal_manager.close()
+    reopened = RowStore('t', pk='id', base_path=str(tmp_path))
+    assert sorted((r['id'], r['name']) for r in reopened.get_rows()) == [(0, 'row0'), (1, 'changed'), (2, 'row2')]
+    assert reopened.get_row(1) == {'id': 1, 'name': 'changed'}
+
+
+def test_crash_during_an_update_keeps_the_old_row(tmp_path, monkeypatch):
+    from storage.row_store import RowStore
+    monkeypatch.chdir(tmp_path)
+    store = RowStore('t', pk='id', base_path=str(tmp_path))
+    store.bulk_insert_rows([{'id': i, 'name': f'row{i}'} for i in range(3)])
+    def crash(*args, **kwargs):
+        raise OSError("power cut")
+    monkeypatch.setattr(store, "_place_rows", crash)
+    with pytest.raises(OSError):
+        store.update_row(1, {'id': 1, 'name': 'changed'})
+    store.bm.close(flush=False)
+    store.wal_manager.close()
+    reopened = RowStore('t', pk='id', base_path=str(tmp_path))
+    assert reopened.get_row(1) == {'id': 1, 'name': 'row1'}
+
+
+def test_lazy_store_decodes_blocks_on_demand(tmp_path):
+    with patch('storage.row_store.WALManager', DummyWALManager):
+        from storage.row_store import RowStore
+        store = RowStore('lazy', pk='id', base_path=str(tmp_path))
+        store.bulk_insert_rows([{'id': i, 'name': f"row{i}" + "x" * 200} for i in range(100)])
+        store.bm.flush()
+        reopened = RowStore('lazy', pk='id', base_path=str(tmp_path), lazy=True, cache_bytes=20_000)
+        # Only metadata is read at startup
+        assert reopened.block_rows == {}
+        assert reopened.row_count() == 100
+        # The primary-key map is built by streaming blocks through the cache
+        assert reopened.get_row(57)['id'] == 57
+        assert 0 < reopened.cached_bytes <= 20_000
+        assert len(reopened.block_rows) < reopened.bm.num_blocks()
+        assert [r['id'] for r in reopened.get_rows()] == list(range(100))
+        assert reopened.delete_row(3)
+        reopened.insert_row({'id': 100, 'name': 'new'})
+        assert reopened.row_count() == 100
+        assert [r['id'] for r in reopened.get_rows()] == [i for i in range(101) if i != 3]
+
+def test_lazy_open_after_a_checkpoint_reads_no_pages(tmp_path, monkeypatch):
+    with patch('storage.row_store.WALManager', DummyWALManager):
+        from storage.row_store import RowStore
+        from storage.block_manager import BlockManager
+        store = RowStore('fsm', pk='id', base_path=str(tmp_path))
+        store.bulk_insert_rows([{'id': i, 'name': f"row{i}" + "x" * 200} for i in range(100)])
+        store.delete_row(5)
+        store.checkpoint()
+        reads = []
+        read_block = BlockManager.read_block
+        monkeypatch.setattr(BlockManager, 'read_block', lambda bm, n: reads.append(n) or read_block(bm, n))
+        reopened = RowStore('fsm', pk='id', base_path=str(tmp_path), lazy=True)
+        assert reads == []
+        assert reopened.row_count() == 99
+        assert reopened.block_free == store.block_free
+        assert [r['id'] for r in reopened.get_rows()] == [i for i in range(100) if i != 5]
+
+def test_lazy_open_redoes_pages_newer_than_the_free_space_map(tmp_path, monkeypatch):
+    from storage.row_store import RowStore
+    monkeypatch.chdir(tmp_path)
+    store = RowStore('stale', pk='id', base_path=str(tmp_path))
+    store.bulk_insert_rows([{'id': i, 'name': f'row{i}'} for i in range(3)])
+    store.checkpoint()
+    store.delete_row(1)
+    store.insert_row({'id': 3, 'name': 'row3'})
+    store.bm.close()  # the pages reach disk, the map still describes the checkpoint
+    store.wal_manager.close()
+    reopened = RowStore('stale', pk='id', base_path=str(tmp_path), lazy=True)
+    assert reopened.row_count() == 3
+    assert [r['id'] for r in reopened.get_rows()] == [0, 2, 3]
+
+def test_scan_streams_rows_and_tolerates_deletes():
+    with patch('storage.row_store.BlockManager', DummyBlockManager), \
+         patch('storage.row_store.WALManager', DummyWALManager):
+        from storage.row_store import RowStore
+        store = RowStore('test_table', pk='id', base_path='/tmp/')
+        store.bulk_insert_rows([{'id': i} for i in range(5)])
+        scan = store.scan()
+        assert next(scan) == {'id': 0}
+        store.delete_row(0)
+        assert [r['id'] for r in scan] == [1, 2, 3, 4]
+        assert [r['id'] for r in store.scan()] == [1, 2, 3, 4]
+
+def test_restart_redoes_only_changes_missing_from_pages(tmp_path, monkeypatch):
+    from storage.row_store import RowStore
+    monkeypatch.chdir(tmp_path)  # the WAL lives under data/wal
+    store = RowStore('crashy', pk='id', base_path=str(tmp_path))
+    store.bulk_insert_rows([{'id': i, 'name': f'row{i}'} for i in range(3)])
+    store.bm.flush()  # pages reach disk with their LSNs; the WAL still holds the records
+    store.delete_row(1)
+    store.insert_row({'id': 3, 'name': 'row3'})
+    store.bm.close(flush=False)  # crash: the last two changes never reach the pages
+    store.wal_manager.close()
+    reopened = RowStore('crashy', pk='id', base_path=str(tmp_path))
+    assert [r['id'] for r in reopened.get_rows()] == [0, 2, 3]
+    # Recovery ends with a checkpoint, so the next start has nothing to redo
+    assert reopened.wal_manager.wal_bytes < 64
+    reopened.wal_manager.close()
+    again = RowStore('crashy', pk='id', base_path=str(tmp_path))
+    assert [r['id'] for r in again.get_rows()] == [0, 2, 3]
+
+def test_legacy_json_wal_is_redone_once(tmp_path, monkeypatch):
+    from storage.row_store import RowStore
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "wal").mkdir(parents=True)
+    (tmp_path / "data" / "wal" / "old.wal").write_text('{"op": "INSERT", "row": {"id": 1}}\n'
+                                                       '{"op": "INSERT", "row": {"id": 2}}\n')
+    for _ in range(3):
+        store = RowStore('old', pk='id', base_path=str(tmp_path))
+        assert [r['id'] for r in store.get_rows()] == [1, 2]
+        store.bm.close()
+        store.wal_manager.close()
@@ -0,0 +1,147 @@
+import json
+from array import array
+
+import pytest
+import zstandard as zstd
+
+from storage.column_store import ColumnStore
+from storage.predicate import value_matches
+from storage.row_packer import TYPE_ANY, TYPE_BOOL, TYPE_FLOAT, TYPE_INT, TYPE_TEXT
+from storage.segment import (ENC_DELTA, ENC_DICT, ENC_FOR, ENC_PLAIN, ENC_RLE, SegmentReader, _with_nulls,
+                             column_type, decode_column, encode_column, match_column, sort_order,
+                             write_segment)
+
+ROWS = [
+    {"id": 1, "score": 1.5, "ok": True, "title": "Ünïcode", "meta": {"a": 1}},
+    {"id": 2, "score": None, "ok": False, "title": None, "meta": 3},
+    {"id": 3, "score": -2.0, "ok": None, "title": "", "meta": None},
+]
+
+
+def test_segment_roundtrip_keeps_types_and_nulls(tmp_path):
+    path = str(tmp_path / "seg_0.seg")
+    write_segment(path, ROWS)
+    reader = SegmentReader(path)
+    assert reader.row_count == 3
+    assert {name: col[0] for name, col in reader.columns.items()} == {
+        "id": TYPE_INT, "score": TYPE_FLOAT, "ok": TYPE_BOOL, "title": TYPE_TEXT, "meta": TYPE_ANY}
+    assert reader.rows() == ROWS
+
+
+def test_numeric_columns_decode_to_arrays(tmp_path):
+    path = str(tmp_path / "seg_0.seg")
+    write_segment(path, ROWS)
+    ids, nulls = SegmentReader(path).read_array("id")
+    assert ids == array("q", [1, 2, 3]) and nulls is None
+    scores, nulls = SegmentReader(path).read_array("score")
+    assert isinstance(scores, array) and nulls is not None
+    assert SegmentReader(path).read_column("score") == [1.5, None, -2.0]
+
+
+def test_column_store_reads_typed_and_json_segments(tmp_path):
+    # A table written before typed segments (and the manifest) existed
+    legacy = {"id": [3], "name": ["c"]}
+    (tmp_path / "t").mkdir()
+    with open(tmp_path / "t" / "seg_old.json.zst", "wb") as f:
+        f.write(zstd.ZstdCompressor().compress(json.dumps(legacy).encode("utf-8")))
+    store = ColumnStore("t", segment_path=str(tmp_path))
+    store.flush([{"id": 1, "name": "a"}, {"id": 2, "name": "b"}])
+    store.log_delete(2)
+    assert sorted(r["id"] for r in store.scan()) == [1, 3]
+    store.compact()
+    assert sorted(r["id"] for r in store.scan()) == [1, 3]
+    assert [reader.row_count for reader in store.scan_columns()] == [2]
+
+
+def test_projection_reads_only_requested_chunks(tmp_path):
+    path = str(tmp_path / "seg_0.seg")
+    write_segment(path, ROWS)
+    reader = SegmentReader(path)
+    # Corrupt the title chunk: reading other columns must not touch it
+    _, offset, length = reader.columns["title"]
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(b"\0" * length)
+    assert SegmentReader(path).read_columns(["id", "missing"]) == {"id": [1, 2, 3], "missing": [None] * 3}
+
+    store = ColumnStore("t", segment_path=str(tmp_path))
+    store.flush([{"id": 1, "name": "a", "age": 5}, {"id": 2, "name": "b", "age": 6}])
+    store.log_delete(1)
+    assert list(store.scan(["name"])) == [{"name": "b"}]
+
+
+def test_zone_maps_skip_segments_that_cannot_match(tmp_path):
+    store = ColumnStore("t", segment_path=str(tmp_path))
+    store.flush([{"id": i, "year": 1990 + i % 5, "title": f"t{i}"} for i in range(10)], "seg_0.seg")
+    store.flush([{"id": i, "year": 2000 + i % 5, "title": None} for i in range(10, 20)], "seg_1.seg")
+    reader = SegmentReader(str(tmp_path / "t" / "seg_1.seg"))
+    assert reader.stats["year"] == (0, 2000, 2004)
+    assert reader.stats["title"] == (10, None, None)
+    # Wreck seg_1's data chunks: a scan the zone maps rule it out of must never read them
+    _, offset, _ = reader.columns["id"]
+    with open(reader.path, "r+b") as f:
+        f.seek(offset)
+        f.write(b"\0" * (reader.columns["title"][1] + reader.columns["title"][2] - offset))
+    assert [r["id"] for r in store.scan(["id"], [("year", "=", 1992)])] == [2, 7]
+    assert [r["id"] for r in store.scan(["id"], [("year", "<", 1991)])] == [0, 5]
+    assert list(store.scan(where=[("title", "=", "t3")])) == [{"id": 3, "year": 1993, "title": "t3"}]
+
+
+@pytest.mark.parametrize("values, encoding", [
+    (["movie", "short", None, "movie", "tvSeries", "movie"] * 50, ENC_DICT),
+    ([False] * 200 + [True] * 100 + [None] * 5, ENC_RLE),
+    ([0.0] * 100 + [-0.0] * 100, ENC_RLE),
+    (list(range(1_000_000, 1_000_300)), ENC_DELTA),
+    ([1990 + i * 7 % 40 for i in range(300)], ENC_FOR),
+    ([1.5, 2.25, None], ENC_PLAIN),
+])
+def test_column_encodings_roundtrip(values, encoding):
+    type_code = column_type(values)
+    chunk = encode_column(type_code, values)
+    assert chunk[0] >> 1 == encoding
+    decoded = _with_nulls(*decode_column(type_code, chunk, len(values)), type_code)
+    assert [repr(v) for v in decoded] == [repr(v) for v in values]
+    pivot = next(v for v in values if v is not None)
+    assert match_column(type_code, chunk, len(values), "=", pivot) == [v == pivot and v is not None for v in values]
+
+
+def test_filters_run_on_encoded_chunks(tmp_path):
+    rows = [{"id": i, "titleType": ["movie", "short", "tvEpisode"][i % 3], "isAdult": i > 250} for i in range(300)]
+    path = str(tmp_path / "seg_0.seg")
+    write_segment(path, rows)
+    reader = SegmentReader(path)
+    assert reader.matching_rows([("titleType", "=", "short"), ("isAdult", "=", True)]) == \
+        [i for i in range(251, 300) if i % 3 == 1]
+    assert reader.read_columns(["id"], [4, 7]) == {"id": [4, 7]}
+    assert len(encode_column(TYPE_TEXT, [r["titleType"] for r in rows])) < 150
+
+
+def test_bloom_filter_footer(tmp_path):
+    path = str(tmp_path / "seg_0.seg")
+    write_segment(path, [{"id": i * 3, "v": "x"} for i in range(500)], bloom_columns=["id"])
+    reader = SegmentReader(path)
+    assert list(reader.blooms) == ["id"]
+    assert all(reader.blooms["id"].might_contain(i * 3) for i in range(500))
+    assert all(reader.may_match([("id", "=", float(i * 3))]) for i in range(0, 500, 50))
+    false_positives = sum(reader.blooms["id"].might_contain(i * 3 + 1) for i in range(500))
+    assert false_positives < 25
+
+
+def test_sorted_segments_binary_search_their_sort_column(tmp_path):
+    rows = [{"year": None if i % 50 == 0 else 1900 + i % 120, "title": f"t{i}"} for i in range(600)]
+    rows.sort(key=sort_order("year"))
+    path = str(tmp_path / "seg_0.seg")
+    write_segment(path, rows, sort_key="year")
+    reader = SegmentReader(path)
+    assert reader.sort_key == "year"
+
+    def expected(*preds):
+        return [i for i, row in enumerate(rows) if all(value_matches(row["year"], op, v) for op, v in preds)]
+    assert reader.matching_rows([("year", ">=", 1990), ("year", "<", 2000)]) == expected((">=", 1990), ("<", 2000))
+    assert reader.matching_rows([("year", "=", 1950)]) == expected(("=", 1950))
+    assert reader.matching_rows([("year", ">", 2000.5), ("year", "!=", 2010)]) == \
+        expected((">", 2000.5), ("!=", 2010))
+    assert reader.matching_rows([("year", "<=", 1900), ("title", "=", "t120")]) == \
+        [i for i in expected(("<=", 1900)) if rows[i]["title"] == "t120"]
+    assert reader.matching_rows([("year", "=", "1950")]) == []  # doesn't compare: falls back to the filter
+    assert reader._sorted_span([("title", "=", "t1")]) is None
@@ -0,0 +1,28 @@
+from storage.column_store import ColumnStore
+from storage.segment_cache import SegmentCache
+
+
+def test_repeated_scans_hit_the_cache(tmp_path):
+    cache = SegmentCache(capacity_bytes=1 << 20)
+    store = ColumnStore("t", segment_path=str(tmp_path), cache=cache)
+    store.flush([{"id": i, "kind": "a" if i % 2 else "b"} for i in range(100)])
+    assert len(list(store.scan())) == 100
+    assert cache.stats()["misses"] == 2 and cache.stats()["hits"] == 0
+    assert len(list(store.scan(["id"], [("kind", "=", "a")]))) == 50
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["hit_rate"] == 0.5
+    assert stats["cached_chunks"] == 2 and stats["cached_bytes"] > 0
+
+
+def test_compaction_invalidates_and_budget_evicts(tmp_path):
+    cache = SegmentCache(capacity_bytes=1 << 20)
+    store = ColumnStore("t", segment_path=str(tmp_path), cache=cache)
+    store.flush([{"id": i, "v": i * 3} for i in range(10)])
+    list(store.scan())
+    store.log_delete(4)
+    store.compact(full=True)
+    assert cache.stats()["cached_chunks"] == 0 and cache.invalidations == 2
+    assert 4 not in [r["id"] for r in store.scan()]
+
+    cache.resize(cache.cached_bytes - 1)
+    assert cache.stats()["cached_chunks"] == 1 and cache.evictions == 1
@@ -0,0 +1,189 @@
+import os
+import threading
+import time
+
+import pytest
+
+from jobs.queue import JobQueue
+from storage.manager import StorageManager
+from storage.tiering import TierLock, TieringPolicy
+
+
+def _crash_after_inserts(manager, table_name, n):
+    store = manager.get_row_store(table_name)
+    store.bulk_insert_rows([{"id": i} for i in range(n)])
+    # Crash: the WAL is durable but the pages never reach disk
+    store.bm.close(flush=False)
+    store.wal_manager.close()
+
+
+def test_recover_tables_in_parallel(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # WAL files live under data/wal
+    manager = StorageManager(base_path="data")
+    for name, n in (("a", 3), ("b", 5), ("c", 1)):
+        _crash_after_inserts(manager, name, n)
+    seen = []
+    restarted = StorageManager(base_path="data")
+    timings = restarted.recover_tables({name: {} for name in "abc"}, workers=3,
+                                       progress=lambda name, done, total, secs: seen.append((done, total)))
+    assert set(timings) == {"a", "b", "c"}
+    assert sorted(seen) == [(1, 3), (2, 3), (3, 3)]
+    assert [restarted.get_row_store(name).row_count() for name in "abc"] == [3, 5, 1]
+    # Already-open stores are not recovered again
+    assert restarted.recover_tables({"a": {}}) == {}
+
+
+def test_recover_tables_in_worker_processes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = StorageManager(base_path="data")
+    _crash_after_inserts(manager, "p", 4)
+    restarted = StorageManager(base_path="data")
+    timings = restarted.load_all_tables(workers=1, processes=True)
+    assert list(timings) == ["p"]
+    store = restarted.get_row_store("p")
+    assert [row["id"] for row in store.get_rows()] == [0, 1, 2, 3]
+    # The worker checkpointed after its redo, so the WAL is just the checkpoint record
+    assert os.path.getsize(store.wal_manager.wal_path) < 64
+
+
+def test_startup_recovery_uses_worker_processes_when_configured(tmp_path, monkeypatch):
+    from core.column import Column
+    from schema.schema import Schema
+    monkeypatch.chdir(tmp_path)
+    schema = Schema(schema_path="schema.json")
+    manager = StorageManager(base_path="data")
+    schema.create_table("p", [Column("id", "INT", ["PK"])], manager)
+    _crash_after_inserts(manager, "p", 4)
+    restarted = StorageManager(base_path="data", recovery_processes=True)
+    Schema(schema_path="schema.json").load_schema(restarted)
+    store = restarted.get_row_store("p")
+    assert [row["id"] for row in store.get_rows()] == [0, 1, 2, 3]
+    # Only a worker checkpoints after its redo
+    assert os.path.getsize(store.wal_manager.wal_path) < 64
+
+
+def test_tiering_policy_thresholds():
+    policy = TieringPolicy(max_rows=100, max_bytes=1 << 20, max_age=60)
+    assert policy.reason(0, 1 << 30, 1e9) is None
+    assert policy.reason(100, 0, 0) == "rows"
+    assert policy.reason(1, 1 << 20, 0) == "bytes"
+    assert policy.reason(1, 0, 60) == "age"
+    assert policy.reason(99, 1000, 59) is None
+    assert TieringPolicy(max_rows=None, max_bytes=None, max_age=None).reason(10**9, 1 << 40, 1e9) is None
+
+
+def test_tiering_needs_a_job_queue(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(ValueError):
+        StorageManager(base_path="data", tiering=TieringPolicy())
+
+
+def test_writes_past_the_threshold_queue_one_migration(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    jobs = JobQueue()  # not started: the test runs the queued job itself
+    manager = StorageManager(base_path="data", tiering=TieringPolicy(max_rows=50, max_bytes=None, max_age=None,
+                                                                     segment_rows=20), job_queue=jobs)
+    manager.bulk_write("t", [{"id": i} for i in range(40)])
+    assert jobs.q.empty()
+    manager.bulk_write("t", [{"id": i} for i in range(40, 60)])
+    manager.write_row("t", {"id": 60})
+    assert jobs.q.qsize() == 1  # already pending: not queued twice
+    _, _, job = jobs.q.get()
+    job.run()
+    col_store = manager.get_column_store("t")
+    assert [col_store.entries[os.path.basename(f)]["rows"] for f in col_store.current.files] == [20, 20, 20, 1]
+    assert manager.get_row_store("t").row_count() == 0
+    assert sorted(row["id"] for row in col_store.scan()) == list(range(61))
+    assert manager.check_tiering() == {}
+
+
+def test_migration_hands_off_rows_changed_while_it_ran(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = StorageManager(base_path="data")
+    manager.bulk_write("t", [{"id": i, "v": "old"} for i in range(10)])
+    row_store = manager.get_row_store("t")
+    col_store = manager.get_column_store("t")
+    write_segments = col_store.write_segments
+
+    def write_while_writing(rows, **kwargs):
+        # Writers carry on while the segments are written
+        row_store.update_row(3, {"id": 3, "v": "new"})
+        row_store.delete_row(4)
+        manager.write_row("t", {"id": 10, "v": "old"})
+        return write_segments(rows, **kwargs)
+    monkeypatch.setattr(col_store, "write_segments", write_while_writing)
+
+    assert manager.migrate_table("t") == 8
+    assert {row["id"]: row["v"] for row in row_store.scan()} == {3: "new", 10: "old"}
+    assert sorted(row["id"] for row in col_store.scan()) == [0, 1, 2, 5, 6, 7, 8, 9]
+    assert col_store.migration is None
+
+
+def test_a_crash_mid_handoff_is_finished_on_open(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = StorageManager(base_path="data")
+    manager.bulk_write("t", [{"id": i} for i in range(5)])
+    row_store = manager.get_row_store("t")
+    row_store.delete_row(2)
+    col_store = manager.get_column_store("t")
+    batch = row_store.get_rows_with_ids()
+    written = col_store.write_segments([row for _, row in batch])
+    # Crash right after the manifest commit: the row store still has every moved row
+    col_store.commit_migration([path for path, _ in written], [(row_id, row["id"]) for row_id, row in batch], {})
+    row_store.bm.close()
+    row_store.wal_manager.close()
+    col_store.close()
+
+    restarted = StorageManager(base_path="data")
+    assert restarted.get_row_store("t").row_count() == 0
+    assert restarted.get_column_store("t").migration is None
+    assert sorted(row["id"] for row in restarted.get_column_store("t").scan()) == [0, 1, 3, 4]
+
+
+def test_concurrent_first_use_opens_one_store_per_table(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import storage.manager
+    class SlowColumnStore(storage.manager.ColumnStore):
+        def __init__(self, *args, **kwargs):
+            time.sleep(0.02)  # widen the window between the check and the insert
+            super().__init__(*args, **kwargs)
+    monkeypatch.setattr(storage.manager, "ColumnStore", SlowColumnStore)
+    manager = StorageManager(base_path="data")
+    stores, errors = [], []
+    def open_store():
+        try:
+            stores.append(manager.get_column_store("t"))
+        except Exception as exc:
+            errors.append(exc)
+    threads = [threading.Thread(target=open_store) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(stores) == 8 and all(store is stores[0] for store in stores)
+
+
+def test_two_tier_scans_hold_off_the_handoff():
+    lock = TierLock()
+    order = []
+    with lock.reading():
+        def hand_off():
+            with lock.handing_off():
+                order.append("handoff")
+        handoff = threading.Thread(target=hand_off)
+        handoff.start()
+        with lock.reading():  # nested scan on the same thread doesn't wait behind the handoff
+            order.append("scan")
+        handoff.join(0.05)
+        assert order == ["scan"]
+    handoff.join()
+    assert order == ["scan", "handoff"]
+
+
+def test_row_store_files_stay_next_to_the_wal(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = StorageManager(base_path="data")
+    manager.bulk_write("t", [{"id": 1}])
+    assert os.path.exists(os.path.join("data", "wal", "t.tbl"))
+    assert not os.path.exists(os.path.join("data", "t.tbl"))
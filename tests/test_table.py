@@ -45,8 +45,9 @@ def patch_bplustree():
 def mock_storage():
     storage = MagicMock()
     # Default for get_row_store/get_column_store
-    storage.get_row_store.return_value.get_rows.return_value = []
-    storage.get_column_store.return_value.load_segments.return_value = []
+    storage.get_row_store.return_value.scan.return_value = []
+    storage.get_column_store.return_value.scan.return_value = []
+    storage.get_column_store.return_value.max_value.return_value = None
     storage.write_row = MagicMock()
     storage.bulk_write = MagicMock()
     storage.flush_table = MagicMock()
@@ -67,10 +68,23 @@ def test_init_sets_pk_and_auto_increment(mock_storage):
     assert t.pk_column is col
     assert t.auto_increment_col is col
 
+def test_load_next_increment_counts_migrated_rows(tmp_path, monkeypatch):
+    from storage.manager import StorageManager
+    monkeypatch.chdir(tmp_path)
+    col = DummyColumn('id', constraints=['PK'], auto_increment=True)
+    storage = StorageManager(base_path="data")
+    t = Table('t', storage, columns=[col, DummyColumn('val')])
+    for i in range(5):
+        t.insert({'val': i})
+    storage.migrate_table('t')
+    storage.close()
+    restarted = Table('t', StorageManager(base_path="data"), columns=[col, DummyColumn('val')])
+    assert restarted.next_increment == 6
+
 def test_load_next_increment_with_rows(mock_storage):
     col = DummyColumn('id', constraints=['PK'], auto_increment=True)
     # Simulate existing rows with id values
-    mock_storage.get_row_store.return_value.get_rows.return_value = [{'id': 1}, {'id': 5}, {'id': 3}]
+    mock_storage.get_row_store.return_value.scan.return_value = [{'id': 1}, {'id': 5}, {'id': 3}]
     t = Table('t', mock_storage, columns=[col])
     assert t.next_increment == 6
 
@@ -136,9 +150,9 @@ def test_flush_calls_storage(table):
     table.storage.flush_table.assert_called_with('test_table')
 
 def test_select_all_merges_oltp_olap(table):
-    table.storage.get_row_store.return_value.get_rows.return_value = [{'id': 1}]
-    table.storage.get_column_store.return_value.load_segments.return_value = [{'id': 2}]
-    result = table.select_all()
+    table.storage.get_row_store.return_value.scan.return_value = [{'id': 1}]
+    table.storage.get_column_store.return_value.scan.return_value = [{'id': 2}]
+    result = list(table.select_all())
     assert {'id': 1} in result and {'id': 2} in result
 
 def test_to_dict_and_from_dict(mock_storage):
@@ -170,3 +184,45 @@ def test_bulk_insert_assigns_auto_increment_multiple(table):
 def test_repr(table):
     s = repr(table)
     assert f"<Table {table.name}" in s
+
+def test_delete_rows_without_a_primary_key(tmp_path, monkeypatch):
+    from storage.manager import StorageManager
+    monkeypatch.chdir(tmp_path)
+    table = Table("nopk", StorageManager(base_path="data"), columns=[DummyColumn("name", dtype="str")])
+    table.bulk_insert([{"name": "a"}, {"name": "b"}, {"name": "a"}])
+    assert table.delete_rows("name", "a") == 2
+    assert [row["name"] for row in table.select_all()] == ["b"]
+
+def test_delete_rows_reaches_migrated_rows(tmp_path, monkeypatch):
+    from storage.manager import StorageManager
+    monkeypatch.chdir(tmp_path)
+    storage = StorageManager(base_path="data")
+    table = Table("t", storage, columns=[DummyColumn("id", constraints=["PK"]), DummyColumn("name", dtype="str")])
+    table.bulk_insert([{"id": i, "name": "a" if i % 2 else "b"} for i in range(6)])
+    storage.migrate_table("t")
+    assert table.delete_rows("id", "3") == 1
+    assert table.delete_rows("name", "b") == 3
+    assert [row["id"] for row in table.select_all()] == [1, 5]
+
+def test_index_files_from_before_the_page_header_are_rebuilt(tmp_path, monkeypatch):
+    import os
+    import pickle
+    from indexing.bplustree import BplusTree
+    from storage.block_manager import BLOCK_SIZE
+    from storage.manager import StorageManager
+    monkeypatch.chdir(tmp_path)
+    columns = [DummyColumn("id", constraints=["PK"]), DummyColumn("name", dtype="str")]
+    storage = StorageManager(base_path="data")
+    storage.bulk_write("t", [{"id": i, "name": str(i)} for i in range(5)])
+    # The old layout: pickled nodes at hashed block numbers, the root id in a .meta file
+    os.makedirs("data/indexes", exist_ok=True)
+    with open("data/indexes/t_id.idx", "wb") as f:
+        f.write(bytes(BLOCK_SIZE) + pickle.dumps({"keys": [0, 1], "node_id": "ab"}))
+    with open("data/indexes/t_id.idx.meta", "w") as f:
+        f.write("ab")
+    with patch("core.table.BplusTree", BplusTree):
+        table = Table("t", storage, columns=columns)
+        assert [key for key, _ in table.indexes["id"].scan()] == [0, 1, 2, 3, 4]
+        assert not os.path.exists("data/indexes/t_id.idx.meta")
+        # Reopening reads the converted file as it is
+        assert Table("t", storage, columns=columns).indexes["id"].search(4) is not None
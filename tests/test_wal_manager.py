@@ -0,0 +1,143 @@
+import threading
+import time
+
+import pytest
+
+from transaction.wal_manager import WALManager
+
+
+def replayed(wal):
+    rows, deletes = [], []
+    wal.replay(lambda row, *_: rows.append(row), lambda key, *_: deletes.append(key))
+    return rows, deletes
+
+
+def test_replay_inserts_and_deletes(tmp_path):
+    wal = WALManager("t", base_path=str(tmp_path), durability="sync")
+    wal.log_insert({"id": 1})
+    wal.log_insert_many([{"id": 2}, {"id": 3}])
+    wal.log_delete(2)
+    assert replayed(wal) == ([{"id": 1}, {"id": 2}, {"id": 3}], [2])
+    # Each sync commit is its own fsync
+    assert wal.fsyncs == 3
+    wal.clear()
+    assert replayed(WALManager("t", base_path=str(tmp_path))) == ([], [])
+
+
+def test_unknown_durability_mode_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        WALManager("t", base_path=str(tmp_path), durability="sometimes")
+
+
+def test_group_commit_batches_concurrent_writers(tmp_path, monkeypatch):
+    wal = WALManager("t", base_path=str(tmp_path), durability="group")
+    real_write = wal._write
+    gate = threading.Event()
+    def slow_write(batch):
+        gate.wait(1)  # hold the first fsync open so the other writers queue up behind it
+        real_write(batch)
+    monkeypatch.setattr(wal, "_write", slow_write)
+    threads = [threading.Thread(target=wal.log_insert, args=({"id": i},)) for i in range(20)]
+    for t in threads:
+        t.start()
+    gate.set()
+    for t in threads:
+        t.join()
+    assert wal.durable_lsn == wal.lsn == 21  # one layout record, then the rows
+    assert wal.fsyncs < 20
+    assert sorted(r["id"] for r in replayed(wal)[0]) == list(range(20))
+
+
+def test_a_failed_write_stops_the_log(tmp_path, monkeypatch):
+    wal = WALManager("t", base_path=str(tmp_path), durability="group")
+    wal.log_insert({"id": 1})
+    def full_disk(batch):
+        raise OSError("no space left on device")
+    monkeypatch.setattr(wal, "_write", full_disk)
+    with pytest.raises(OSError):
+        wal.log_insert({"id": 2})
+    monkeypatch.undo()
+    # A later flush must not report the lost record as durable
+    with pytest.raises(RuntimeError):
+        wal.flush()
+    with pytest.raises(RuntimeError):
+        wal.log_insert({"id": 3})
+    assert wal.durable_lsn == 2  # the layout record and the first row
+    wal.close()
+    assert replayed(WALManager("t", base_path=str(tmp_path)))[0] == [{"id": 1}]
+
+
+def test_async_commits_are_flushed_in_background(tmp_path):
+    wal = WALManager("t", base_path=str(tmp_path), durability="async", async_interval=0.01)
+    for i in range(5):
+        wal.log_insert({"id": i})
+    # Commits return before their fsync; the flusher catches up within a few intervals
+    deadline = time.time() + 1
+    while wal.durable_lsn < wal.lsn and time.time() < deadline:
+        time.sleep(0.01)
+    assert wal.durable_lsn == wal.lsn
+    wal.close()
+    assert len(replayed(wal)[0]) == 5
+
+
+def test_async_flusher_restarts_register_one_exit_hook(tmp_path, monkeypatch):
+    hooks = []
+    monkeypatch.setattr("transaction.wal_manager.atexit.register", hooks.append)
+    monkeypatch.setattr("transaction.wal_manager.atexit.unregister", hooks.remove)
+    wal = WALManager("t", base_path=str(tmp_path), durability="async", async_interval=0.01)
+    for i in range(3):
+        wal.log_insert({"id": i})
+        wal._closed.set()  # the flusher stops, the next commit starts a new one
+        wal._flusher.join()
+    wal.log_insert({"id": 3})
+    assert hooks == [wal.close]
+    wal.close()
+    assert hooks == []
+
+
+def test_records_carry_increasing_lsns(tmp_path):
+    from transaction.wal_manager import _frames, REC_INSERT, REC_LAYOUT
+    wal = WALManager("t", base_path=str(tmp_path))
+    wal.log_insert({"id": 1, "name": "a"})
+    wal.log_insert({"id": 2, "name": "b"})
+    wal.log_insert({"id": 3, "extra": True})
+    wal.close()
+    with open(wal.wal_path, "rb") as f:
+        frames = list(_frames(f.read()))
+    assert [lsn for lsn, _, _, _ in frames] == [1, 2, 3, 4, 5]
+    # The layout is only logged again when a row brings a new column
+    assert [t for _, t, _, _ in frames] == [REC_LAYOUT, REC_INSERT, REC_INSERT, REC_LAYOUT, REC_INSERT]
+    reopened = WALManager("t", base_path=str(tmp_path))
+    reopened.log_delete(1)
+    assert reopened.lsn == 6
+
+
+def test_replay_stops_at_torn_or_corrupt_record(tmp_path):
+    wal = WALManager("t", base_path=str(tmp_path))
+    for i in range(3):
+        wal.log_insert({"id": i})
+    wal.close()
+    with open(wal.wal_path, "ab") as f:
+        f.write(b"\x00\x00\x00\x10garbage")
+    assert replayed(WALManager("t", base_path=str(tmp_path)))[0] == [{"id": 0}, {"id": 1}, {"id": 2}]
+    # Appending after a torn tail cuts it off first, so new records stay reachable
+    wal = WALManager("t", base_path=str(tmp_path))
+    wal.log_insert({"id": 3})
+    assert [r["id"] for r in replayed(wal)[0]] == [0, 1, 2, 3]
+    # A flipped payload byte fails the CRC
+    with open(wal.wal_path, "r+b") as f:
+        data = bytearray(f.read())
+        data[-1] ^= 0xFF
+        f.seek(0)
+        f.write(data)
+    assert [r["id"] for r in replayed(WALManager("t", base_path=str(tmp_path)))[0]] == [0, 1, 2]
+
+
+def test_json_lines_wal_is_replayed_and_converted(tmp_path):
+    path = tmp_path / "t.wal"
+    path.write_text('{"op": "INSERT", "row": {"id": 1}}\n{"op": "DELETE", "key": 1}\n{"op": "INS')
+    wal = WALManager("t", base_path=str(tmp_path))
+    assert replayed(wal) == ([{"id": 1}], [1])
+    wal.log_insert({"id": 2})
+    assert path.read_bytes()[:1] != b"{"
+    assert replayed(wal) == ([{"id": 1}, {"id": 2}], [1])
@@ -1,44 +1,367 @@
+import atexit
 import os
 import json
+import struct
+import threading
+import zlib
+
+from storage.row_packer import RowCodec, TYPE_ANY
+
+DURABILITY_SYNC = "sync"    # every commit writes and fsyncs on its own
+DURABILITY_GROUP = "group"  # concurrent commits share one fsync; each waits until its record is durable
+DURABILITY_ASYNC = "async"  # commits return at once; a background flush bounds the loss window
+DURABILITY_MODES = (DURABILITY_SYNC, DURABILITY_GROUP, DURABILITY_ASYNC)
+
+DEFAULT_ASYNC_INTERVAL = 0.05      # seconds of commits an async WAL may lose on a crash
+DEFAULT_ASYNC_MAX_PENDING = 1 << 20  # bytes buffered before an async commit flushes inline
+
+# Record frame: payload length, CRC32 of (lsn, type, payload), LSN, record type; then the payload
+RECORD = struct.Struct(">IIQB")
+_LSN_TYPE = struct.Struct(">QB")
+REC_LAYOUT = 1      # column layout (RowCodec.layout_bytes) used by the INSERT records after it
+REC_INSERT = 2      # row id, then one row encoded with the current layout
+REC_DELETE = 3      # row id, then the primary key encoded as a one-column row
+REC_CHECKPOINT = 4  # redo LSN: every change up to it is in the data pages
+REC_UPDATE = 5      # old row id, new row id, the old primary key (as in DELETE), then the new row (as in INSERT)
+_KEY_CODEC = RowCodec([("key", TYPE_ANY)])
+# (block, slot) the record's row lives at; NO_BLOCK when the writer didn't say
+ROW_ID = struct.Struct(">IH")
+NO_BLOCK = 0xFFFFFFFF
+_REDO_LSN = struct.Struct(">Q")
+
 
 class WALManager:
-    def __init__(self, table_name, base_path="data/wal"):
+    """
+    Append-only log of row operations written through a persistent handle. Records are
+    binary frames (see RECORD) whose rows use the heap's encoding with all-TYPE_ANY
+    columns; the layout is logged once per change rather than once per row.
+    The durability mode decides when a commit returns; see DURABILITY_*.
+    """
+    def __init__(self, table_name, base_path="data/wal", durability=DURABILITY_GROUP,
+                 async_interval=DEFAULT_ASYNC_INTERVAL):
         self.table_name = table_name
         self.wal_path = os.path.join(base_path, f"{table_name}.wal")
         os.makedirs(base_path, exist_ok=True)
+        self.set_durability(durability)
+        self.async_interval = async_interval
+        self.cond = threading.Condition()
+        self.file = None
+        self.lsn = 0           # LSN of the last record framed
+        self.durable_lsn = 0   # every record up to here is written and fsynced
+        self.codec = None      # layout of the last REC_LAYOUT written; None forces a new one
+        self.pending = []      # encoded records not yet written
+        self.pending_bytes = 0
+        self.wal_bytes = 0     # size of the log since the last checkpoint
+        self.flushing = False  # a writer (group leader or async flusher) is doing the fsync
+        self.fsyncs = 0
+        self.failed = None     # error from a write or fsync; the log takes no more commits after it
+        self._flusher = None
+        self._closed = threading.Event()
+        self._exit_hook = False  # close registered with atexit while an async flusher may hold records
+
+    def set_durability(self, durability):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode '{durability}', expected one of {DURABILITY_MODES}")
+        self.durability = durability
+
+    def _frame(self, rec_type, payload, lsn=None):
+        if lsn is None:
+            self.lsn += 1
+            lsn = self.lsn
+        body = _LSN_TYPE.pack(lsn, rec_type)
+        return RECORD.pack(len(payload), zlib.crc32(payload, zlib.crc32(body)), lsn, rec_type) + payload
+
+    def _encode_inserts(self, rows, row_ids):
+        records = []
+        if self.codec is None or not all(self.codec.covers(row) for row in rows):
+            self.codec = RowCodec.for_rows(rows, base=self.codec)
+            records.append(self._frame(REC_LAYOUT, self.codec.layout_bytes()))
+        for row, row_id in zip(rows, row_ids):
+            records.append(self._frame(REC_INSERT, ROW_ID.pack(*(row_id or (NO_BLOCK, 0))) + self.codec.encode(row)))
+        return records
+
+    def _encode_update(self, key, old_row_id, row, new_row_id):
+        records = []
+        if self.codec is None or not self.codec.covers(row):
+            self.codec = RowCodec.for_rows([row], base=self.codec)
+            records.append(self._frame(REC_LAYOUT, self.codec.layout_bytes()))
+        payload = (ROW_ID.pack(*old_row_id) + ROW_ID.pack(*new_row_id) + _KEY_CODEC.encode({"key": key})
+                   + self.codec.encode(row))
+        records.append(self._frame(REC_UPDATE, payload))
+        return records
+
+    def _encode_delete(self, key, row_id):
+        return [self._frame(REC_DELETE, ROW_ID.pack(*(row_id or (NO_BLOCK, 0))) + _KEY_CODEC.encode({"key": key}))]
+
+    def _check_failed(self):
+        if self.failed is not None:
+            raise RuntimeError(f"WAL {self.wal_path} stopped after a failed write") from self.failed
+
+    def _commit(self, encode, *args, wait=True):
+        with self.cond:
+            self._check_failed()
+            if self.file is None:
+                self._open_locked()
+            # LSNs are handed out under the lock so they follow file order
+            records = encode(*args)
+            self.pending.extend(records)
+            added = sum(len(r) for r in records)
+            self.pending_bytes += added
+            self.wal_bytes += added
+            if self.durability == DURABILITY_ASYNC:
+                self._start_flusher()
+                if self.pending_bytes >= DEFAULT_ASYNC_MAX_PENDING:
+                    self._flush_locked(self.lsn)
+            elif wait:
+                self._flush_locked(self.lsn)
+            return self.lsn
+
+    def commit(self, lsn):
+        """Wait until the record at lsn is durable (returns at once in async mode)."""
+        if self.durability != DURABILITY_ASYNC:
+            with self.cond:
+                self._flush_locked(lsn)
+
+    def _flush_locked(self, target):
+        """Make every record up to target durable. Caller holds self.cond."""
+        while self.durable_lsn < target:
+            # Records after a failed write may or may not be on disk, so none of them are acknowledged
+            self._check_failed()
+            if self.flushing:
+                # Someone else's fsync is in flight; our record rides along with the next batch
+                self.cond.wait()
+                continue
+            self.flushing = True
+            batch, self.pending, self.pending_bytes = self.pending, [], 0
+            upto = self.lsn
+            self.cond.release()
+            error = None
+            try:
+                self._write(batch)
+            except BaseException as exc:
+                error = exc
+                raise
+            finally:
+                self.cond.acquire()
+                self.flushing = False
+                self.failed = error
+                self.cond.notify_all()
+            self.durable_lsn = upto
+
+    def open(self):
+        """Open the log if it isn't yet, so lsn reflects it (a JSON-lines log gets its LSNs here)."""
+        with self.cond:
+            if self.file is None:
+                self._open_locked()
+
+    def _open_locked(self):
+        """Open the log for appending: cut any torn tail, pick up the last LSN, convert a JSON-lines log."""
+        data = b""
+        if os.path.exists(self.wal_path):
+            with open(self.wal_path, "rb") as f:
+                data = f.read()
+        if data[:1] == b"{":
+            self.codec = None
+            records = []
+            for op, value in _json_entries(data):
+                if op == REC_INSERT:
+                    records.extend(self._encode_inserts([value], [None]))
+                else:
+                    records.extend(self._encode_delete(value, None))
+            data = b"".join(records)
+            self._rewrite(data)
+        else:
+            end = 0
+            for lsn, _, _, end in _frames(data):
+                self.lsn = max(self.lsn, lsn)
+            if end < len(data):
+                with open(self.wal_path, "r+b") as f:
+                    f.truncate(end)
+                data = data[:end]
+        self.durable_lsn = self.lsn
+        self.wal_bytes = len(data)
+        self.codec = None
+        self.file = open(self.wal_path, "ab")
+
+    def _rewrite(self, data):
+        """Atomically replace the log file with data."""
+        tmp_path = self.wal_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.wal_path)
+
+    def _write(self, batch):
+        if self.file is None:
+            return  # closed without flushing
+        if batch:
+            self.file.write(b"".join(batch))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.fsyncs += 1
+
+    def _start_flusher(self):
+        if self._flusher is None or not self._flusher.is_alive():
+            self._closed.clear()
+            self._flusher = threading.Thread(target=self._flush_loop, name=f"wal-{self.table_name}", daemon=True)
+            self._flusher.start()
+            if not self._exit_hook:
+                atexit.register(self.close)
+                self._exit_hook = True
 
-    def log_insert(self, row):
-        entry = {"op": "INSERT", "row": row}
-        with open(self.wal_path, "a") as f:
-            f.write(json.dumps(entry) + "\n")
-    
-    def log_insert_many(self, rows):
+    def _flush_loop(self):
+        while not self._closed.wait(self.async_interval):
+            try:
+                self.flush()
+            except Exception:
+                return  # the write failed (kept in self.failed); commits raise from here on
+
+    def flush(self):
+        """Write and fsync everything logged so far, whatever the durability mode."""
+        with self.cond:
+            self._flush_locked(self.lsn)
+
+    def log_insert(self, row, row_id=None, wait=True):
+        """Log an insert; returns its LSN. With wait=False call commit(lsn) once the batch is logged."""
+        return self._commit(self._encode_inserts, [row], [row_id], wait=wait)
+
+    def log_insert_many(self, rows, row_ids=None, wait=True):
         """
         Batch log a list of rows as INSERTs in a single file write.
         """
-        with open(self.wal_path, "a") as f:
-            for row in rows:
-                entry = {"op": "INSERT", "row": row}
-                f.write(json.dumps(entry) + "\n")
-
-    def log_delete(self, key):
-        entry = {"op": "DELETE", "key": key}
-        with open(self.wal_path, "a") as f:
-            f.write(json.dumps(entry) + "\n")
-
-    def replay(self, apply_fn,delete_fn):
-        """Replay WAL and call apply_fn(row) for each INSERT row."""
+        return self._commit(self._encode_inserts, rows, row_ids or [None] * len(rows), wait=wait)
+
+    def log_delete(self, key, row_id=None, wait=True):
+        return self._commit(self._encode_delete, key, row_id, wait=wait)
+
+    def log_update(self, key, old_row_id, row, new_row_id, wait=True):
+        """Log replacing the row at old_row_id (primary key key) with row at new_row_id, as one record."""
+        return self._commit(self._encode_update, key, old_row_id, row, new_row_id, wait=wait)
+
+    def replay(self, apply_fn, delete_fn, update_fn=None):
+        """
+        Replay WAL and call apply_fn(row, lsn, row_id) for each INSERT row, delete_fn(key, lsn, row_id)
+        for each DELETE and update_fn(key, row, lsn, old_row_id, new_row_id) for each UPDATE (without
+        update_fn, a delete then an insert). Records covered by a checkpoint are skipped; row_id is
+        None when the writer didn't log one. Stops at the first torn or corrupt record.
+        """
+        self.flush()
         if not os.path.exists(self.wal_path):
             return
-        with open(self.wal_path, "r") as f:
-            for line in f:
-                entry = json.loads(line.strip())
-                if entry["op"] == "INSERT":
-                    apply_fn(entry["row"])
-                if entry["op"] == "INSERT":
-                    delete_fn(entry["row"])
-                
+        with open(self.wal_path, "rb") as f:
+            data = f.read()
+        if data[:1] == b"{":
+            for op, value in _json_entries(data):
+                if op == REC_INSERT:
+                    apply_fn(value)
+                else:
+                    delete_fn(value)
+            return
+        codec = None
+        redo_lsn = 0
+        for lsn, rec_type, payload, _ in _frames(data):
+            self.lsn = max(self.lsn, lsn)
+            if rec_type == REC_LAYOUT:
+                codec = RowCodec.from_layout_bytes(payload)[0]
+            elif rec_type == REC_CHECKPOINT:
+                redo_lsn = max(redo_lsn, _REDO_LSN.unpack_from(payload)[0])
+            elif (rec_type not in (REC_INSERT, REC_DELETE, REC_UPDATE)
+                  or (rec_type != REC_DELETE and codec is None)):
+                return
+            elif lsn > redo_lsn:
+                block, slot = ROW_ID.unpack_from(payload)
+                row_id = None if block == NO_BLOCK else (block, slot)
+                if rec_type == REC_UPDATE:
+                    new_row_id = ROW_ID.unpack_from(payload, ROW_ID.size)
+                    key, offset = _KEY_CODEC.decode(payload, 2 * ROW_ID.size)
+                    row = codec.decode(payload, offset)[0]
+                    if update_fn is None:
+                        delete_fn(key["key"], lsn, row_id)
+                        apply_fn(row, lsn, new_row_id)
+                    else:
+                        update_fn(key["key"], row, lsn, row_id, new_row_id)
+                elif rec_type == REC_INSERT:
+                    apply_fn(codec.decode(payload, ROW_ID.size)[0], lsn, row_id)
+                else:
+                    delete_fn(_KEY_CODEC.decode(payload, ROW_ID.size)[0]["key"], lsn, row_id)
+
+    def checkpoint(self, redo_lsn):
+        """
+        Record that every change up to redo_lsn is in the data pages and recycle the log:
+        it is rewritten as the checkpoint record plus whatever was logged after redo_lsn.
+        """
+        with self.cond:
+            if self.file is None:
+                self._open_locked()
+            self._flush_locked(self.lsn)
+            with open(self.wal_path, "rb") as f:
+                data = f.read()
+            layout, keep_from = None, len(data)
+            for lsn, rec_type, payload, end in _frames(data):
+                if lsn > redo_lsn:
+                    keep_from = end - RECORD.size - len(payload)
+                    break
+                if rec_type == REC_LAYOUT:
+                    layout = bytes(payload)
+            out = [self._frame(REC_CHECKPOINT, _REDO_LSN.pack(redo_lsn), lsn=redo_lsn)]
+            if keep_from < len(data):
+                if layout is not None:
+                    out.append(self._frame(REC_LAYOUT, layout, lsn=redo_lsn))
+                out.append(data[keep_from:])
+            else:
+                self.codec = None
+            data = b"".join(out)
+            self.file.close()
+            self._rewrite(data)
+            self.file = open(self.wal_path, "ab")
+            self.wal_bytes = len(data)
 
     def clear(self):
         """Truncate WAL after successful block flush."""
-        open(self.wal_path, "w").close()
+        self.checkpoint(self.lsn)
+
+    def close(self, flush=True):
+        """Stop the async flusher and release the handle. With flush=False pending records are dropped."""
+        self._closed.set()
+        if self._exit_hook:
+            atexit.unregister(self.close)
+            self._exit_hook = False
+        with self.cond:
+            if flush and self.failed is None:
+                self._flush_locked(self.lsn)
+            else:
+                self.pending, self.pending_bytes = [], 0
+                self.durable_lsn = self.lsn
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def _frames(data):
+    """Yield (lsn, type, payload, end offset) for each intact record, stopping at the first bad one."""
+    view = memoryview(data)
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        length, crc, lsn, rec_type = RECORD.unpack_from(data, offset)
+        end = offset + RECORD.size + length
+        if end > len(data):
+            return
+        payload = view[offset + RECORD.size:end]
+        if zlib.crc32(payload, zlib.crc32(_LSN_TYPE.pack(lsn, rec_type))) != crc:
+            return
+        yield lsn, rec_type, payload, end
+        offset = end
+
+
+def _json_entries(data):
+    """(REC_INSERT, row) / (REC_DELETE, key) from a JSON-lines WAL written before the binary format."""
+    for line in data.split(b"\n"):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return  # torn tail
+        if entry["op"] == "INSERT":
+            yield REC_INSERT, entry["row"]
+        elif entry["op"] == "DELETE":
+            yield REC_DELETE, entry["key"]